@@ -37,11 +37,23 @@ class AddServerWindow(QDialog):
         # Create input fields
         self.name_input = QLineEdit(self)
         self.ip_input = QLineEdit(self)
+        # optional http health check, left empty the server is pinged instead
+        self.http_path_input = QLineEdit(self)
+        self.http_path_input.setPlaceholderText("/health")
+        self.http_status_input = QLineEdit(self)
+        self.http_status_input.setPlaceholderText("200")
+        self.http_body_input = QLineEdit(self)
+        # optional server this one is reached through, e.g. its regional gateway
+        self.depends_on_input = QLineEdit(self)
 
         # Form layout for labels and input fields
         form_layout = QFormLayout()
         form_layout.addRow("Name:", self.name_input)
         form_layout.addRow("IP Address:", self.ip_input)
+        form_layout.addRow("HTTP Path (optional):", self.http_path_input)
+        form_layout.addRow("Expected Status:", self.http_status_input)
+        form_layout.addRow("Body Contains:", self.http_body_input)
+        form_layout.addRow("Depends On (optional):", self.depends_on_input)
 
         # Add button
         self.add_button = QPushButton("Add", self)
@@ -58,20 +70,40 @@ class AddServerWindow(QDialog):
         """
         name = self.name_input.text().strip()
         ip = self.ip_input.text().strip()
+        http_path = self.http_path_input.text().strip()
+        http_status = self.http_status_input.text().strip()
+        http_body = self.http_body_input.text().strip()
+        depends_on = self.depends_on_input.text().strip().lower()
+
+        http = None
+        if (http_status or http_body) and not http_path:
+            show_error_popup(message="Expected status and body only apply to an HTTP check, please enter its path")
+            return
+        if http_path:
+            if http_status and not http_status.isdigit():
+                show_error_popup(message="Expected status must be a number, e.g. 200")
+                return
+            http = {"path": http_path, "expected_status": int(http_status) if http_status else 200}
+            if http_body:
+                http["body_contains"] = http_body
 
         if name and ip:
-            self.save_to_json(name, ip)
+            self.save_to_json(name, ip, http, depends_on or None)
             self.accept()
         else:
             print("Error: Both fields must be filled!")
 
-    def save_to_json(self, name:str, ip:str) -> None:
+    def save_to_json(self, name:str, ip:str, http:dict=None, depends_on:str=None) -> None:
         """saves data entered by user into a json file
 
         :param name: name of server
         :type name: string
         :param ip: ip address of server
         :type ip: string
+        :param http: optional http health check settings (path, expected_status, body_contains)
+        :type http: dict, optional
+        :param depends_on: name of the server this one is reached through, defaults to None
+        :type depends_on: str, optional
         """
         
         data = {}
@@ -91,6 +123,10 @@ class AddServerWindow(QDialog):
         # Append new entry
         if name.lower() not in data:
             data[name.lower()] = {"ip": ip}
+            if http:
+                data[name.lower()]["http"] = http
+            if depends_on:
+                data[name.lower()]["depends_on"] = depends_on
         else:
             show_error_popup(message="A server by that name already exists, please enter with a different name")
 
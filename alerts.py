@@ -0,0 +1,406 @@
+"""Alerting on server state transitions.
+
+Transitions are collected for a short window, deduplicated per server and grouped, so an area outage sends one
+"12 servers down in group DJ" alert instead of twelve. Every channel delivers on its own thread with its own rate
+limit and retries, a slow or broken sink never holds up probing or the other channels.
+
+Channels are configured in alerts.json next to servers.json, without it alerting is off:
+
+    {
+        "window": 30,
+        "channels": [
+            {"type": "smtp", "host": "localhost", "port": 25, "from": "panel@example.org", "to": ["ops@example.org"]},
+            {"type": "webhook", "url": "http://localhost:8080/alerts"},
+            {"type": "command", "command": ["notify-send", "{subject}"]}
+        ]
+    }
+
+Every channel also takes "rate" (alerts per minute, default 6), "burst" (default 3) and "timeout" (seconds). The
+configuration can be tried against local stand-in servers with
+
+    python alerts.py --test
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from rate_limiter import TokenBucket
+
+ALERTS_FILE = "alerts.json"
+ALERT_WINDOW = 30  # seconds transitions are collected before they are grouped into alerts
+CHANNEL_RATE = 6  # alerts per minute a channel may send
+CHANNEL_BURST = 3
+SINK_TIMEOUT = 10  # seconds a single delivery may take
+MAX_ATTEMPTS = 5  # deliveries are retried with exponential backoff, 1, 2, 4 and 8 seconds apart
+RETRY_DELAY = 1
+
+DOWN = "down"
+UP = "up"
+
+
+class Transition:
+    """a server changing state, as fed to the dispatcher"""
+
+    __slots__ = ("server_name", "group", "state", "at", "detail")
+
+    def __init__(self, server_name: str, group: str, state: str, detail: str = "", at: Optional[float] = None) -> None:
+        self.server_name = server_name
+        self.group = group
+        self.state = state  # DOWN or UP
+        self.detail = detail
+        self.at = time.time() if at is None else at
+
+
+class Alert:
+    __slots__ = ("subject", "body", "transitions", "created_at")
+
+    def __init__(self, subject: str, body: str, transitions: List[Transition]) -> None:
+        self.subject = subject
+        self.body = body
+        self.transitions = transitions
+        self.created_at = time.time()
+
+    def to_dict(self) -> Dict:
+        return {
+            "subject": self.subject,
+            "body": self.body,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(timespec="seconds"),
+            "transitions": [
+                {"server": t.server_name, "group": t.group, "state": t.state, "detail": t.detail,
+                 "at": datetime.fromtimestamp(t.at).isoformat(timespec="seconds")}
+                for t in self.transitions
+            ],
+        }
+
+
+def group_alerts(transitions: List[Transition]) -> List[Alert]:
+    """one alert per group and direction, in the order their first transition happened"""
+    grouped = {}
+    for transition in transitions:
+        grouped.setdefault((transition.group, transition.state), []).append(transition)
+    alerts = []
+    for (group, state), members in grouped.items():
+        if len(members) == 1:
+            subject = f"{members[0].server_name.title()} Server is {state}"
+        else:
+            subject = f"{len(members)} servers {state} in group {group.upper()}"
+        lines = []
+        for transition in members:
+            when = datetime.fromtimestamp(transition.at).strftime("%Y-%m-%d %H:%M:%S")
+            detail = f" ({transition.detail})" if transition.detail else ""
+            lines.append(f"{when}  {transition.server_name.title()} is {state}{detail}")
+        alerts.append(Alert(subject, "\n".join(lines) + "\n", members))
+    return alerts
+
+
+def digest(alerts: List[Alert]) -> Alert:
+    """folds alerts that queued up behind a channel's rate limit into one"""
+    if len(alerts) == 1:
+        return alerts[0]
+    subject = f"{len(alerts)} alerts: " + "; ".join(alert.subject for alert in alerts[:3])
+    if len(alerts) > 3:
+        subject += "; ..."
+    body = "\n".join(f"{alert.subject}\n{alert.body}" for alert in alerts)
+    return Alert(subject, body, [transition for alert in alerts for transition in alert.transitions])
+
+
+class SmtpSink:
+    name = "smtp"
+
+    def __init__(self, host: str = "localhost", port: int = 25, sender: str = "gcs-panel@localhost",
+                 recipients: Optional[List[str]] = None, username: Optional[str] = None,
+                 password: Optional[str] = None, starttls: bool = False, timeout: float = SINK_TIMEOUT) -> None:
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = recipients or []
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send(self, alert: Alert) -> None:
+        import smtplib
+        from email.message import EmailMessage
+        message = EmailMessage()
+        message["Subject"] = f"[GCS] {alert.subject}"
+        message["From"] = self.sender
+        message["To"] = ", ".join(self.recipients)
+        message.set_content(alert.body)
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or "")
+            smtp.send_message(message)
+
+
+class WebhookSink:
+    """posts the alert as json"""
+
+    name = "webhook"
+
+    def __init__(self, url: str, headers: Optional[Dict[str, str]] = None, timeout: float = SINK_TIMEOUT) -> None:
+        self.url = url
+        self.headers = headers or {}
+        self.timeout = timeout
+
+    def send(self, alert: Alert) -> None:
+        import urllib.request
+        request = urllib.request.Request(self.url, data=json.dumps(alert.to_dict()).encode("utf-8"), method="POST",
+                                         headers={"Content-Type": "application/json", **self.headers})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()  # non 2xx answers raise HTTPError
+
+
+class CommandSink:
+    """runs a command per alert, "{subject}" in its arguments is replaced and the body goes to its stdin"""
+
+    name = "command"
+
+    def __init__(self, command, timeout: float = SINK_TIMEOUT) -> None:
+        self.command = command if isinstance(command, list) else [command]
+        self.timeout = timeout
+
+    def send(self, alert: Alert) -> None:
+        import subprocess
+        arguments = [argument.replace("{subject}", alert.subject) for argument in self.command]
+        environment = dict(os.environ, GCS_ALERT_SUBJECT=alert.subject)
+        completed = subprocess.run(arguments, input=alert.body.encode("utf-8"), env=environment,
+                                   timeout=self.timeout, capture_output=True)
+        if completed.returncode != 0:
+            raise RuntimeError(f"exit status {completed.returncode}: {completed.stderr.decode(errors='replace')[:200]}")
+
+
+SINKS = {"smtp": SmtpSink, "webhook": WebhookSink, "command": CommandSink}
+
+
+class Channel:
+    """delivers alerts to one sink on its own thread, rate limited and retried"""
+
+    def __init__(self, sink, rate: float = CHANNEL_RATE, burst: float = CHANNEL_BURST,
+                 on_event: Optional[Callable[[str], None]] = None) -> None:
+        """
+        :param sink: anything with a name and a send(alert) that raises on failure
+        :param rate: alerts per minute, defaults to CHANNEL_RATE
+        :type rate: float, optional
+        :param burst: alerts that may be sent back to back, defaults to CHANNEL_BURST
+        :type burst: float, optional
+        :param on_event: called with a line describing every delivery and failure, from the channel's thread
+        :type on_event: Callable[[str], None], optional
+        """
+        self.sink = sink
+        self.bucket = TokenBucket(rate / 60, burst)
+        self.on_event = on_event
+        self.sent = 0
+        self.failed = 0
+        self.last_error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"alerts-{sink.name}", daemon=True)
+        self._thread.start()
+
+    def put(self, alert: Alert) -> None:
+        self._queue.put(alert)
+
+    def close(self) -> None:
+        self._queue.put(None)
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        self._thread.join(timeout)
+
+    def _report(self, line: str) -> None:
+        if self.on_event is not None:
+            self.on_event(line)
+
+    def _run(self) -> None:
+        closing = False
+        while not closing:
+            alert = self._queue.get()
+            if alert is None:
+                return
+            wait = self.bucket.time_until(1)
+            time.sleep(wait)
+            self.bucket.try_take(1)
+            waiting = [alert]
+            # whatever queued up while the channel waited for its rate limit goes out as one digest
+            while wait > 0:
+                try:
+                    alert = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if alert is None:
+                    closing = True
+                    break
+                waiting.append(alert)
+            self._deliver(digest(waiting))
+
+    def _deliver(self, alert: Alert) -> None:
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                self.sink.send(alert)
+            except Exception as e:
+                self.last_error = str(e) or type(e).__name__
+                if attempt + 1 < MAX_ATTEMPTS:
+                    time.sleep(RETRY_DELAY * 2 ** attempt)
+                continue
+            self.sent += 1
+            self._report(f"Alert sent via {self.sink.name}: {alert.subject}")
+            return
+        self.failed += 1
+        self._report(f"Alert via {self.sink.name} failed after {MAX_ATTEMPTS} attempts: {self.last_error}")
+
+
+class AlertDispatcher:
+    """collects transitions for a window, then deduplicates, groups and hands the alerts to every channel"""
+
+    def __init__(self, channels: List[Channel], window: float = ALERT_WINDOW) -> None:
+        self.channels = channels
+        self.window = window
+        self.transitions = 0
+        self.cancelled = 0  # servers that went back to where they were inside a window
+        self.alerts = 0
+        self._pending = {}  # server name -> [first transition, last transition] inside the current window
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._window_started = None
+        self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, transition: Transition) -> None:
+        """queues a transition, never blocks on delivery"""
+        with self._lock:
+            self.transitions += 1
+            pending = self._pending.get(transition.server_name)
+            if pending is None:
+                self._pending[transition.server_name] = [transition, transition]
+            else:
+                pending[1] = transition
+            if self._window_started is None:
+                self._window_started = time.monotonic()
+                self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                started = self._window_started
+            if started is None:
+                continue
+            self._stop.wait(max(0.0, started + self.window - time.monotonic()))
+            self.flush()
+
+    def flush(self) -> List[Alert]:
+        """groups what was collected so far and sends it, called when the window closes and at shutdown"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._window_started = None
+        transitions = []
+        for first, last in pending.values():
+            # down and back up again (or the other way) inside one window is no news
+            if first is not last and first.state != last.state:
+                self.cancelled += 1
+                continue
+            transitions.append(last)
+        transitions.sort(key=lambda transition: transition.at)
+        alerts = group_alerts(transitions)
+        self.alerts += len(alerts)
+        for alert in alerts:
+            for channel in self.channels:
+                channel.put(alert)
+        return alerts
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """sends what is still collected and gives the channels a moment to deliver it"""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        deadline = time.monotonic() + timeout
+        for channel in self.channels:
+            channel.close()
+            channel.join(max(0.0, deadline - time.monotonic()))
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            collecting = len(self._pending)
+        return {
+            "transitions": self.transitions,
+            "cancelled_in_window": self.cancelled,
+            "alerts": self.alerts,
+            "collecting": collecting,
+            "channels": [
+                {"sink": channel.sink.name, "sent": channel.sent, "failed": channel.failed,
+                 "last_error": channel.last_error}
+                for channel in self.channels
+            ],
+        }
+
+
+def make_sink(config: Dict):
+    kind = config.get("type")
+    timeout = config.get("timeout", SINK_TIMEOUT)
+    if kind == "smtp":
+        return SmtpSink(config.get("host", "localhost"), config.get("port", 25),
+                        config.get("from", "gcs-panel@localhost"), config.get("to"), config.get("username"),
+                        config.get("password"), config.get("starttls", False), timeout)
+    if kind == "webhook":
+        return WebhookSink(config["url"], config.get("headers"), timeout)
+    if kind == "command":
+        return CommandSink(config["command"], timeout)
+    raise ValueError(f"unknown alert channel type {kind!r}, expected one of {sorted(SINKS)}")
+
+
+def load_dispatcher(path: str = ALERTS_FILE,
+                    on_event: Optional[Callable[[str], None]] = None) -> Optional[AlertDispatcher]:
+    """builds the dispatcher from alerts.json
+
+    :return: the dispatcher, None if there is no configuration or no channel in it
+    :rtype: Optional[AlertDispatcher]
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as file:
+            config = json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"ignoring unreadable alert configuration {path}: {e}")
+        return None
+    channels = []
+    for channel_config in config.get("channels", []):
+        try:
+            sink = make_sink(channel_config)
+        except (KeyError, ValueError) as e:
+            print(f"ignoring alert channel {channel_config}: {e}")
+            continue
+        rate = channel_config.get("rate", CHANNEL_RATE)
+        burst = channel_config.get("burst", CHANNEL_BURST)
+        channels.append(Channel(sink, rate, burst, on_event))
+    if not channels:
+        return None
+    return AlertDispatcher(channels, config.get("window", ALERT_WINDOW))
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Send a test alert through the channels in alerts.json.")
+    parser.add_argument("--config", default=ALERTS_FILE, help="alert configuration (default: %(default)s)")
+    parser.add_argument("--test", action="store_true", help="send a test alert and wait for it to be delivered")
+    args = parser.parse_args(argv)
+
+    dispatcher = load_dispatcher(args.config, on_event=print)
+    if dispatcher is None:
+        raise SystemExit(f"no alert channels configured in {args.config}")
+    if args.test:
+        dispatcher.submit(Transition("test", "test", DOWN, "test alert from alerts.py"))
+        dispatcher.stop(timeout=SINK_TIMEOUT * MAX_ATTEMPTS)
+    print(json.dumps(dispatcher.metrics(), indent=4))
+
+
+if __name__ == "__main__":
+    main()
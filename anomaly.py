@@ -0,0 +1,299 @@
+"""Latency and loss anomalies: every server keeps an exponentially weighted mean and variance of its rtt and of its
+burst loss, and a server whose results sit more than ANOMALY_SIGMA standard deviations above that baseline for
+ANOMALY_STREAK sweeps in a row is flagged, usually well before it goes offline.
+
+The baselines of the whole fleet live in contiguous numpy arrays, one row per metric and hour of the day (a single
+hour unless hourly baselines are on) with one column per server. Results are summed into pending arrays as they
+arrive and each sweep folds every server's results into its baseline with a handful of whole array operations.
+Without numpy the same is done one server at a time.
+"""
+import argparse
+import math
+import random
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sample_store import _numpy
+
+ANOMALY_SIGMA = 4.0  # standard deviations above its baseline a result counts as anomalous
+ANOMALY_STREAK = 3  # anomalous sweeps in a row that flag a server, as many normal ones clear it
+BASELINE_GAIN = 0.05  # weight of a sweep's result in the baseline, about the last 20 sweeps
+HOURLY_BASELINE_GAIN = 0.0005  # about the last three days of the same hour at one sweep every 5 seconds
+ANOMALOUS_GAIN_FACTOR = 0.2  # anomalous results move the baseline slower, a lasting shift still becomes the norm
+WARMUP_SAMPLES = 20  # results a baseline needs before it flags anything
+RTT_SIGMA_FLOOR = 0.002  # seconds, so a steady 1 ms link is not flagged for answering in 1.5 ms
+LOSS_SIGMA_FLOOR = 0.05
+METRICS = ("rtt", "loss")
+
+
+class AnomalyDetector:
+    """ewma baselines of every server's rtt and loss, indexed like the server model"""
+
+    def __init__(self, names: List[str], hourly: bool = False, sigma: float = ANOMALY_SIGMA,
+                 streak: int = ANOMALY_STREAK, gain: Optional[float] = None) -> None:
+        """
+        :param names: server names, a server's position is the index observe and sweep use
+        :type names: List[str]
+        :param hourly: keep a baseline per hour of the day, defaults to False
+        :type hourly: bool, optional
+        :param gain: weight of a result in the baseline, defaults to BASELINE_GAIN or HOURLY_BASELINE_GAIN
+        :type gain: float, optional
+        """
+        self.names = list(names)
+        self.hourly = hourly
+        self.sigma = sigma
+        self.streak = streak
+        self.gain = gain if gain is not None else HOURLY_BASELINE_GAIN if hourly else BASELINE_GAIN
+        self.sweeps = 0
+        self._numpy = _numpy()
+        self._allocate(len(self.names))
+
+    def _allocate(self, count: int) -> None:
+        hours = 24 if self.hourly else 1
+        numpy = self._numpy
+        if numpy is not None:
+            self._mean = numpy.zeros((hours, len(METRICS), count))
+            self._variance = numpy.zeros((hours, len(METRICS), count))
+            self._seen = numpy.zeros((hours, count), dtype=numpy.int64)
+            self._sums = numpy.zeros((len(METRICS), count))
+            self._counts = numpy.zeros(count, dtype=numpy.int64)
+            self._anomalous_run = numpy.zeros(count, dtype=numpy.int64)
+            self._normal_run = numpy.zeros(count, dtype=numpy.int64)
+            self._flagged = numpy.zeros(count, dtype=bool)
+            self._floors = numpy.array([RTT_SIGMA_FLOOR, LOSS_SIGMA_FLOOR])[:, None]
+        else:
+            self._mean = [[[0.0] * count for _ in METRICS] for _ in range(hours)]
+            self._variance = [[[0.0] * count for _ in METRICS] for _ in range(hours)]
+            self._seen = [[0] * count for _ in range(hours)]
+            self._sums = [[0.0] * count for _ in METRICS]
+            self._counts = [0] * count
+            self._anomalous_run = [0] * count
+            self._normal_run = [0] * count
+            self._flagged = [False] * count
+
+    def resize(self, names: List[str]) -> None:
+        """follows a rebuilt server model, servers that are still there keep their baselines"""
+        old = {name: index for index, name in enumerate(self.names)}
+        previous = (self._mean, self._variance, self._seen, self._anomalous_run, self._normal_run, self._flagged)
+        self.names = list(names)
+        self._allocate(len(self.names))
+        moved = [(index, old[name]) for index, name in enumerate(self.names) if name in old]
+        if not moved:
+            return
+        mean, variance, seen, anomalous_run, normal_run, flagged = previous
+        if self._numpy is not None:
+            new_indexes, old_indexes = (self._numpy.array(indexes) for indexes in zip(*moved))
+            self._mean[..., new_indexes] = mean[..., old_indexes]
+            self._variance[..., new_indexes] = variance[..., old_indexes]
+            self._seen[:, new_indexes] = seen[:, old_indexes]
+            self._anomalous_run[new_indexes] = anomalous_run[old_indexes]
+            self._normal_run[new_indexes] = normal_run[old_indexes]
+            self._flagged[new_indexes] = flagged[old_indexes]
+            return
+        for new_index, old_index in moved:
+            for hour in range(len(self._mean)):
+                self._seen[hour][new_index] = seen[hour][old_index]
+                for metric in range(len(METRICS)):
+                    self._mean[hour][metric][new_index] = mean[hour][metric][old_index]
+                    self._variance[hour][metric][new_index] = variance[hour][metric][old_index]
+            self._anomalous_run[new_index] = anomalous_run[old_index]
+            self._normal_run[new_index] = normal_run[old_index]
+            self._flagged[new_index] = flagged[old_index]
+
+    def observe(self, index: int, rtt: float, loss: float = 0.0) -> None:
+        """adds a reachable server's result to the next sweep, several results before a sweep are averaged
+
+        :param rtt: seconds
+        :type rtt: float
+        :param loss: share of a burst's echoes lost, 0 for single echo probes
+        :type loss: float
+        """
+        if self._numpy is not None:
+            self._sums[0, index] += rtt
+            self._sums[1, index] += loss
+        else:
+            self._sums[0][index] += rtt
+            self._sums[1][index] += loss
+        self._counts[index] += 1
+
+    def clear(self, index: int) -> None:
+        """forgets a server's pending results and streaks without an event, when it went offline or was stopped"""
+        for metric in range(len(METRICS)):
+            self._sums[metric][index] = 0.0
+        self._counts[index] = 0
+        self._anomalous_run[index] = 0
+        self._normal_run[index] = 0
+        self._flagged[index] = False
+
+    def is_flagged(self, index: int) -> bool:
+        return bool(self._flagged[index])
+
+    def _hour(self, now: Optional[float]) -> int:
+        if not self.hourly:
+            return 0
+        return datetime.fromtimestamp(time.time() if now is None else now).hour
+
+    def sweep(self, now: Optional[float] = None) -> Tuple[Dict[int, str], List[int]]:
+        """folds the results since the last sweep into the baselines
+
+        :param now: picks the hour of hourly baselines, defaults to the current time
+        :type now: float, optional
+        :return: servers newly flagged with a description of what deviates, and servers cleared
+        :rtype: Tuple[Dict[int, str], List[int]]
+        """
+        self.sweeps += 1
+        hour = self._hour(now)
+        if self._numpy is None:
+            return self._sweep_python(hour)
+        numpy = self._numpy
+        mean = self._mean[hour]
+        variance = self._variance[hour]
+        seen = self._seen[hour]
+        counts = self._counts
+        fresh = counts > 0
+        # every step works in place on whole arrays. Servers without a result have a gain of zero, which leaves
+        # their baselines as they are without masking them out
+        numpy.maximum(counts, 1, out=counts)
+        deviation = self._sums
+        deviation /= counts
+        deviation -= mean
+        limit = numpy.sqrt(variance)
+        numpy.maximum(limit, self._floors, out=limit)
+        limit *= self.sigma
+        above = deviation > limit
+        high = above[0] | above[1]
+        high &= fresh
+        high &= seen >= WARMUP_SAMPLES
+        normal = fresh & ~high
+        # a run of anomalous results grows with each one and ends with a normal one, and the other way round
+        self._anomalous_run += high
+        self._anomalous_run *= ~normal
+        self._normal_run += normal
+        self._normal_run *= ~high
+        flagged = self._anomalous_run >= self.streak
+        flagged &= ~self._flagged
+        cleared = self._normal_run >= self.streak
+        cleared &= self._flagged
+        self._flagged ^= flagged
+        self._flagged ^= cleared
+        descriptions = {}
+        if flagged.any():
+            for index in numpy.flatnonzero(flagged).tolist():
+                values = (deviation[:, index] + mean[:, index]).tolist()
+                descriptions[index] = _describe(values, mean[:, index].tolist(),
+                                                (limit[:, index] / self.sigma).tolist())
+        # west's incremental ewma, a plain average until the baseline has seen 1 / gain results. Anomalous results
+        # count for less and only up to the anomaly threshold, so a spike cannot blow up the variance
+        gain = seen + 1.0
+        numpy.reciprocal(gain, out=gain)
+        numpy.maximum(gain, self.gain, out=gain)
+        gain *= fresh
+        gain *= 1 - high * (1 - ANOMALOUS_GAIN_FACTOR)
+        numpy.minimum(deviation, limit, out=deviation, where=high)
+        increment = deviation * gain
+        mean += increment
+        deviation *= increment
+        variance += deviation
+        variance *= 1 - gain
+        seen += fresh
+        self._sums.fill(0.0)
+        counts.fill(0)
+        return descriptions, numpy.flatnonzero(cleared).tolist()
+
+    def _sweep_python(self, hour: int) -> Tuple[Dict[int, str], List[int]]:
+        """sweep without numpy"""
+        means = self._mean[hour]
+        variances = self._variance[hour]
+        seen = self._seen[hour]
+        floors = (RTT_SIGMA_FLOOR, LOSS_SIGMA_FLOOR)
+        descriptions = {}
+        cleared = []
+        for index, count in enumerate(self._counts):
+            if not count:
+                continue
+            values = [self._sums[metric][index] / count for metric in range(len(METRICS))]
+            mean = [means[metric][index] for metric in range(len(METRICS))]
+            sigma = [max(math.sqrt(variances[metric][index]), floors[metric]) for metric in range(len(METRICS))]
+            high = seen[index] >= WARMUP_SAMPLES and any(
+                value - average > self.sigma * spread for value, average, spread in zip(values, mean, sigma))
+            self._anomalous_run[index] = self._anomalous_run[index] + 1 if high else 0
+            self._normal_run[index] = 0 if high else self._normal_run[index] + 1
+            if not self._flagged[index] and self._anomalous_run[index] >= self.streak:
+                self._flagged[index] = True
+                descriptions[index] = _describe(values, mean, sigma)
+            elif self._flagged[index] and self._normal_run[index] >= self.streak:
+                self._flagged[index] = False
+                cleared.append(index)
+            gain = max(self.gain, 1.0 / (seen[index] + 1)) * (ANOMALOUS_GAIN_FACTOR if high else 1.0)
+            for metric, value in enumerate(values):
+                deviation = value - mean[metric]
+                if high:
+                    deviation = min(deviation, self.sigma * sigma[metric])
+                increment = deviation * gain
+                means[metric][index] += increment
+                variances[metric][index] = (1 - gain) * (variances[metric][index] + deviation * increment)
+                self._sums[metric][index] = 0.0
+            seen[index] += 1
+            self._counts[index] = 0
+        return descriptions, cleared
+
+    def baseline(self, index: int, now: Optional[float] = None) -> Optional[Dict]:
+        """a server's baseline for the current hour, None while it is warming up"""
+        hour = self._hour(now)
+        if self._seen[hour][index] < WARMUP_SAMPLES:
+            return None
+        return {metric: {"mean": float(self._mean[hour][position][index]),
+                         "stdev": math.sqrt(float(self._variance[hour][position][index]))}
+                for position, metric in enumerate(METRICS)}
+
+    def metrics(self) -> Dict:
+        hour = self._hour(None)
+        return {
+            "servers": len(self.names),
+            "hourly": self.hourly,
+            "warmed_up": sum(1 for seen in self._seen[hour] if seen >= WARMUP_SAMPLES),
+            "anomalous": int(sum(1 for flagged in self._flagged if flagged)),
+            "sweeps": self.sweeps,
+        }
+
+
+def _describe(values: List[float], mean: List[float], sigma: List[float]) -> str:
+    rtt, loss = values
+    return (f"rtt {rtt * 1000:.1f} ms against {mean[0] * 1000:.1f} ± {sigma[0] * 1000:.1f} ms, "
+            f"loss {loss:.0%} against {mean[1]:.0%}")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Time anomaly detector sweeps over a simulated fleet.")
+    parser.add_argument("--servers", type=int, default=10000)
+    parser.add_argument("--sweeps", type=int, default=200)
+    parser.add_argument("--hourly", action="store_true", help="keep a baseline per hour of the day")
+    parser.add_argument("--degrade", type=float, default=0.01, help="share of servers whose rtt jumps halfway")
+    args = parser.parse_args(argv)
+
+    detector = AnomalyDetector([f"server {index}" for index in range(args.servers)], hourly=args.hourly)
+    base = [random.uniform(0.005, 0.2) for _ in range(args.servers)]
+    degraded = set(random.sample(range(args.servers), int(args.servers * args.degrade)))
+    timings = []
+    flagged = set()
+    cleared = 0
+    for sweep in range(args.sweeps):
+        late = sweep >= args.sweeps // 2
+        for index, rtt in enumerate(base):
+            rtt *= random.uniform(0.95, 1.05)
+            detector.observe(index, rtt * 3 if late and index in degraded else rtt)
+        began = time.perf_counter()
+        new, normal = detector.sweep()
+        timings.append(time.perf_counter() - began)
+        flagged.update(new)
+        cleared += len(normal)
+    timings.sort()
+    print(f"{args.servers} servers, {args.sweeps} sweeps ({'numpy' if _numpy() else 'pure python'}): "
+          f"median {timings[len(timings) // 2] * 1000:.3f} ms, max {timings[-1] * 1000:.3f} ms")
+    print(f"{len(flagged & degraded)} of {len(degraded)} degraded servers flagged, "
+          f"{len(flagged - degraded)} false positives, {cleared} cleared again as their new rtt became the norm")
+
+
+if __name__ == "__main__":
+    main()
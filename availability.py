@@ -0,0 +1,241 @@
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from event_store import KIND_DOWN, KIND_ERROR, KIND_MONITORING_STOPPED, KIND_UP
+
+STATE_DOWN = 0
+STATE_UP = 1
+STATE_UNKNOWN = 255
+
+LOG_HISTORY_DAYS = 31  # how far back the logs are read when the history is loaded
+
+_LOG_EVENTS = [
+    (re.compile(r"\| (?P<name>[^|]+?) Server became reachable\."), STATE_UP),
+    (re.compile(r"\| (?P<name>[^|]+?) Server became unreachable\."), STATE_DOWN),
+    (re.compile(r"\| Ping failed for (?P<name>[^|]+?) Server:"), STATE_DOWN),
+    (re.compile(r"\| (?P<name>[^|]+?) Server monitoring stopped\."), STATE_UNKNOWN),
+]
+_EVENT_STATES = {KIND_UP: STATE_UP, KIND_DOWN: STATE_DOWN, KIND_ERROR: STATE_DOWN, KIND_MONITORING_STOPPED: STATE_UNKNOWN}
+
+
+def state_code(status: Optional[bool]) -> int:
+    if status is None:
+        return STATE_UNKNOWN
+    return STATE_UP if status else STATE_DOWN
+
+
+class AvailabilityHistory:
+    """every server's state changes over time, the source of the timeline view.
+
+    A server's history is two parallel arrays, the times it changed state and the state it changed to, so a month of
+    a flapping server is a few kilobytes and any time range is found with a binary search.
+    """
+
+    def __init__(self) -> None:
+        self._times: Dict[str, array] = {}
+        self._states: Dict[str, bytearray] = {}
+        self._lock = threading.Lock()
+        self.version = 0  # goes up with every recorded change
+
+    def record(self, server_name: str, when: float, state: int) -> None:
+        """notes a server's state at a time, nothing is stored unless it differs from the last one.
+        Times before the last recorded change are inserted in order."""
+        with self._lock:
+            times = self._times.get(server_name)
+            if times is None:
+                times = self._times[server_name] = array("d")
+                self._states[server_name] = bytearray()
+            states = self._states[server_name]
+            if times and when >= times[-1]:
+                if states[-1] == state:
+                    return
+                times.append(when)
+                states.append(state)
+            else:
+                position = bisect_right(times, when)
+                if position and states[position - 1] == state:
+                    return
+                times.insert(position, when)
+                states.insert(position, state)
+            self.version += 1
+
+    def state_at(self, server_name: str, when: float) -> int:
+        with self._lock:
+            times = self._times.get(server_name)
+            if not times:
+                return STATE_UNKNOWN
+            position = bisect_right(times, when)
+            return self._states[server_name][position - 1] if position else STATE_UNKNOWN
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return list(self._times)
+
+    def last_change(self, server_name: str) -> Optional[Tuple[float, int]]:
+        """time and state of the server's latest change, None if nothing is known about it"""
+        with self._lock:
+            times = self._times.get(server_name)
+            return (times[-1], self._states[server_name][-1]) if times else None
+
+    def intervals(self, server_name: str, state: int, start: float, end: float,
+                  now: Optional[float] = None) -> List[Tuple[float, float]]:
+        """the stretches of time between start and end the server spent in a state, clipped to the range
+
+        :param state: STATE_UP, STATE_DOWN or STATE_UNKNOWN
+        :type state: int
+        :param now: the last known state lasts until now, defaults to the current time
+        :type now: float, optional
+        :rtype: List[Tuple[float, float]]
+        """
+        end = min(end, time.time() if now is None else now)
+        with self._lock:
+            times = self._times.get(server_name)
+            if not times:
+                return [(start, end)] if state == STATE_UNKNOWN and start < end else []
+            states = self._states[server_name]
+            first = bisect_right(times, start) - 1
+            last = bisect_right(times, end)
+            changes = [(times[i], states[i]) for i in range(max(0, first), last)]
+        if first < 0:
+            changes.insert(0, (start, STATE_UNKNOWN))  # nothing is known before the first change
+        found = []
+        for index, (since, changed_to) in enumerate(changes):
+            until = changes[index + 1][0] if index + 1 < len(changes) else end
+            since = max(since, start)
+            if changed_to == state and since < until:
+                if found and found[-1][1] == since:
+                    found[-1] = (found[-1][0], until)
+                else:
+                    found.append((since, until))
+        return found
+
+    def last_in_state(self, server_name: str, state: int, now: Optional[float] = None) -> Optional[float]:
+        """the last time the server was in a state, now if it still is, None if it never was"""
+        with self._lock:
+            times = self._times.get(server_name)
+            if not times:
+                return None
+            states = self._states[server_name]
+            position = states.rfind(bytes((state,)))
+            if position < 0:
+                return None
+            if position == len(states) - 1:
+                return time.time() if now is None else now
+            return times[position + 1]
+
+    def packed(self) -> Tuple[List[str], List[int], array, bytes]:
+        """every server's changes back to back, for fleet wide queries
+
+        :return: server names, offset of each server's first change (one more than there are servers, the last is
+            the total), times and states
+        :rtype: Tuple[List[str], List[int], array, bytes]
+        """
+        names = []
+        offsets = [0]
+        times = array("d")
+        states = bytearray()
+        with self._lock:
+            for name, server_times in self._times.items():
+                names.append(name)
+                times.extend(server_times)
+                states.extend(self._states[name])
+                offsets.append(len(times))
+        return names, offsets, times, bytes(states)
+
+    def up_fractions(self, server_name: str, start: float, bucket_seconds: float, count: int,
+                     now: Optional[float] = None) -> List[float]:
+        """share of each bucket the server was up, -1 for buckets without any known state.
+
+        Buckets are aggregated in one pass over the changes inside the range, the cost is the number of changes
+        plus the number of buckets however long each state lasted.
+
+        :param start: start of the first bucket, unix time
+        :type start: float
+        :param bucket_seconds: width of a bucket
+        :type bucket_seconds: float
+        :param count: number of buckets
+        :type count: int
+        :param now: the last known state lasts until now, defaults to the current time
+        :type now: float, optional
+        :rtype: List[float]
+        """
+        now = time.time() if now is None else now
+        end = min(start + bucket_seconds * count, now)
+        known = [0.0] * count
+        up = [0.0] * count
+        with self._lock:
+            times = self._times.get(server_name)
+            states = self._states.get(server_name)
+            if times:
+                position = max(0, bisect_right(times, start) - 1)
+                changes = [(times[i], states[i]) for i in range(position, bisect_right(times, end))]
+            else:
+                changes = []
+        for index, (since, state) in enumerate(changes):
+            until = changes[index + 1][0] if index + 1 < len(changes) else end
+            since = max(since, start)
+            if state == STATE_UNKNOWN or until <= since:
+                continue
+            first = int((since - start) // bucket_seconds)
+            last = min(count - 1, int((until - start) // bucket_seconds))
+            for bucket in range(first, last + 1):
+                bucket_start = start + bucket * bucket_seconds
+                overlap = min(until, bucket_start + bucket_seconds) - max(since, bucket_start)
+                if overlap > 0:
+                    known[bucket] += overlap
+                    if state == STATE_UP:
+                        up[bucket] += overlap
+        return [up[i] / known[i] if known[i] else -1.0 for i in range(count)]
+
+    def load_events(self, events, names: Iterable[str], days: int = LOG_HISTORY_DAYS) -> int:
+        """reads the transitions of the last days out of the event store
+
+        :param events: the panel's EventStore
+        :type events: EventStore
+        :param names: server names
+        :type names: Iterable[str]
+        :return: number of transitions read
+        :rtype: int
+        """
+        names = set(names)
+        loaded = 0
+        for event in events.iterate(time.time() - days * 86400, kinds=_EVENT_STATES):
+            if event.server in names:
+                self.record(event.server, event.time, _EVENT_STATES[event.kind])
+                loaded += 1
+        return loaded
+
+    def load_log(self, log, names: Iterable[str], days: int = LOG_HISTORY_DAYS, end: Optional[datetime] = None) -> int:
+        """reads the transitions of the last days out of the panel's logs, compressed segments included
+
+        :param log: the panel's RotatingLog
+        :type log: RotatingLog
+        :param names: server names, the logs only have them in title case
+        :type names: Iterable[str]
+        :param end: only transitions before this time, for the part of the history older than the event store,
+            defaults to now
+        :type end: datetime, optional
+        :return: number of transitions read
+        :rtype: int
+        """
+        by_title = {name.title(): name for name in names}
+        start = datetime.now() - timedelta(days=days)
+        end = end or datetime.now()
+        if end <= start:
+            return 0
+        loaded = 0
+        for entry in log.search(start, end):
+            for pattern, state in _LOG_EVENTS:
+                match = pattern.search(entry)
+                if match is None or match.group("name") not in by_title:
+                    continue
+                when = datetime.strptime(entry[:19], "%Y-%m-%d %H:%M:%S").timestamp()
+                self.record(by_title[match.group("name")], when, state)
+                loaded += 1
+                break
+        return loaded
@@ -0,0 +1,259 @@
+"""Burst probes: a few echo requests a few milliseconds apart instead of one, so a lossy or jittery link shows up as
+degraded instead of flickering between online and offline.
+
+Every burst goes out through one shared ICMP socket. A receiver thread matches the replies to the bursts waiting
+for them by sequence number, so thousands of bursts in flight cost one socket and one thread, not one each. The
+statistics of a burst (loss, mean and standard deviation of the rtt, RFC 3550 interarrival jitter) are computed
+by burst_result as each burst finishes, in plain python: a burst is a handful of numbers.
+
+A server is probed in bursts when its servers.json entry has a "burst" section, for example
+{"count": 5, "spacing_ms": 20, "max_loss": 0.2, "max_jitter_ms": 30}, or just true for the defaults.
+"""
+import argparse
+import itertools
+import math
+import os
+import random
+import select
+import socket
+import struct
+import threading
+import time
+from typing import Dict, List, Optional
+
+BURST_COUNT = 5  # echoes per burst
+BURST_SPACING = 0.02  # seconds between the echoes of a burst
+BURST_TIMEOUT = 2.0  # seconds to wait for replies after the last echo was sent
+DEGRADED_LOSS = 0.2  # share of a burst's echoes lost at which a reachable server counts as degraded
+DEGRADED_JITTER = 0.03  # seconds of jitter at which a reachable server counts as degraded
+JITTER_GAIN = 1 / 16  # rfc 3550
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+_ICMP_HEADER = struct.Struct("!BBHHH")  # type, code, checksum, identifier, sequence
+_PAYLOAD = b"gcs-burst-probe"
+
+
+def burst_settings(config: Optional[Dict]) -> Optional[Dict]:
+    """the burst settings of a servers.json entry with the defaults filled in, None if it is probed with one echo"""
+    burst = (config or {}).get("burst")
+    if not burst:
+        return None
+    burst = burst if isinstance(burst, dict) else {}
+    return {
+        "count": max(2, int(burst.get("count", BURST_COUNT))),
+        "spacing": float(burst.get("spacing_ms", BURST_SPACING * 1000)) / 1000,
+        "max_loss": float(burst.get("max_loss", DEGRADED_LOSS)),
+        "max_jitter": float(burst.get("max_jitter_ms", DEGRADED_JITTER * 1000)) / 1000,
+    }
+
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+class BurstResult:
+    """one burst's echoes and statistics, rtts in seconds"""
+
+    __slots__ = ("sent", "received", "rtts", "loss", "mean", "stdev", "jitter", "degraded")
+
+    def __init__(self, rtts: List[Optional[float]], loss: float, mean: Optional[float], stdev: Optional[float],
+                 jitter: Optional[float], degraded: bool = False) -> None:
+        self.rtts = rtts  # None for echoes without a reply
+        self.sent = len(rtts)
+        self.received = sum(1 for rtt in rtts if rtt is not None)
+        self.loss = loss  # share of echoes lost, 0 to 1
+        self.mean = mean
+        self.stdev = stdev
+        self.jitter = jitter
+        self.degraded = degraded
+
+    def summary(self) -> str:
+        if not self.received:
+            return f"{self.sent} echoes, all lost"
+        return (f"{self.loss:.0%} loss, rtt {self.mean * 1000:.1f} ms ± {self.stdev * 1000:.1f} ms, "
+                f"jitter {self.jitter * 1000:.1f} ms")
+
+
+def burst_result(rtts: List[Optional[float]], settings: Dict, jitter: Optional[float] = None) -> BurstResult:
+    """statistics and degraded state of one burst
+
+    Jitter follows RFC 3550: every pair of consecutive replies moves it a sixteenth of the way towards the
+    difference of their rtts. Each burst continues from its server's previous jitter, a burst of five echoes alone
+    would barely move it off zero.
+
+    :param rtts: rtt of every echo, None for lost ones
+    :type rtts: List[Optional[float]]
+    :param settings: burst_settings of the server
+    :type settings: Dict
+    :param jitter: the server's jitter after its previous burst, defaults to None
+    :type jitter: float, optional
+    :rtype: BurstResult
+    """
+    answered = [rtt for rtt in rtts if rtt is not None]
+    loss = 1 - len(answered) / len(rtts)
+    if not answered:
+        return BurstResult(rtts, loss, None, None, jitter, False)
+    mean = sum(answered) / len(answered)
+    stdev = math.sqrt(sum((rtt - mean) ** 2 for rtt in answered) / len(answered))
+    for previous, current in zip(answered, answered[1:]):
+        started = jitter or 0.0
+        jitter = started + (abs(current - previous) - started) * JITTER_GAIN
+    degraded = loss >= settings["max_loss"] or (jitter or 0.0) >= settings["max_jitter"]
+    return BurstResult(rtts, loss, mean, stdev, jitter, degraded)
+
+
+class _Pending:
+    __slots__ = ("address", "sent", "rtts", "waiting", "done")
+
+    def __init__(self, address: str, count: int) -> None:
+        self.address = address
+        self.sent = [None] * count
+        self.rtts: List[Optional[float]] = [None] * count
+        self.waiting = count
+        self.done = threading.Event()
+
+
+class EchoSocket:
+    """one ICMP socket shared by every burst, with a receiver thread handing replies to the bursts waiting for them.
+
+    Unprivileged ping sockets are used where the system allows them (linux with net.ipv4.ping_group_range), raw
+    sockets otherwise, which need root or administrator rights. Ping sockets rewrite the identifier, so replies
+    are matched on address and sequence number only.
+    """
+
+    def __init__(self) -> None:
+        try:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            self.raw = False
+        except OSError:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            self.raw = True
+        self.identifier = (os.getpid() ^ random.getrandbits(16)) & 0xFFFF
+        self._sequence = itertools.count(random.getrandbits(16))
+        self._lock = threading.Lock()
+        self._pending = {}  # sequence -> (_Pending, index of the echo in its burst)
+        self._closed = False
+        self._receiver = threading.Thread(target=self._receive_loop, name="burst-receiver", daemon=True)
+        self._receiver.start()
+
+    def burst(self, address: str, count: int = BURST_COUNT, spacing: float = BURST_SPACING,
+              timeout: float = BURST_TIMEOUT) -> List[Optional[float]]:
+        """sends count echoes spaced apart and waits for their replies, on the calling thread
+
+        :param address: ipv4 address
+        :type address: str
+        :return: each echo's rtt in seconds, None for echoes without a reply
+        :rtype: List[Optional[float]]
+        """
+        pending = _Pending(address, count)
+        sequences = []
+        try:
+            for index in range(count):
+                if index:
+                    time.sleep(spacing)
+                sequence = next(self._sequence) & 0xFFFF
+                header = _ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, self.identifier, sequence)
+                packet = _ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, _checksum(header + _PAYLOAD), self.identifier,
+                                           sequence) + _PAYLOAD
+                with self._lock:
+                    self._pending[sequence] = (pending, index)
+                    sequences.append(sequence)
+                    pending.sent[index] = time.perf_counter()
+                self._socket.sendto(packet, (address, 0))
+            pending.done.wait(timeout)
+        finally:
+            with self._lock:
+                for sequence in sequences:
+                    self._pending.pop(sequence, None)
+        return list(pending.rtts)
+
+    def _receive_loop(self) -> None:
+        while not self._closed:
+            try:
+                if not select.select([self._socket], [], [], 0.5)[0]:
+                    continue
+                packet, (source, _) = self._socket.recvfrom(1500)
+            except (OSError, ValueError):
+                if self._closed:
+                    return
+                continue
+            received = time.perf_counter()
+            offset = (packet[0] & 0x0F) * 4 if self.raw else 0
+            if len(packet) < offset + _ICMP_HEADER.size:
+                continue
+            icmp_type, _, _, identifier, sequence = _ICMP_HEADER.unpack_from(packet, offset)
+            if icmp_type != ICMP_ECHO_REPLY or (self.raw and identifier != self.identifier):
+                continue
+            with self._lock:
+                entry = self._pending.pop(sequence, None)
+                if entry is None:
+                    continue
+                pending, index = entry
+                if pending.address != source:
+                    self._pending[sequence] = entry
+                    continue
+                pending.rtts[index] = received - pending.sent[index]
+                pending.waiting -= 1
+                if not pending.waiting:
+                    pending.done.set()
+
+    def close(self) -> None:
+        self._closed = True
+        self._socket.close()
+
+
+_shared_socket = None
+_shared_lock = threading.Lock()
+
+
+def shared_socket() -> EchoSocket:
+    """the process wide EchoSocket, opened on first use"""
+    global _shared_socket
+    with _shared_lock:
+        if _shared_socket is None:
+            _shared_socket = EchoSocket()
+        return _shared_socket
+
+
+def probe_burst(ip: str, settings: Dict, jitter: Optional[float] = None, timeout: float = BURST_TIMEOUT) -> BurstResult:
+    """bursts one target on the calling thread, host names are resolved first
+
+    :param settings: from burst_settings
+    :type settings: Dict
+    :param jitter: the server's jitter after its previous burst, defaults to None
+    :type jitter: float, optional
+    :rtype: BurstResult
+    """
+    address = socket.gethostbyname(ip.strip())
+    rtts = shared_socket().burst(address, settings["count"], settings["spacing"], timeout)
+    return burst_result(rtts, settings, jitter)
+
+
+def main(argv=None) -> None:
+    from concurrent.futures import ThreadPoolExecutor
+    parser = argparse.ArgumentParser(description="Burst probe targets and print loss, rtt and jitter.")
+    parser.add_argument("targets", nargs="+", help="ip addresses or host names")
+    parser.add_argument("--count", type=int, default=BURST_COUNT)
+    parser.add_argument("--spacing-ms", type=float, default=BURST_SPACING * 1000)
+    parser.add_argument("--rounds", type=int, default=1, help="bursts per target, jitter carries over")
+    args = parser.parse_args(argv)
+
+    settings = burst_settings({"burst": {"count": args.count, "spacing_ms": args.spacing_ms}})
+    jitter = {target: None for target in args.targets}
+    with ThreadPoolExecutor(max_workers=min(64, len(args.targets))) as executor:
+        for _ in range(args.rounds):
+            results = executor.map(lambda target: probe_burst(target, settings, jitter[target]), args.targets)
+            for target, result in zip(args.targets, results):
+                jitter[target] = result.jitter
+                state = "degraded" if result.degraded else "up" if result.received else "down"
+                print(f"{target:<20} {state:<9} {result.summary()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""Events of the panel (transitions, monitoring started and stopped, servers added, probe errors, path traces and
+other messages) in an SQLite database, so the log view, reports and searches page through them with an index instead
+of reading the text logs.
+
+The database runs in WAL mode, readers never wait for the writer. record() only queues an event, a writer thread
+inserts everything queued in one transaction and deletes events past the retention period in the background.
+"""
+import argparse
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+EVENTS_FILE = "gcs_events.db"
+RETENTION_DAYS = 366  # events older than this are deleted
+RETENTION_INTERVAL = 3600  # seconds between retention passes
+RETENTION_CHUNK = 10000  # rows deleted per transaction, so a large purge does not hold the write lock for long
+BATCH_SIZE = 5000  # most events inserted in one transaction
+PAGE_ROWS = 500  # default page size of queries
+
+KIND_UP = "up"
+KIND_DOWN = "down"
+KIND_ERROR = "error"  # the probe itself raised
+KIND_DEGRADED = "degraded"  # reachable, but a burst probe lost or jittered too much
+KIND_RECOVERED = "recovered"
+KIND_ANOMALY = "anomaly"  # reachable, but rtt or loss well above the server's own baseline
+KIND_ANOMALY_CLEARED = "anomaly_cleared"
+KIND_MONITORING_STARTED = "monitoring_started"
+KIND_MONITORING_STOPPED = "monitoring_stopped"
+KIND_SERVER_ADDED = "server_added"
+KIND_PATH_TRACE = "path_trace"  # hops towards a server that just went down, stored right after its transition
+KIND_MESSAGE = "message"  # anything else the panel logs
+KINDS = (KIND_UP, KIND_DOWN, KIND_ERROR, KIND_DEGRADED, KIND_RECOVERED, KIND_ANOMALY, KIND_ANOMALY_CLEARED,
+         KIND_MONITORING_STARTED, KIND_MONITORING_STOPPED, KIND_SERVER_ADDED, KIND_PATH_TRACE, KIND_MESSAGE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    kind TEXT NOT NULL,
+    server TEXT,
+    message TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS events_server_time ON events (server, time);
+CREATE INDEX IF NOT EXISTS events_kind_time ON events (kind, time);
+CREATE INDEX IF NOT EXISTS events_time ON events (time);
+"""
+
+
+class Event:
+    __slots__ = ("id", "time", "kind", "server", "message")
+
+    def __init__(self, id: int, time: float, kind: str, server: Optional[str], message: str) -> None:
+        self.id = id
+        self.time = time
+        self.kind = kind
+        self.server = server
+        self.message = message
+
+    @property
+    def cursor(self) -> Tuple[float, int]:
+        """pass as before (or after) to get the next page of a query"""
+        return self.time, self.id
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "time": datetime.fromtimestamp(self.time).isoformat(timespec="seconds"),
+            "kind": self.kind,
+            "server": self.server,
+            "message": self.message,
+        }
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")  # a crash loses at most the last transactions, never the file
+    return connection
+
+
+class EventStore:
+    """the panel's events in an SQLite database, written by a background thread.
+
+    Queries page by (time, id) cursors on the (server, time), (kind, time) and time indexes, so the next page costs
+    the same however far back it is.
+    """
+
+    def __init__(self, path: str = EVENTS_FILE, retention_days: Optional[float] = RETENTION_DAYS) -> None:
+        """
+        :param path: database file, created if missing
+        :type path: str, optional
+        :param retention_days: events older than this many days are deleted, None keeps everything, defaults to
+            RETENTION_DAYS
+        :type retention_days: float, optional
+        """
+        self.path = path
+        self.retention_days = retention_days
+        connection = _connect(path)
+        # set before the first table exists, freed pages are then handed back by incremental_vacuum
+        connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.executescript(_SCHEMA)
+        self._writer_connection = connection
+        self._readers = threading.local()
+        self._queue = queue.Queue()
+        self.written = 0
+        self.purged = 0
+        self.failed = 0
+        self._writer = threading.Thread(target=self._write_loop, name="event-writer", daemon=True)
+        self._writer.start()
+
+    def record(self, kind: str, server: Optional[str] = None, message: str = "", when: Optional[float] = None) -> None:
+        """queues an event, never blocks
+
+        :param kind: one of KINDS
+        :type kind: str
+        :param server: server the event is about, defaults to None
+        :type server: str, optional
+        :param message: defaults to ""
+        :type message: str, optional
+        :param when: unix time, defaults to now
+        :type when: float, optional
+        """
+        self._queue.put((time.time() if when is None else when, kind, server, message))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """waits until everything recorded so far is written
+
+        :return: False if the timeout passed first
+        :rtype: bool
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """writes what is queued and stops the writer"""
+        self._queue.put(None)
+        self._writer.join(timeout)
+
+    def _write_loop(self) -> None:
+        next_retention = time.monotonic() + 60  # the first pass waits for startup to settle
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, next_retention - time.monotonic()))
+            except queue.Empty:
+                item = ()
+            rows = []
+            waiters = []
+            stop = False
+            while True:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                elif item:
+                    rows.append(item)
+                if stop or len(rows) >= BATCH_SIZE:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if rows:
+                self._insert(rows)
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                self._writer_connection.close()
+                return
+            if time.monotonic() >= next_retention:
+                next_retention = time.monotonic() + RETENTION_INTERVAL
+                if self.retention_days is not None:
+                    self.purge(time.time() - self.retention_days * 86400)
+
+    def _insert(self, rows: List[tuple]) -> None:
+        connection = self._writer_connection
+        try:
+            connection.execute("BEGIN")
+            connection.executemany("INSERT INTO events (time, kind, server, message) VALUES (?, ?, ?, ?)", rows)
+            connection.execute("COMMIT")
+            self.written += len(rows)
+        except sqlite3.Error as e:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            self.failed += len(rows)
+            print(f"could not write {len(rows)} events: {e}")
+
+    def purge(self, before: float) -> int:
+        """deletes events older than a time in small transactions, then returns the freed pages to the file system.
+        Runs on the writer thread, call it directly only when nothing is being recorded
+
+        :return: events deleted
+        :rtype: int
+        """
+        connection = self._writer_connection
+        deleted = 0
+        try:
+            while True:
+                cursor = connection.execute(
+                    "DELETE FROM events WHERE id IN (SELECT id FROM events WHERE time < ? LIMIT ?)",
+                    (before, RETENTION_CHUNK))
+                deleted += cursor.rowcount
+                if cursor.rowcount < RETENTION_CHUNK:
+                    break
+            if deleted:
+                connection.execute("PRAGMA incremental_vacuum")
+                connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            print(f"could not delete old events: {e}")
+        self.purged += deleted
+        return deleted
+
+    def _reader(self) -> sqlite3.Connection:
+        """one read connection per thread, in WAL mode they read a consistent snapshot without blocking the writer"""
+        connection = getattr(self._readers, "connection", None)
+        if connection is None:
+            connection = self._readers.connection = _connect(self.path)
+        return connection
+
+    def _where(self, start: Optional[float], end: Optional[float], server: Optional[str],
+               kinds: Optional[Iterable[str]], contains: Optional[str]) -> Tuple[List[str], List]:
+        clauses = []
+        parameters = []
+        if server is not None:
+            clauses.append("server = ?")
+            parameters.append(server)
+        if kinds is not None:
+            kinds = list(kinds)
+            clauses.append(f"kind IN ({', '.join('?' * len(kinds))})")
+            parameters.extend(kinds)
+        if start is not None:
+            clauses.append("time >= ?")
+            parameters.append(start)
+        if end is not None:
+            clauses.append("time < ?")
+            parameters.append(end)
+        if contains is not None:
+            clauses.append("instr(message, ?) > 0")
+            parameters.append(contains)
+        return clauses, parameters
+
+    def query(self, start: Optional[float] = None, end: Optional[float] = None, server: Optional[str] = None,
+              kinds: Optional[Iterable[str]] = None, contains: Optional[str] = None,
+              before: Optional[Tuple[float, int]] = None, after: Optional[Tuple[float, int]] = None,
+              limit: int = PAGE_ROWS, oldest_first: bool = False) -> List[Event]:
+        """one page of events, newest first unless oldest_first is set or the page follows after a cursor
+
+        :param start: earliest time, defaults to None
+        :type start: float, optional
+        :param end: events before this time, defaults to None
+        :type end: float, optional
+        :param server: only this server's events, defaults to None
+        :type server: str, optional
+        :param kinds: only events of these kinds, defaults to None
+        :type kinds: Iterable[str], optional
+        :param contains: only events whose message contains this text, defaults to None
+        :type contains: str, optional
+        :param before: cursor of the last event of the previous page, defaults to None
+        :type before: Tuple[float, int], optional
+        :param after: cursor to page forward from instead, defaults to None
+        :type after: Tuple[float, int], optional
+        :param limit: events per page, defaults to PAGE_ROWS
+        :type limit: int, optional
+        :param oldest_first: defaults to False
+        :type oldest_first: bool, optional
+        :rtype: List[Event]
+        """
+        clauses, parameters = self._where(start, end, server, kinds, contains)
+        order = "ASC" if oldest_first else "DESC"
+        if before is not None:
+            clauses.append("(time, id) < (?, ?)")
+            parameters.extend(before)
+        elif after is not None:
+            clauses.append("(time, id) > (?, ?)")
+            parameters.extend(after)
+            order = "ASC"
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(
+            f"SELECT id, time, kind, server, message FROM events {where} ORDER BY time {order}, id {order} LIMIT ?",
+            parameters + [limit])
+        return [Event(*row) for row in rows]
+
+    def count(self, start: Optional[float] = None, end: Optional[float] = None, server: Optional[str] = None,
+              kinds: Optional[Iterable[str]] = None, contains: Optional[str] = None) -> int:
+        clauses, parameters = self._where(start, end, server, kinds, contains)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._reader().execute(f"SELECT count(*) FROM events {where}", parameters).fetchone()[0]
+
+    def iterate(self, start: Optional[float] = None, end: Optional[float] = None, server: Optional[str] = None,
+                kinds: Optional[Iterable[str]] = None, page_rows: int = PAGE_ROWS * 10):
+        """every matching event, oldest first, read a page at a time so memory stays flat however many match"""
+        after = None
+        while True:
+            page = self.query(start, end, server, kinds, after=after, limit=page_rows, oldest_first=True)
+            yield from page
+            if len(page) < page_rows:
+                return
+            after = page[-1].cursor
+
+    def first_time(self) -> Optional[float]:
+        """time of the oldest event, None when there are none"""
+        return self._reader().execute("SELECT min(time) FROM events").fetchone()[0]
+
+    def metrics(self) -> Dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "failed": self.failed,
+            "purged": self.purged,
+        }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Search the GCS control panel's event database.")
+    parser.add_argument("--db", default=EVENTS_FILE, help="event database (default: %(default)s)")
+    parser.add_argument("--server", help="only this server's events, as in servers.json")
+    parser.add_argument("--kind", action="append", choices=KINDS, help="only events of this kind, repeatable")
+    parser.add_argument("--contains", help="only events whose message contains this text")
+    parser.add_argument("--hours", type=float, default=24, help="events of the last hours (default: %(default)s)")
+    parser.add_argument("--limit", type=int, default=PAGE_ROWS, help="most events shown (default: %(default)s)")
+    parser.add_argument("--count", action="store_true", help="only count the matching events")
+    args = parser.parse_args(argv)
+
+    store = EventStore(args.db, retention_days=None)
+    start = (datetime.now() - timedelta(hours=args.hours)).timestamp()
+    if args.count:
+        print(store.count(start, server=args.server, kinds=args.kind, contains=args.contains))
+    else:
+        events = store.query(start, server=args.server, kinds=args.kind, contains=args.contains, limit=args.limit)
+        for event in reversed(events):
+            print(f"{datetime.fromtimestamp(event.time):%Y-%m-%d %H:%M:%S}  {event.kind:<18}  "
+                  f"{(event.server or '-').title():<20}  {event.message}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""Streams events and probe samples of a time range to CSV, JSONL or Parquet (when pyarrow is installed) for audits.
+
+Rows are read and written a chunk at a time (event pages from the event store, segment by segment or block by block
+from the sample store), so memory stays flat however many rows are exported. The file is written next to its
+target and only moved into place once complete, a cancelled or failed export leaves nothing behind.
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sample_store import FLAG_DEGRADED, FLAG_ERROR, FLAG_HTTP, FLAG_REACHABLE, FLAG_VIA_PARENT, _numpy
+
+CHUNK_ROWS = 65536  # rows converted and written at a time
+EVENTS = "events"
+SAMPLES = "samples"
+DATASETS = (EVENTS, SAMPLES)
+FORMATS = {"csv": ".csv", "jsonl": ".jsonl", "parquet": ".parquet"}
+COLUMNS = {
+    EVENTS: ("time", "kind", "server", "message"),
+    SAMPLES: ("time", "server", "rtt_ms", "reachable", "error", "http", "via_parent", "degraded"),
+}
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def _pyarrow():
+    """pyarrow and pyarrow.parquet if they are installed, None otherwise"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def available_formats() -> List[str]:
+    return [name for name in FORMATS if name != "parquet" or _pyarrow() is not None]
+
+
+def _local_times(times: list) -> List[str]:
+    """iso 8601 local times to the millisecond. Rows come in time order, each second is only formatted once"""
+    seconds = {}
+    formatted = []
+    for when in times:
+        second, millisecond = divmod(round(when * 1000), 1000)
+        prefix = seconds.get(second)
+        if prefix is None:
+            prefix = seconds[second] = datetime.fromtimestamp(second).isoformat()
+        formatted.append(f"{prefix}.{millisecond:03d}")
+    return formatted
+
+
+def _values(column) -> list:
+    return column.tolist() if hasattr(column, "tolist") else column
+
+
+class _CsvWriter:
+    def __init__(self, path: str, dataset: str) -> None:
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS[dataset])
+
+    def write(self, columns: Dict) -> None:
+        values = [_values(column) for column in columns.values()]
+        values[0] = _local_times(values[0])
+        if "rtt_ms" in columns:
+            values[2] = ["" if rtt is None or math.isnan(rtt) else round(rtt, 3) for rtt in values[2]]
+        self._writer.writerows(zip(*values))
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _JsonlWriter:
+    def __init__(self, path: str, dataset: str) -> None:
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, columns: Dict) -> None:
+        names = list(columns)
+        values = [_values(column) for column in columns.values()]
+        values[0] = _local_times(values[0])
+        if "rtt_ms" in columns:
+            values[2] = [None if rtt is None or math.isnan(rtt) else round(rtt, 3) for rtt in values[2]]
+        self._file.writelines(json.dumps(dict(zip(names, row))) + "\n" for row in zip(*values))
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _ParquetWriter:
+    """one row group per chunk, times as millisecond timestamps"""
+
+    def __init__(self, path: str, dataset: str) -> None:
+        pyarrow = _pyarrow()
+        if pyarrow is None:
+            raise ValueError("parquet export needs pyarrow, install it or pick csv or jsonl")
+        self._pyarrow = pyarrow
+        types = {"time": pyarrow.timestamp("ms"), "kind": pyarrow.string(), "server": pyarrow.string(),
+                 "message": pyarrow.string(), "rtt_ms": pyarrow.float32(), "reachable": pyarrow.bool_(),
+                 "error": pyarrow.bool_(), "http": pyarrow.bool_(), "via_parent": pyarrow.bool_(),
+                 "degraded": pyarrow.bool_()}
+        self._schema = pyarrow.schema([(name, types[name]) for name in COLUMNS[dataset]])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write(self, columns: Dict) -> None:
+        pyarrow = self._pyarrow
+        arrays = []
+        for field in self._schema:
+            column = columns[field.name]
+            if field.name == "time":
+                if hasattr(column, "dtype"):
+                    column = (column * 1000).round().astype("int64")
+                else:
+                    column = [round(when * 1000) for when in column]
+                arrays.append(pyarrow.array(column, type=pyarrow.int64()).cast(field.type))
+            else:
+                arrays.append(pyarrow.array(column, type=field.type, from_pandas=field.name == "rtt_ms"))
+        self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+WRITERS = {"csv": _CsvWriter, "jsonl": _JsonlWriter, "parquet": _ParquetWriter}
+
+
+def event_chunks(events, start: float, end: float,
+                 servers: Optional[Iterable[str]] = None) -> Iterator[Tuple[float, Dict]]:
+    """events of a range as (time reached, columns) chunks, oldest first"""
+    servers = set(servers) if servers is not None else None
+    server = next(iter(servers)) if servers is not None and len(servers) == 1 else None
+    chunk = []
+    for event in events.iterate(start, end, server=server, page_rows=CHUNK_ROWS):
+        if servers is None or event.server in servers:
+            chunk.append(event)
+        if len(chunk) >= CHUNK_ROWS:
+            yield chunk[-1].time, _event_columns(chunk)
+            chunk = []
+    if chunk:
+        yield chunk[-1].time, _event_columns(chunk)
+
+
+def _event_columns(chunk: list) -> Dict:
+    return {
+        "time": [event.time for event in chunk],
+        "kind": [event.kind for event in chunk],
+        "server": [event.server for event in chunk],
+        "message": [event.message for event in chunk],
+    }
+
+
+def sample_chunks(samples, start: float, end: float,
+                  servers: Optional[Iterable[str]] = None) -> Iterator[Tuple[float, Dict]]:
+    """probe samples of a range as (time reached, columns) chunks, oldest first. With numpy the columns are arrays
+    sliced out of each segment's records, without it lists"""
+    numpy = _numpy()
+    wanted = None
+    if servers is not None:
+        wanted = {samples.server_ids[name] for name in servers if name in samples.server_ids}
+    for records in samples.scan_segments(start, end):
+        names = samples.server_names  # grows as servers are added, read after the segment
+        if numpy is not None:
+            if wanted is not None:
+                records = records[numpy.isin(records["server"], numpy.fromiter(wanted, dtype=numpy.uint32))]
+            lookup = numpy.array(names, dtype=object)
+            for first in range(0, len(records), CHUNK_ROWS):
+                part = records[first:first + CHUNK_ROWS]
+                flags = part["flags"]
+                yield float(part["time"][-1]), {
+                    "time": part["time"],
+                    "server": lookup[part["server"]],
+                    "rtt_ms": part["rtt"].astype(numpy.float64) * 1000,
+                    "reachable": (flags & FLAG_REACHABLE) != 0,
+                    "error": (flags & FLAG_ERROR) != 0,
+                    "http": (flags & FLAG_HTTP) != 0,
+                    "via_parent": (flags & FLAG_VIA_PARENT) != 0,
+                    "degraded": (flags & FLAG_DEGRADED) != 0,
+                }
+            continue
+        if wanted is not None:
+            records = [record for record in records if record[1] in wanted]
+        for first in range(0, len(records), CHUNK_ROWS):
+            part = records[first:first + CHUNK_ROWS]
+            yield part[-1][0], {
+                "time": [record[0] for record in part],
+                "server": [names[record[1]] for record in part],
+                "rtt_ms": [record[2] * 1000 for record in part],
+                "reachable": [bool(record[3] & FLAG_REACHABLE) for record in part],
+                "error": [bool(record[3] & FLAG_ERROR) for record in part],
+                "http": [bool(record[3] & FLAG_HTTP) for record in part],
+                "via_parent": [bool(record[3] & FLAG_VIA_PARENT) for record in part],
+                "degraded": [bool(record[3] & FLAG_DEGRADED) for record in part],
+            }
+
+
+def export(path: str, file_format: str, chunks: Iterable[Tuple[float, Dict]], dataset: str, start: float,
+           end: float, progress: Optional[Callable[[float, int], None]] = None,
+           cancel: Optional[threading.Event] = None) -> int:
+    """writes chunks to a file, atomically
+
+    :param path: file written
+    :type path: str
+    :param file_format: one of FORMATS
+    :type file_format: str
+    :param chunks: from event_chunks or sample_chunks
+    :type chunks: Iterable[Tuple[float, Dict]]
+    :param dataset: EVENTS or SAMPLES
+    :type dataset: str
+    :param progress: called after every chunk with the share of the time range done and the rows written,
+        defaults to None
+    :type progress: Callable[[float, int], None], optional
+    :param cancel: stops the export when set, defaults to None
+    :type cancel: threading.Event, optional
+    :raises ExportCancelled: when cancel was set
+    :return: rows written
+    :rtype: int
+    """
+    temp_path = path + ".tmp"
+    writer = WRITERS[file_format](temp_path, dataset)
+    rows = 0
+    try:
+        for reached, columns in chunks:
+            if cancel is not None and cancel.is_set():
+                raise ExportCancelled()
+            writer.write(columns)
+            rows += len(columns["time"])
+            if progress is not None:
+                progress(min(1.0, max(0.0, (reached - start) / (end - start))) if end > start else 1.0, rows)
+        writer.close()
+        os.replace(temp_path, path)
+    except BaseException:
+        writer.close()
+        os.remove(temp_path)
+        raise
+    return rows
+
+
+def export_path(base: str, dataset: str, file_format: str) -> str:
+    """gcs_export.csv becomes gcs_export_events.csv and gcs_export_samples.csv"""
+    root, _ = os.path.splitext(base)
+    return f"{root}_{dataset}{FORMATS[file_format]}"
+
+
+def main(argv=None) -> None:
+    from event_store import EVENTS_FILE, EventStore
+    from sample_store import SAMPLES_DIR, SampleStore
+    parser = argparse.ArgumentParser(description="Export the GCS control panel's events and probe samples.")
+    parser.add_argument("output", help="base file name, the dataset and format are added to it")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--dataset", choices=DATASETS, action="append", help="default: both")
+    parser.add_argument("--hours", type=float, default=24, help="the last hours (default: %(default)s)")
+    parser.add_argument("--server", action="append", help="only this server, repeatable")
+    parser.add_argument("--events", default=EVENTS_FILE, help="event database (default: %(default)s)")
+    parser.add_argument("--samples", default=SAMPLES_DIR, help="sample store (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    end = time.time()
+    start = (datetime.now() - timedelta(hours=args.hours)).timestamp()
+    for dataset in args.dataset or DATASETS:
+        path = export_path(args.output, dataset, args.format)
+        if dataset == EVENTS:
+            store = EventStore(args.events, retention_days=None)
+            chunks = event_chunks(store, start, end, args.server)
+        else:
+            store = SampleStore(args.samples, compress=False)
+            chunks = sample_chunks(store, start, end, args.server)
+        began = time.perf_counter()
+        rows = export(path, args.format, chunks, dataset, start, end)
+        store.close()
+        print(f"{rows} {dataset} written to {path} in {time.perf_counter() - began:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
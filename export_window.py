@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+from typing import List
+
+from PyQt5.QtCore import QDateTime
+from PyQt5.QtWidgets import (
+    QCheckBox, QComboBox, QDateTimeEdit, QDialog, QFileDialog, QFormLayout, QLineEdit, QMessageBox, QPushButton,
+    QVBoxLayout
+)
+
+from export import DATASETS, FORMATS, available_formats
+
+DEFAULT_EXPORT_DAYS = 7
+
+
+class ExportWindow(QDialog):
+    def __init__(self, server_names: List[str], width: int = 420, height: int = 300) -> None:
+        """asks for the time range, servers, datasets and format of a history export and the file to write it to.
+        The choices are in options once the dialog is accepted
+
+        :param server_names: servers that can be picked
+        :type server_names: List[str]
+        :param width: width of dialog, defaults to 420
+        :type width: int, optional
+        :param height: height of dialog, defaults to 300
+        :type height: int, optional
+        """
+        super().__init__()
+        self.setWindowTitle("Export History")
+        self.setGeometry(100, 100, width, height)
+        self.server_names = {name.lower(): name for name in server_names}
+        self.options = None
+
+        now = datetime.now()
+        self.start_input = QDateTimeEdit(QDateTime(now - timedelta(days=DEFAULT_EXPORT_DAYS)), self)
+        self.start_input.setCalendarPopup(True)
+        self.end_input = QDateTimeEdit(QDateTime(now), self)
+        self.end_input.setCalendarPopup(True)
+        # comma separated, left empty every server is exported
+        self.servers_input = QLineEdit(self)
+        self.servers_input.setPlaceholderText("all servers")
+        self.dataset_inputs = {dataset: QCheckBox(dataset.title(), self) for dataset in DATASETS}
+        for checkbox in self.dataset_inputs.values():
+            checkbox.setChecked(True)
+        self.format_input = QComboBox(self)
+        self.format_input.addItems(available_formats())
+
+        form_layout = QFormLayout()
+        form_layout.addRow("From:", self.start_input)
+        form_layout.addRow("To:", self.end_input)
+        form_layout.addRow("Servers:", self.servers_input)
+        for dataset, checkbox in self.dataset_inputs.items():
+            form_layout.addRow("Include:" if dataset == DATASETS[0] else "", checkbox)
+        form_layout.addRow("Format:", self.format_input)
+
+        self.export_button = QPushButton("Export", self)
+        self.export_button.clicked.connect(self.choose_file)
+
+        layout = QVBoxLayout()
+        layout.addLayout(form_layout)
+        layout.addWidget(self.export_button)
+        self.setLayout(layout)
+
+    def choose_file(self) -> None:
+        servers = None
+        if self.servers_input.text().strip():
+            servers = []
+            for name in self.servers_input.text().split(","):
+                name = name.strip().lower()
+                if name not in self.server_names:
+                    QMessageBox.warning(self, "Error", f"Unknown server: {name}")
+                    return
+                servers.append(self.server_names[name])
+        datasets = [dataset for dataset, checkbox in self.dataset_inputs.items() if checkbox.isChecked()]
+        start = self.start_input.dateTime().toSecsSinceEpoch()
+        end = self.end_input.dateTime().toSecsSinceEpoch()
+        if not datasets or end <= start:
+            QMessageBox.warning(self, "Error", "Pick at least one dataset and a range that ends after it starts.")
+            return
+        file_format = self.format_input.currentText()
+        default_name = datetime.now().strftime("gcs_export_%Y_%m_%d") + FORMATS[file_format]
+        path, _ = QFileDialog.getSaveFileName(self, "Export History", default_name)
+        if not path:
+            return
+        self.options = {"path": path, "format": file_format, "datasets": datasets, "servers": servers,
+                        "start": float(start), "end": float(end)}
+        self.accept()
@@ -0,0 +1,215 @@
+"""Questions about the fleet's past: a server's status at a time, the stretches it spent up or down, when it last
+changed or was last reachable, and which servers were down during a window.
+
+Point queries bisect one server's change arrays in AvailabilityHistory. Fleet wide queries work on every server's
+changes packed back to back into numpy arrays, rebuilt only when the history changed, and answer for the whole fleet
+with one searchsorted or one weighted bincount. Without numpy they fall back to a bisect per server.
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from availability import STATE_DOWN, STATE_UNKNOWN, STATE_UP, AvailabilityHistory
+from sample_store import _numpy
+
+SERVERS_FILE = "servers.json"
+STATE_NAMES = {STATE_UP: "up", STATE_DOWN: "down", STATE_UNKNOWN: "unknown"}
+_STATES_BY_NAME = {name: state for state, name in STATE_NAMES.items()}
+
+
+class _Packed:
+    """every server's changes in flat arrays. A change's key is its server's rank times span plus its time since
+    base, so the keys of all servers are sorted and one searchsorted finds every server's position at once"""
+
+    __slots__ = ("version", "names", "offsets", "times", "states", "ranks", "next_times", "keys", "base", "span")
+
+    def __init__(self, numpy, version: int, names: List[str], offsets: List[int], times, states: bytes) -> None:
+        self.version = version
+        self.names = names
+        self.offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        self.times = numpy.frombuffer(times, dtype=numpy.float64) if len(times) else numpy.zeros(0)
+        self.states = numpy.frombuffer(states, dtype=numpy.uint8)
+        self.ranks = numpy.repeat(numpy.arange(len(names)), numpy.diff(self.offsets))
+        # the time each state ended, inf for a server's current state
+        self.next_times = numpy.append(self.times[1:], numpy.inf)[:len(self.times)]
+        self.next_times[self.offsets[1:] - 1] = numpy.inf
+        self.base = float(self.times.min()) if len(self.times) else 0.0
+        self.span = (float(self.times.max()) - self.base if len(self.times) else 0.0) + 2
+        self.keys = self.ranks * self.span + (self.times - self.base)
+
+    def positions(self, numpy, when: float):
+        """index of each server's last change at or before a time, its offset minus one if there is none"""
+        relative = min(max(when - self.base, -1.0), self.span - 1)
+        return numpy.searchsorted(self.keys, numpy.arange(len(self.names)) * self.span + relative, side="right") - 1
+
+
+class HistoryQuery:
+    """the query api over an AvailabilityHistory"""
+
+    def __init__(self, history: AvailabilityHistory) -> None:
+        self.history = history
+        self._packed = None
+
+    def _pack(self):
+        numpy = _numpy()
+        if numpy is None:
+            return None, None
+        if self._packed is None or self._packed.version != self.history.version:
+            version = self.history.version
+            self._packed = _Packed(numpy, version, *self.history.packed())
+        return numpy, self._packed
+
+    def status_at(self, server_name: str, when: float) -> int:
+        """STATE_UP, STATE_DOWN or STATE_UNKNOWN"""
+        return self.history.state_at(server_name, when)
+
+    def intervals(self, server_name: str, state: int, start: float, end: float,
+                  now: Optional[float] = None) -> List[Tuple[float, float]]:
+        return self.history.intervals(server_name, state, start, end, now)
+
+    def last_change(self, server_name: str) -> Optional[Tuple[float, int]]:
+        return self.history.last_change(server_name)
+
+    def last_up(self, server_name: str, now: Optional[float] = None) -> Optional[float]:
+        """when the server was last reachable, now if it is, None if it never was"""
+        return self.history.last_in_state(server_name, STATE_UP, now)
+
+    def statuses_at(self, when: float) -> Dict[str, int]:
+        """every server's state at a time"""
+        numpy, packed = self._pack()
+        if numpy is None:
+            return {name: self.history.state_at(name, when) for name in self.history.names()}
+        positions = packed.positions(numpy, when)
+        known = positions >= packed.offsets[:-1]
+        states = numpy.where(known, packed.states[numpy.maximum(positions, 0)], STATE_UNKNOWN)
+        return dict(zip(packed.names, states.tolist()))
+
+    def down_during(self, start: float, end: float, now: Optional[float] = None) -> Dict[str, float]:
+        """servers that were down at some point between start and end, with the seconds they were down
+
+        :param now: the last known state lasts until now, defaults to the current time
+        :type now: float, optional
+        :rtype: Dict[str, float]
+        """
+        end = min(end, time.time() if now is None else now)
+        numpy, packed = self._pack()
+        if numpy is None:
+            down = {}
+            for name in self.history.names():
+                seconds = sum(until - since for since, until in self.history.intervals(name, STATE_DOWN, start, end,
+                                                                                       now))
+                if seconds > 0:
+                    down[name] = seconds
+            return down
+        overlap = numpy.minimum(packed.next_times, end) - numpy.maximum(packed.times, start)
+        overlap = numpy.where((packed.states == STATE_DOWN) & (overlap > 0), overlap, 0.0)
+        seconds = numpy.bincount(packed.ranks, weights=overlap, minlength=len(packed.names))
+        return {packed.names[rank]: float(seconds[rank]) for rank in numpy.flatnonzero(seconds > 0)}
+
+
+def load(names: List[str], days: float, events_path: Optional[str] = None, log_pattern: Optional[str] = None,
+         history: Optional[AvailabilityHistory] = None) -> HistoryQuery:
+    """reads a history out of the event store, and the text logs for the time before it, the way the panel does
+
+    :param names: servers to load
+    :type names: List[str]
+    :param days: how far back to read
+    :type days: float
+    :rtype: HistoryQuery
+    """
+    from event_store import EVENTS_FILE, EventStore
+    from rotating_log import LOG_FILE_PATTERN, RotatingLog
+    history = history or AvailabilityHistory()
+    events = EventStore(events_path or EVENTS_FILE, retention_days=None)
+    history.load_events(events, names, days)
+    first = events.first_time()
+    events.close()
+    log = RotatingLog(pattern=log_pattern or LOG_FILE_PATTERN, compression=None)
+    history.load_log(log, names, days, end=datetime.fromtimestamp(first) if first is not None else None)
+    return HistoryQuery(history)
+
+
+def _parse_time(value: str) -> float:
+    """"now", "HH:MM" today, "YYYY-MM-DD", "YYYY-MM-DD HH:MM" or "YYYY-MM-DD HH:MM:SS" """
+    if value == "now":
+        return time.time()
+    for pattern in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, pattern).timestamp()
+        except ValueError:
+            pass
+    try:
+        clock = datetime.strptime(value, "%H:%M")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a time: {value!r}")
+    return datetime.now().replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0).timestamp()
+
+
+def _format_time(when: Optional[float]) -> str:
+    return "never" if when is None else f"{datetime.fromtimestamp(when):%Y-%m-%d %H:%M:%S}"
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Query the GCS fleet's availability history.")
+    parser.add_argument("--days", type=float, default=31, help="history read (default: %(default)s days)")
+    parser.add_argument("--json", action="store_true", help="print json instead of text")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("status-at", help="a server's state at a time, or every server's")
+    command.add_argument("time", type=_parse_time)
+    command.add_argument("server", nargs="?")
+    command = commands.add_parser("intervals", help="the stretches a server spent in a state")
+    command.add_argument("server")
+    command.add_argument("state", choices=sorted(_STATES_BY_NAME))
+    command.add_argument("start", type=_parse_time)
+    command.add_argument("end", type=_parse_time, nargs="?", default="now")
+    command = commands.add_parser("down-during", help="servers down at some point between two times")
+    command.add_argument("start", type=_parse_time)
+    command.add_argument("end", type=_parse_time, nargs="?", default="now")
+    command = commands.add_parser("last-change", help="a server's latest change")
+    command.add_argument("server")
+    command = commands.add_parser("last-up", help="when a server was last reachable")
+    command.add_argument("server")
+    args = parser.parse_args(argv)
+
+    with open(SERVERS_FILE) as file:
+        names = list(json.load(file))
+    by_lower = {name.lower(): name for name in names}
+    server = getattr(args, "server", None)
+    if server is not None:
+        if server.lower() not in by_lower:
+            parser.error(f"unknown server {server!r}")
+        server = by_lower[server.lower()]
+    query = load(names, args.days)
+
+    if args.command == "status-at":
+        statuses = {server: query.status_at(server, args.time)} if server else query.statuses_at(args.time)
+        result = {name: STATE_NAMES[state] for name, state in statuses.items()}
+    elif args.command == "intervals":
+        result = [{"start": _format_time(since), "end": _format_time(until), "seconds": round(until - since)}
+                  for since, until in query.intervals(server, _STATES_BY_NAME[args.state], args.start, args.end)]
+    elif args.command == "down-during":
+        down = query.down_during(args.start, args.end)
+        result = {name: round(seconds) for name, seconds in sorted(down.items(), key=lambda item: -item[1])}
+    elif args.command == "last-change":
+        change = query.last_change(server)
+        result = None if change is None else {"time": _format_time(change[0]), "state": STATE_NAMES[change[1]]}
+    else:
+        result = _format_time(query.last_up(server))
+
+    if args.json:
+        print(json.dumps(result, indent=4))
+    elif isinstance(result, dict) and args.command in ("status-at", "down-during"):
+        unit = " s down" if args.command == "down-during" else ""
+        for name, value in result.items():
+            print(f"{name.title():<30} {value}{unit}")
+    elif isinstance(result, list):
+        for interval in result:
+            print(f"{interval['start']}  {interval['end']}  {interval['seconds']} s")
+    else:
+        print(result if not isinstance(result, dict) else f"{result['time']}  {result['state']}")
+
+
+if __name__ == "__main__":
+    main()
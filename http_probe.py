@@ -0,0 +1,244 @@
+import http.client
+import socket
+import ssl
+import threading
+import time
+from typing import Dict, Optional
+
+DEFAULT_TIMEOUT = 2  # seconds, same budget as the icmp ping
+MAX_CONNECTIONS_PER_HOST = 2
+MAX_CONCURRENT_PROBES = 64
+MAX_BODY_BYTES = 64 * 1024  # bodies larger than this are not searched past and the connection is dropped
+IDLE_CONNECTION_TTL = 30  # seconds an idle keep-alive connection is kept before it is closed
+
+
+class ProbeDeadlineExceeded(Exception):
+    """raised when a probe could not finish inside its deadline"""
+
+
+class HttpProbeResult:
+    """outcome of a single http health-check probe"""
+
+    __slots__ = ("ok", "status", "ttfb", "total", "error", "reused")
+
+    def __init__(self, ok: bool, status: Optional[int] = None, ttfb: Optional[float] = None,
+                 total: Optional[float] = None, error: Optional[str] = None, reused: bool = False) -> None:
+        self.ok = ok
+        self.status = status
+        self.ttfb = ttfb
+        self.total = total
+        self.error = error
+        self.reused = reused
+
+    def __repr__(self) -> str:
+        return (f"HttpProbeResult(ok={self.ok}, status={self.status}, ttfb={self.ttfb}, "
+                f"total={self.total}, error={self.error!r}, reused={self.reused})")
+
+
+class ConnectionPool:
+    """keeps keep-alive connections per host so a probe every 5 s does not reconnect every time.
+
+    Every host gets at most max_per_host open connections (idle and busy together), a probe that
+    finds all of them busy waits for one until its deadline.
+    """
+
+    def __init__(self, max_per_host: int = MAX_CONNECTIONS_PER_HOST, idle_ttl: float = IDLE_CONNECTION_TTL) -> None:
+        self.max_per_host = max_per_host
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._idle = {}  # key -> list of (connection, time it was released)
+        self._slots = {}  # key -> BoundedSemaphore limiting open connections for that host
+        self._ssl_context = ssl.create_default_context()
+        self._unverified_context = ssl._create_unverified_context()
+
+    def _slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[key]
+
+    def acquire(self, scheme: str, host: str, port: int, deadline: float, verify: bool = True):
+        """returns (connection, reused) for the host, blocking until a slot frees up or the deadline passes
+
+        :raises ProbeDeadlineExceeded: if no connection slot became available before the deadline
+        """
+        key = (scheme, host, port, verify)
+        if not self._slot(key).acquire(timeout=max(0.0, deadline - time.monotonic())):
+            raise ProbeDeadlineExceeded(f"no free connection to {host}:{port}")
+
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                connection, released_at = idle.pop()
+                if now - released_at < self.idle_ttl and connection.sock is not None:
+                    return connection, True
+                connection.close()
+
+        timeout = max(0.001, deadline - now)
+        if scheme == "https":
+            context = self._ssl_context if verify else self._unverified_context
+            connection = http.client.HTTPSConnection(host, port, timeout=timeout, context=context)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        return connection, False
+
+    def release(self, connection, scheme: str, host: str, port: int, verify: bool = True, reusable: bool = True) -> None:
+        """gives a connection back to the pool, closing it if it can not be reused"""
+        key = (scheme, host, port, verify)
+        if reusable and connection.sock is not None:
+            with self._lock:
+                self._idle.setdefault(key, []).append((connection, time.monotonic()))
+        else:
+            connection.close()
+        self._slot(key).release()
+
+    def close_all(self) -> None:
+        """closes every idle connection"""
+        with self._lock:
+            for connections in self._idle.values():
+                for connection, _ in connections:
+                    connection.close()
+            self._idle.clear()
+
+
+class HttpProber:
+    """runs http(s) health checks against a path, checking the status code and optionally a body substring.
+
+    A global semaphore caps the number of probes in flight so a large number of slow endpoints can not
+    use up every socket, and every probe gets a strict deadline covering waiting, connecting and reading.
+    """
+
+    def __init__(self, max_per_host: int = MAX_CONNECTIONS_PER_HOST, max_concurrent: int = MAX_CONCURRENT_PROBES) -> None:
+        self.pool = ConnectionPool(max_per_host=max_per_host)
+        self._concurrency = threading.BoundedSemaphore(max_concurrent)
+
+    def probe(self, host: str, path: str = "/", port: Optional[int] = None, scheme: str = "http",
+              expected_status: int = 200, body_contains: Optional[str] = None,
+              timeout: float = DEFAULT_TIMEOUT, verify: bool = True) -> HttpProbeResult:
+        """sends a GET request for path to the host and checks the response
+
+        :param host: ip address or host name of the server
+        :type host: str
+        :param path: url path to request, defaults to "/"
+        :type path: str, optional
+        :param port: port to connect to, defaults to 80 for http and 443 for https
+        :type port: int, optional
+        :param scheme: "http" or "https", defaults to "http"
+        :type scheme: str, optional
+        :param expected_status: status code that counts as healthy, defaults to 200
+        :type expected_status: int, optional
+        :param body_contains: text that must appear in the body for the probe to pass, defaults to None
+        :type body_contains: str, optional
+        :param timeout: deadline in seconds for the whole probe, defaults to DEFAULT_TIMEOUT
+        :type timeout: float, optional
+        :param verify: whether to verify the https certificate, defaults to True
+        :type verify: bool, optional
+        :return: the probe result with time to first byte and total time in seconds
+        :rtype: HttpProbeResult
+        """
+        if scheme not in ("http", "https"):
+            return HttpProbeResult(ok=False, error=f"unsupported scheme {scheme!r}")
+        if port is None:
+            port = 443 if scheme == "https" else 80
+        if not path.startswith("/"):
+            path = "/" + path
+
+        start = time.monotonic()
+        deadline = start + timeout
+        if not self._concurrency.acquire(timeout=timeout):
+            return HttpProbeResult(ok=False, error="too many probes in flight")
+        try:
+            try:
+                return self._request(host, port, scheme, path, expected_status, body_contains, start, deadline, verify)
+            except ProbeDeadlineExceeded as e:
+                return HttpProbeResult(ok=False, error=str(e), total=time.monotonic() - start)
+        finally:
+            self._concurrency.release()
+
+    def _request(self, host, port, scheme, path, expected_status, body_contains, start, deadline, verify) -> HttpProbeResult:
+        # a pooled connection may have been closed by the server while idle, in that case retry once on a fresh one
+        for attempt in range(2):
+            connection, reused = self.pool.acquire(scheme, host, port, deadline, verify)
+            reusable = False
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ProbeDeadlineExceeded(f"deadline exceeded before sending request to {host}")
+                connection.timeout = remaining
+                if connection.sock is None:
+                    connection.connect()
+                connection.sock.settimeout(max(0.001, deadline - time.monotonic()))
+
+                connection.request("GET", path, headers={"Connection": "keep-alive", "User-Agent": "gcs-control-panel"})
+                response = connection.getresponse()
+                ttfb = time.monotonic() - start
+
+                body, complete = self._read_body(connection, response, deadline)
+                total = time.monotonic() - start
+                reusable = complete and not response.will_close
+
+                if response.status != expected_status:
+                    return HttpProbeResult(ok=False, status=response.status, ttfb=ttfb, total=total, reused=reused,
+                                           error=f"expected status {expected_status}, got {response.status}")
+                if body_contains and body_contains.encode() not in body:
+                    return HttpProbeResult(ok=False, status=response.status, ttfb=ttfb, total=total, reused=reused,
+                                           error=f"body does not contain {body_contains!r}")
+                return HttpProbeResult(ok=True, status=response.status, ttfb=ttfb, total=total, reused=reused)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                if reused and attempt == 0:
+                    continue
+                return HttpProbeResult(ok=False, error=str(e) or type(e).__name__, total=time.monotonic() - start)
+            except socket.timeout:
+                return HttpProbeResult(ok=False, error="timed out", total=time.monotonic() - start)
+            except (OSError, http.client.HTTPException) as e:
+                return HttpProbeResult(ok=False, error=str(e) or type(e).__name__, total=time.monotonic() - start)
+            finally:
+                self.pool.release(connection, scheme, host, port, verify, reusable=reusable)
+
+    def _read_body(self, connection, response, deadline: float):
+        """reads the response body up to MAX_BODY_BYTES, returns the body and whether it was read completely
+
+        a body that was cut short leaves unread bytes on the connection, so it can not go back to the pool
+        """
+        chunks = []
+        size = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout()
+            connection.sock.settimeout(remaining)
+            chunk = response.read(min(16384, MAX_BODY_BYTES - size)) if size < MAX_BODY_BYTES else b""
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        body = b"".join(chunks)
+        if not response.isclosed():
+            response.close()
+            return body, False
+        return body, True
+
+    def probe_config(self, host: str, config: Dict) -> HttpProbeResult:
+        """runs a probe using the "http" section of a server entry in servers.json
+
+        :param host: ip address of the server
+        :type host: str
+        :param config: dictionary with optional keys path, port, scheme, expected_status, body_contains, timeout, verify
+        :type config: Dict
+        :return: the probe result
+        :rtype: HttpProbeResult
+        """
+        return self.probe(
+            host,
+            path=config.get("path", "/"),
+            port=config.get("port"),
+            scheme=config.get("scheme", "http"),
+            expected_status=int(config.get("expected_status", 200)),
+            body_contains=config.get("body_contains"),
+            timeout=float(config.get("timeout", DEFAULT_TIMEOUT)),
+            verify=config.get("verify", True),
+        )
+
+    def close(self) -> None:
+        self.pool.close_all()
@@ -0,0 +1,247 @@
+import bisect
+import json
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Dict, Optional
+
+from sample_store import _numpy
+
+# histogram bucket upper bounds in seconds, doubling from 10 microseconds up to about 3 minutes
+BUCKET_BOUNDS = [0.00001 * 2 ** i for i in range(25)]
+STALL_THRESHOLD = 0.25  # seconds the loop may go without a beat before it counts as stalled
+HEARTBEAT_INTERVAL = 0.05  # seconds between beats from the watched loop
+MAX_STALLS = 20  # stalls kept with their stack samples
+FOLD_VALUES = 1024  # observations a histogram collects before counting them into its buckets
+
+
+class Histogram:
+    """counts observations in fixed log-scale buckets, cheap enough to sit on every hot path
+
+    observe only appends to a list, which is safe from any thread without a lock. The values are counted into the
+    buckets in bulk, with numpy when it is installed, once FOLD_VALUES have piled up or when the histogram is read.
+    """
+
+    __slots__ = ("values", "counts", "count", "total", "min", "max", "_lock")
+
+    def __init__(self) -> None:
+        self.values = []  # observations not counted into the buckets yet
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()  # one fold at a time
+
+    def observe(self, seconds: float) -> None:
+        values = self.values
+        values.append(seconds)
+        if len(values) >= FOLD_VALUES:
+            self.fold()
+
+    def fold(self) -> None:
+        """counts the pending observations into the buckets"""
+        with self._lock:
+            # values appended while this runs sit past the slice and stay for the next fold
+            pending = len(self.values)
+            if not pending:
+                return
+            values = self.values[:pending]
+            del self.values[:pending]
+            numpy = _numpy()
+            if numpy is not None:
+                indexes = numpy.searchsorted(numpy.array(BUCKET_BOUNDS), numpy.array(values), side="left")
+                for index, count in enumerate(numpy.bincount(indexes, minlength=len(self.counts)).tolist()):
+                    self.counts[index] += count
+            else:
+                for seconds in values:
+                    self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+            self.count += pending
+            self.total += sum(values)
+            low, high = min(values), max(values)
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """upper bound of the bucket holding the q quantile, capped at the largest value seen"""
+        self.fold()
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                bound = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict:
+        """summary in milliseconds"""
+        ms = lambda value: None if value is None else round(value * 1000, 3)
+        self.fold()
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count) if self.count else None,
+            "min_ms": ms(self.min),
+            "p50_ms": ms(self.quantile(0.50)),
+            "p95_ms": ms(self.quantile(0.95)),
+            "p99_ms": ms(self.quantile(0.99)),
+            "max_ms": ms(self.max),
+            "total_ms": ms(self.total),
+        }
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram) -> None:
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Instrumentation:
+    """named counters and timing histograms for the panel's hot paths
+
+    usage:
+        with instrumentation.timer("log_write"):
+            ...
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.started = time.time()
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram())
+        return histogram
+
+    def timer(self, name: str):
+        """context manager timing the block into the named histogram"""
+        if not self.enabled:
+            return _NULL_TIMER
+        histogram = self._histograms.get(name)
+        return _Timer(histogram if histogram is not None else self.histogram(name))
+
+    def observe(self, name: str, seconds: float) -> None:
+        if self.enabled:
+            histogram = self._histograms.get(name)
+            (histogram if histogram is not None else self.histogram(name)).observe(seconds)
+
+    def increment(self, name: str, count: int = 1) -> None:
+        if self.enabled:
+            with self._lock:
+                self._counters[name] = self._counters.get(name, 0) + count
+
+    def snapshot(self) -> Dict:
+        """every counter and histogram as a json friendly dictionary"""
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = dict(self._counters)
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "counters": counters,
+            "timings": {name: histogram.to_dict() for name, histogram in sorted(histograms.items())},
+        }
+
+
+class StallWatchdog:
+    """detects stalls of an event loop from how late its heartbeat timer fires.
+
+    The watched loop calls beat() from a repeating timer (a QTimer, or loop.call_later under asyncio) every
+    HEARTBEAT_INTERVAL. Every beat records its lateness as loop lag. A watchdog thread notices when no beat has
+    arrived for longer than the threshold and samples the loop thread's stack while it is still stuck, so the stall
+    can be traced to the code that caused it.
+    """
+
+    def __init__(self, instrumentation: Instrumentation, threshold: float = STALL_THRESHOLD,
+                 interval: float = HEARTBEAT_INTERVAL) -> None:
+        self.instrumentation = instrumentation
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = deque(maxlen=MAX_STALLS)
+        self._loop_thread_id = None
+        self._last_beat = None
+        self._current_stall = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """starts watching, must be called from the loop's own thread"""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="stall-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def beat(self) -> None:
+        """called by the loop's heartbeat timer"""
+        now = time.perf_counter()
+        with self._lock:
+            lateness = max(0.0, now - self._last_beat - self.interval)
+            self._last_beat = now
+            stall, self._current_stall = self._current_stall, None
+        self.instrumentation.observe("loop_lag", lateness)
+        if stall is not None:
+            stall["duration_ms"] = round((lateness + self.interval) * 1000, 1)
+            self.instrumentation.increment("stalls")
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                blocked_for = time.perf_counter() - self._last_beat
+                if blocked_for < self.threshold or self._current_stall is not None:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = traceback.format_stack(frame) if frame is not None else []
+                self._current_stall = {
+                    "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "duration_ms": None,  # filled in by the beat that ends the stall
+                    "stack": [line.rstrip() for line in stack],
+                }
+                self.stalls.append(self._current_stall)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "threshold_ms": self.threshold * 1000,
+                "blocked_for_ms": round((time.perf_counter() - self._last_beat) * 1000, 1) if self._last_beat else None,
+                "stalls": list(self.stalls),
+            }
+
+
+def dump_json(path: str, diagnostics: Dict) -> None:
+    """writes a diagnostics snapshot to path"""
+    with open(path, "w") as file:
+        json.dump(diagnostics, file, indent=4, default=str)
@@ -1,21 +1,112 @@
+import time
+
+PROCESS_START = time.perf_counter()  # taken before the heavy imports so --measure-startup counts them
+
 import sys
 import os
 import json
-from functools import partial
-from typing import Dict
-from add_server_window import AddServerWindow
-from ping3 import ping
+import argparse
+import sqlite3
+import threading
+from typing import Dict, List
+from alerts import DOWN, UP, Transition, load_dispatcher
+from anomaly import AnomalyDetector
+from availability import STATE_DOWN, STATE_UNKNOWN, AvailabilityHistory, state_code
+from event_store import (
+    EVENTS_FILE, KIND_ANOMALY, KIND_ANOMALY_CLEARED, KIND_DEGRADED, KIND_DOWN, KIND_ERROR, KIND_MESSAGE,
+    KIND_MONITORING_STARTED, KIND_MONITORING_STOPPED, KIND_PATH_TRACE, KIND_RECOVERED, KIND_SERVER_ADDED, KIND_UP, KINDS,
+    EventStore
+)
+from instrumentation import Instrumentation, StallWatchdog
+from probe_engine import PARENT_DOWN_INTERVAL, PRIORITY_HIGH, PROBE_INTERVAL, ProbeEngine, ProbeResult
+from quantiles import merged, report
+from rollups import ROLLUPS_DIR, RollupStore, write_rollups
+from rotating_log import LOG_FILE_PATTERN, RotatingLog
+from sample_store import (
+    FLAG_DEGRADED, FLAG_ERROR, FLAG_HTTP, FLAG_REACHABLE, FLAG_VIA_PARENT, SAMPLES_DIR, SampleStore
+)
+from server_state import (
+    EVENT_DEGRADED, EVENT_ERROR, EVENT_OFFLINE, EVENT_ONLINE, EVENT_RECOVERED, ServerGroup, ServerModel, ServerState
+)
+from sparkline import Sparkline
+from state_snapshot import SNAPSHOT_FILE, capture, load_snapshot, write_snapshot
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QLabel, QPushButton, QVBoxLayout, QHBoxLayout, QWidget,
-    QTableWidget, QTableWidgetItem, QSizePolicy, QHeaderView, QGridLayout, QStackedWidget, QAbstractScrollArea, QScrollArea
+    QTableWidget, QTableWidgetItem, QSizePolicy, QHeaderView, QGridLayout, QStackedWidget, QAbstractScrollArea, QScrollArea,
+    QPlainTextEdit, QShortcut, QDialog, QProgressDialog
 )
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QPixmap
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+from PyQt5.QtGui import QPixmap, QKeySequence
 from datetime import datetime
 
-from ping3 import ping
-
 JSON_FILE = "servers.json"
+MEASURE_STARTUP_TIMEOUT = 60  # seconds --measure-startup waits for every server's first status
+MEASURE_INSTRUMENTATION_SERVERS = 50  # fewer than GROUPED_VIEW_MIN_SERVERS, so each server repaints a tile of its own
+MEASURE_INSTRUMENTATION_ROUNDS = 21  # rounds --measure-instrumentation times with instrumentation on and off each
+SNAPSHOT_INTERVAL = 60000  # ms between state snapshots, one is also written at shutdown
+STATUS_COLORS = {True: "green", False: "red"}
+STALE_STATUS_COLORS = {True: "#3c6e3c", False: "#7a2e2e"}  # dimmed until the first probe confirms the state
+VIA_PARENT_COLOR = "#b36b00"  # unreachable because the server it depends on is down
+DEGRADED_COLOR = "#c9a400"  # reachable, but its burst probes lose or jitter past its thresholds
+ANOMALY_COLOR = "#7d55c7"  # reachable, but its rtt or loss has been far above its own baseline for a while
+GROUPED_VIEW_MIN_SERVERS = 100  # larger fleets open as collapsed group tiles instead of one tile per server
+LOG_HISTORY_ROWS = 200  # earlier events loaded into the log table per click
+LOG_VIEW_KINDS = tuple(kind for kind in KINDS if kind != KIND_MONITORING_STARTED)  # as written to the text log
+EVENT_STATUS_LABELS = {KIND_UP: "Online", KIND_DOWN: "Offline", KIND_ERROR: "Offline", KIND_DEGRADED: "Degraded",
+                       KIND_RECOVERED: "Online", KIND_ANOMALY: "Anomalous", KIND_ANOMALY_CLEARED: "Online",
+                       KIND_MONITORING_STOPPED: "Stopped"}
+
+STYLESHEET = """
+QWidget {
+    background-color: #2b2b2b;
+    color: #ffffff;
+    font-size: 14px;
+}
+QLabel {
+    font-weight: bold;
+    color: #dcdcdc;
+}
+QPushButton {
+    font-size: 14px;
+    font-weight: bold;
+    padding: 8px;
+    border-radius: 8px;
+    background-color: #0078d7;
+    color: white;
+}
+QPushButton:hover {
+    background-color: #005a9e;
+}
+QPushButton:pressed {
+    background-color: #004080;
+}
+QTableWidget {
+    background-color: #1e1e1e;
+    border: 1px solid #444;
+}
+QTableWidget::item {
+    padding: 6px;
+}
+QHeaderView::section {
+    background-color: #444;
+    color: white;
+    padding: 4px;
+    font-weight: bold;
+}
+QScrollBar:vertical, QScrollBar:horizontal {
+    background: #333;
+    border: none;
+    width: 10px;
+    height: 10px;
+}
+QScrollBar::handle:vertical, QScrollBar::handle:horizontal {
+    background: #0078d7;
+    border-radius: 5px;
+}
+QScrollBar::handle:vertical:hover, QScrollBar::handle:horizontal:hover {
+    background: #005a9e;
+}
+"""
 
 def get_servers() -> Dict:
     """reads the server names and ips from the json file in JSON_FILE
@@ -39,64 +130,78 @@ def get_servers() -> Dict:
 
 
 class MainWindow(QMainWindow):
-    def __init__(self, width, height, logo_path, log_file):
+    # probe results arrive on worker threads, the signal hands them over to the gui thread
+    probe_finished = pyqtSignal(object)
+    # path traces finish on their own worker threads as well
+    path_traced = pyqtSignal(str, object)
+    alert_event = pyqtSignal(str)
+    # the availability history is read out of the logs on a background thread when the timeline is first shown
+    availability_loaded = pyqtSignal(int)
+    # history exports run on a worker thread, it reports progress and the outcome through these
+    export_progress = pyqtSignal(float, int)
+    export_finished = pyqtSignal(str)
+
+    def __init__(self, width, height, logo_path, log_pattern=LOG_FILE_PATTERN, measure_startup=False,
+                 hourly_baselines=False, instrument=True):
         super().__init__()
-        self.setStyleSheet("""
-            QWidget {
-                background-color: #2b2b2b;
-                color: #ffffff;
-                font-size: 14px;
-            }
-            QLabel {
-                font-weight: bold;
-                color: #dcdcdc;
-            }
-            QPushButton {
-                font-size: 14px;
-                font-weight: bold;
-                padding: 8px;
-                border-radius: 8px;
-                background-color: #0078d7;
-                color: white;
-            }
-            QPushButton:hover {
-                background-color: #005a9e;
-            }
-            QPushButton:pressed {
-                background-color: #004080;
-            }
-            QTableWidget {
-                background-color: #1e1e1e;
-                border: 1px solid #444;
-            }
-            QTableWidget::item {
-                padding: 6px;
-            }
-            QHeaderView::section {
-                background-color: #444;
-                color: white;
-                padding: 4px;
-                font-weight: bold;
-            }
-            QScrollBar:vertical, QScrollBar:horizontal {
-                background: #333;
-                border: none;
-                width: 10px;
-                height: 10px;
-            }
-            QScrollBar::handle:vertical, QScrollBar::handle:horizontal {
-                background: #0078d7;
-                border-radius: 5px;
-            }
-            QScrollBar::handle:vertical:hover, QScrollBar::handle:horizontal:hover {
-                background: #005a9e;
-            }
-        """)
+        self.measure_startup = measure_startup
+        self.first_frame_at = None
+        self.first_full_status_at = None
+        self.startup_reported = False
+        self.pending_log_rows = []  # rows logged before the log table was built
 
+        self.instrumentation = Instrumentation(enabled=instrument)
+        self.watchdog = StallWatchdog(self.instrumentation)
+        self.probe_engine = ProbeEngine(on_result=self.probe_done)
+        self.probe_finished.connect(self.on_probe_result)
+        self.probe_engine.start()
+        self.path_tracer = None  # created on the first down transition
+        self.traced_transitions = {}  # server name -> time of the down transition its trace in progress belongs to
+        self.path_traced.connect(self.on_path_traced)
+        # transitions are alerted through the channels in alerts.json, if there is one
+        self.alert_event.connect(self.log_event)
+        self.alerts = load_dispatcher(on_event=self.alert_event.emit)
+        self.status_bars = []  # status bar widgets, indexed like the model's server states
+        self.sparklines = []  # rtt sparkline widgets, indexed the same way
+        self.availability = AvailabilityHistory()
+        # results rolled up into 1 minute, 15 minute and hourly buckets, saved along with the state snapshot
+        self.rollups = RollupStore.load(ROLLUPS_DIR)
+        self.unwritten_rollups = []  # buckets a failed write left behind, written with the next snapshot
+        # every result is also appended to the sample store, buffered and written once a second
+        try:
+            self.samples = SampleStore(SAMPLES_DIR)
+        except OSError as e:
+            print(f"probe results will not be stored: {e}")
+            self.samples = None
+        # transitions, monitoring changes and messages, indexed for the log view and searches
+        try:
+            self.events = EventStore(EVENTS_FILE)
+        except (sqlite3.Error, OSError) as e:
+            print(f"events will only be written to the text log: {e}")
+            self.events = None
+        self.availability_loaded.connect(self.on_availability_loaded)
+        self.timeline_view = None
+        self.export_cancel = None  # set while an export runs, setting the event cancels it
+        self.snapshot_writer = None  # thread encoding and writing the latest state snapshot
+        self.export_dialog = None
+        self.export_progress.connect(self.on_export_progress)
+        self.export_finished.connect(self.on_export_finished)
+        # rtt and loss baselines of every server, swept for anomalies every PROBE_INTERVAL
+        self.hourly_baselines = hourly_baselines
+        self.anomalies = None
+        # servers probed every PARENT_DOWN_INTERVAL because their parent is down, back to normal when it recovers
+        self.slowed_servers = set()
+        self.sweep_pending = set()  # servers the initial sweep has not heard back from yet
+        # last known state from the previous run, so the grid starts from it instead of all red
+        self.last_known_states = load_snapshot(SNAPSHOT_FILE)
         self.refresh_servers()
+        self.grouped_view = len(self.model) > GROUPED_VIEW_MIN_SERVERS
+        self.expanded_groups = set()
+        self.group_headers = {}  # group name -> header button of its tile
         self.setWindowTitle("GCS SERVER CONTROL PANEL")
         self.setGeometry(100, 100, width, height)
-        self.log_file = log_file
+        # rotates at midnight and by size, closed days are compressed in the background
+        self.log = RotatingLog(pattern=log_pattern, header=self.log_header)
         self.central_widget = QWidget(self)
         self.setCentralWidget(self.central_widget)
         self.main_layout = QVBoxLayout(self.central_widget)
@@ -113,31 +218,261 @@ class MainWindow(QMainWindow):
         self.main_layout.addWidget(self.add_server_button, alignment=Qt.AlignCenter)
         
         self.main_layout.addWidget(self.middle_layout)
-    
-        
+        self.log_event("Log Section Initialized.")
+        self.start_initial_sweep()
+
+        # the heartbeat fires late whenever the gui thread is busy, the watchdog turns that into loop lag and stalls.
+        # Both start with the first frame, until the event loop runs every moment would count as a stall
+        self.heartbeat_timer = QTimer(self)
+        self.heartbeat_timer.timeout.connect(self.watchdog.beat)
+
+        # the diagnostics pane is hidden, ctrl+shift+d toggles it
+        self.diagnostics_shortcut = QShortcut(QKeySequence("Ctrl+Shift+D"), self)
+        self.diagnostics_shortcut.activated.connect(self.toggle_diagnostics)
+        self.diagnostics_timer = QTimer(self)
+        self.diagnostics_timer.timeout.connect(self.refresh_diagnostics)
+        self.diagnostics_timer.start(1000)
+
+        # group tiles show aggregates that change with every probe, their headers are redrawn once a second
+        self.group_tiles_timer = QTimer(self)
+        self.group_tiles_timer.timeout.connect(self.refresh_group_tiles)
+        self.group_tiles_timer.start(1000)
+
+        # the timeline moves with the clock while it is showing, only its newest tiles are redrawn
+        self.availability_requested = False
+        self.timeline_timer = QTimer(self)
+        self.timeline_timer.timeout.connect(self.advance_timeline)
+        self.timeline_timer.start(5000)
+
+        self.sample_flush_timer = QTimer(self)
+        self.sample_flush_timer.timeout.connect(self.flush_samples)
+        self.sample_flush_timer.start(1000)
+
+        self.snapshot_timer = QTimer(self)
+        self.snapshot_timer.timeout.connect(self.save_state_snapshot)
+        self.snapshot_timer.start(SNAPSHOT_INTERVAL)
+
+        self.anomaly_timer = QTimer(self)
+        self.anomaly_timer.timeout.connect(self.detect_anomalies)
+        self.anomaly_timer.start(PROBE_INTERVAL * 1000)
+
+        # profiles of the live process, from ctrl+shift+p, a signal or the trigger file written by profiler.py.
+        # The profiler module itself is only imported once the first frame is up
+        self.profiler = None
+        self.profile_timer = QTimer(self)
+        self.profile_timer.setSingleShot(True)
+        self.profile_timer.timeout.connect(self.stop_profile)
+        self.profile_shortcut = QShortcut(QKeySequence("Ctrl+Shift+P"), self)
+        self.profile_shortcut.activated.connect(self.toggle_profile)
+        self.profile_trigger_timer = QTimer(self)
+        self.profile_trigger_timer.timeout.connect(self.check_profile_trigger)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.first_frame_at is None:
+            self.first_frame_at = time.perf_counter()
+            QTimer.singleShot(0, self.after_first_frame)
+
+    def after_first_frame(self):
+        """work that can wait until the window is on screen: styling, the stall watchdog and the profiler hooks"""
+        self.watchdog.start()
+        self.heartbeat_timer.start(int(self.watchdog.interval * 1000))
+        with self.instrumentation.timer("startup_styling"):
+            self.setStyleSheet(STYLESHEET)
+        from profiler import install_signal_handler
+        install_signal_handler(self.start_profile)
+        self.profile_trigger_timer.start(1000)
+        if self.measure_startup:
+            QTimer.singleShot(MEASURE_STARTUP_TIMEOUT * 1000, self.report_startup)
+
+    def report_startup(self):
+        """prints time to first frame and to first full status, counted from process start, then quits"""
+        if self.startup_reported:
+            return
+        self.startup_reported = True
+        ms = lambda moment: None if moment is None else round((moment - PROCESS_START) * 1000, 1)
+        report = {
+            "time_to_first_frame_ms": ms(self.first_frame_at),
+            "time_to_first_full_status_ms": ms(self.first_full_status_at),
+            "servers": len(self.model),
+        }
+        print(json.dumps(report))
+        self.log_event(f"Startup measured: first frame {report['time_to_first_frame_ms']} ms, "
+                       f"first full status {report['time_to_first_full_status_ms']} ms")
+        QApplication.instance().quit()
+
     def open_add_server_popup(self):
+        from add_server_window import AddServerWindow
         self.popup = AddServerWindow()
         self.popup.exec_()
+        self.last_known_states = self.model.known_states()
+        known = {state.name for state in self.model}
         self.stop_all_timers()
         self.refresh_servers()
+        for state in self.model:
+            if state.name not in known:
+                self.record_event(KIND_SERVER_ADDED, state.name, f"{state.name.title()} Server added.")
         self.log_event(message="Added a new server", add_headers=True)
         self.refresh_middle_section()
+        self.start_initial_sweep()
         
+    def open_export_popup(self) -> None:
+        """asks what to export and starts the export in the background, a progress dialog can cancel it"""
+        if self.export_cancel is not None:
+            self.export_dialog.show()
+            return
+        from export_window import ExportWindow
+        popup = ExportWindow([state.name for state in self.model])
+        if popup.exec_() != QDialog.Accepted:
+            return
+        self.export_cancel = threading.Event()
+        self.export_dialog = QProgressDialog("Exporting history...", "Cancel", 0, 1000, self)
+        self.export_dialog.setWindowTitle("Export History")
+        self.export_dialog.setAutoClose(False)
+        self.export_dialog.setAutoReset(False)
+        self.export_dialog.canceled.connect(self.export_cancel.set)
+        self.export_dialog.show()
+        threading.Thread(target=self.run_export, args=(popup.options, self.export_cancel), name="history-export",
+                         daemon=True).start()
+
+    def run_export(self, options:Dict, cancel:threading.Event) -> None:
+        """writes one file per dataset, runs on its own thread"""
+        from export import EVENTS, ExportCancelled, event_chunks, export, export_path, sample_chunks
+        datasets = options["datasets"]
+        written = []
+        rows = 0
+        try:
+            for number, dataset in enumerate(datasets):
+                if dataset == EVENTS:
+                    if self.events is None:
+                        continue
+                    self.events.flush(timeout=5)
+                    chunks = event_chunks(self.events, options["start"], options["end"], options["servers"])
+                else:
+                    if self.samples is None:
+                        continue
+                    chunks = sample_chunks(self.samples, options["start"], options["end"], options["servers"])
+                path = export_path(options["path"], dataset, options["format"])
+                done = rows
+                rows += export(path, options["format"], chunks, dataset, options["start"], options["end"],
+                               progress=lambda fraction, count: self.export_progress.emit(
+                                   (number + fraction) / len(datasets), done + count),
+                               cancel=cancel)
+                written.append(path)
+        except ExportCancelled:
+            self.export_finished.emit(f"Export cancelled, {', '.join(written) or 'nothing'} written.")
+            return
+        except Exception as e:
+            # anything else, an sqlite3 error from the event store included, still has to close the dialog
+            self.export_finished.emit(f"Export failed: {type(e).__name__}: {e}")
+            return
+        self.export_finished.emit(f"Exported {rows} rows to {', '.join(written) or 'nothing'}.")
+
+    def on_export_progress(self, fraction:float, rows:int) -> None:
+        if self.export_dialog is not None and not self.export_cancel.is_set():
+            self.export_dialog.setValue(int(fraction * 1000))
+            self.export_dialog.setLabelText(f"Exporting history... {rows:,} rows")
+
+    def on_export_finished(self, message:str) -> None:
+        self.export_dialog.close()
+        self.export_dialog = None
+        self.export_cancel = None
+        self.log_event(message)
+
     def refresh_servers(self):
-        """reads servers and creates timers for them
+        """reads servers into the model and schedules their probes
         """
         
-        self.servers = get_servers()
-        
-        for server_name in self.servers:
-            self.servers[server_name]["status"] = False
-        
+        self.model = ServerModel(get_servers(), self.last_known_states)
+        names = [state.name for state in self.model]
+        for server_name in self.sweep_pending.difference(names):
+            self.sweep_checked(server_name)
+        if self.anomalies is None:
+            self.anomalies = AnomalyDetector(names, hourly=self.hourly_baselines)
+        else:
+            self.anomalies.resize(names)
+            # the rebuilt states start out normal, servers the detector still flags keep their tile and label
+            for state in self.model:
+                state.anomalous = bool(state.status) and self.anomalies.is_flagged(state.index)
         self.setup_timers()
-        
+
+    def start_initial_sweep(self) -> None:
+        """probes every server at once instead of waiting for the first timer tick, results fill in the grid as
+        they arrive and the progress label counts them down"""
+        self.sweep_pending = {state.name for state in self.model}
+        self.sweep_started_at = time.perf_counter()
+        self.probe_engine.sweep(self.model)
+        self.update_sweep_progress()
+
+    def sweep_checked(self, server_name:str) -> None:
+        """counts a server off the initial sweep, once it has its first status or was stopped or removed"""
+        if server_name not in self.sweep_pending:
+            return
+        self.sweep_pending.discard(server_name)
+        self.update_sweep_progress()
+        if not self.sweep_pending and self.first_full_status_at is None:
+            self.first_full_status_at = time.perf_counter()
+            if self.measure_startup:
+                self.report_startup()
+
+    def update_sweep_progress(self) -> None:
+        total = len(self.model)
+        if self.sweep_pending:
+            self.sweep_progress_label.setText(f"Checking servers: {total - len(self.sweep_pending)}/{total}")
+        else:
+            seconds = time.perf_counter() - self.sweep_started_at
+            self.sweep_progress_label.setText(f"All {total} servers checked in {seconds:.1f} s")
+
+    def save_state_snapshot(self, wait:bool=False) -> None:
+        """copies every server's state and the rollup buckets closed since the last snapshot, and writes them on a
+        background thread, encoding thousands of sketches would hold up the gui. A snapshot still being written is
+        left to finish and this one skipped
+
+        :param wait: write it even if one is still being written and return once it is, for shutdown
+        :type wait: bool
+        """
+        writer = self.snapshot_writer
+        if writer is not None and writer.is_alive():
+            if not wait:
+                return
+            writer.join()
+        with self.instrumentation.timer("snapshot_capture"):
+            captured = capture(self.model)
+            # open buckets are only written at shutdown, they are rebuilt from the closed ones after a crash
+            rollups = self.unwritten_rollups + self.rollups.capture(include_open=wait)
+            self.unwritten_rollups = []
+        self.snapshot_writer = threading.Thread(target=self.write_state_snapshot, args=(captured, rollups),
+                                                name="state-snapshot", daemon=True)
+        self.snapshot_writer.start()
+        if wait:
+            self.snapshot_writer.join()
+
+    def write_state_snapshot(self, captured:List, rollups:List) -> None:
+        with self.instrumentation.timer("snapshot_write"):
+            try:
+                write_snapshot(SNAPSHOT_FILE, captured)
+            except OSError as e:
+                print(f"could not write state snapshot: {e}")
+        with self.instrumentation.timer("rollups_write"):
+            try:
+                write_rollups(ROLLUPS_DIR, rollups, self.rollups.resolutions)
+            except OSError as e:
+                print(f"could not write rollups: {e}")
+                self.unwritten_rollups = rollups
+
+    def flush_samples(self) -> None:
+        if self.samples is None:
+            return
+        with self.instrumentation.timer("sample_flush"):
+            try:
+                self.samples.flush()
+            except OSError as e:
+                print(f"could not write probe results: {e}")
+
     def stop_all_timers(self):
         """stops all timers of the servers"""
-        for server_name in self.servers:
-            self.stop_ping(server_name=server_name)
+        for state in self.model:
+            self.stop_ping(server_name=state.name)
     
     def refresh_middle_section(self):
         """Removes the middle layout and rebuilds it to reflect added servers."""
@@ -184,6 +519,12 @@ class MainWindow(QMainWindow):
         self.btn_show_table = QPushButton("Show Table")
         self.btn_show_servers.clicked.connect(lambda: self.switch_view(0))
         self.btn_show_table.clicked.connect(lambda: self.switch_view(1))
+        self.btn_group_view = QPushButton("Group Servers")
+        self.btn_group_view.clicked.connect(self.toggle_grouped_view)
+        self.btn_show_timeline = QPushButton("Show Timeline")
+        self.btn_show_timeline.clicked.connect(lambda: self.switch_view(3))
+        self.btn_export = QPushButton("Export History")
+        self.btn_export.clicked.connect(self.open_export_popup)
         
         top_layout.addWidget(self.logo_label)
         top_layout.addStretch()
@@ -193,10 +534,28 @@ class MainWindow(QMainWindow):
         top_layout.addStretch()
         top_layout.addWidget(self.btn_show_table)
         top_layout.addStretch()
+        top_layout.addWidget(self.btn_group_view)
+        top_layout.addStretch()
+        top_layout.addWidget(self.btn_show_timeline)
+        top_layout.addStretch()
+        top_layout.addWidget(self.btn_export)
+        top_layout.addStretch()
         
         
         self.main_layout.addLayout(top_layout)
 
+        self.probe_metrics_label = QLabel(self)
+        self.probe_metrics_label.setAlignment(Qt.AlignCenter)
+        self.probe_metrics_label.setStyleSheet("font-size: 12px; font-weight: normal; color: #a0a0a0;")
+        self.main_layout.addWidget(self.probe_metrics_label)
+        self.sweep_progress_label = QLabel(self)
+        self.sweep_progress_label.setAlignment(Qt.AlignCenter)
+        self.sweep_progress_label.setStyleSheet("font-size: 12px; font-weight: normal; color: #a0a0a0;")
+        self.main_layout.addWidget(self.sweep_progress_label)
+        self.probe_metrics_timer = QTimer(self)
+        self.probe_metrics_timer.timeout.connect(self.update_probe_metrics)
+        self.probe_metrics_timer.start(1000)
+
     def setup_middle_section(self):
         self.middle_layout = QStackedWidget()
         
@@ -206,16 +565,32 @@ class MainWindow(QMainWindow):
         self.add_servers_to_grid()
         
         # self.middle_layout.addWidget(server_container)
-        self.setup_logs_section(self.middle_layout)
+        # the log and diagnostics pages are hidden at start, they are only built the first time they are shown
+        self.log_table = None
+        self.log_table_since = time.time()  # rows logged before this come out of the event store
+        self.log_history_cursor = None
+        self.diagnostics_text = None
+        self.log_page = QWidget()
+        QVBoxLayout(self.log_page)
+        self.middle_layout.addWidget(self.log_page)
+        self.diagnostics_page = QWidget()
+        QVBoxLayout(self.diagnostics_page)
+        self.middle_layout.addWidget(self.diagnostics_page)
+        if self.timeline_view is not None:
+            self.timeline_view.stop()
+            self.timeline_view = None
+        self.timeline_page = QWidget()
+        QVBoxLayout(self.timeline_page)
+        self.middle_layout.addWidget(self.timeline_page)
         
         # self.main_layout.addLayout(self.middle_layout)
 
-    def create_server_section(self, server_name: str):
+    def create_server_section(self, state: ServerState):
         layout = QVBoxLayout()
         layout.setSpacing(10)  # Add some spacing between elements
 
         # Server name label
-        label = QLabel(f"{server_name.title()} Server", self)
+        label = QLabel(f"{state.name.title()} Server", self)
         label.setAlignment(Qt.AlignCenter)
         label.setStyleSheet("font-size: 18px; font-weight: bold;")
         label.setWordWrap(True)  # Enable word wrapping for long names
@@ -224,17 +599,23 @@ class MainWindow(QMainWindow):
         # Status bar
         status_bar = QLabel(self)
         status_bar.setFixedSize(200, 20)  # Increased width to accommodate longer names
-        status_bar.setStyleSheet("background-color: red; border: 1px solid black;")
+        self.update_status_bar(status_bar, self.status_color(state), stale=state.stale)
         layout.addWidget(status_bar, alignment=Qt.AlignCenter)
 
         # Store status bar reference
-        self.servers[server_name]["status_bar"] = status_bar
+        self.status_bars[state.index] = status_bar
+
+        # rtt and loss over the last minutes, redrawn from the server's history
+        sparkline = Sparkline(state, self.instrumentation, self)
+        sparkline.setFixedWidth(200)
+        layout.addWidget(sparkline, alignment=Qt.AlignCenter)
+        self.sparklines[state.index] = sparkline
 
         return layout  # Return the layout for adding to the grid
 
 
     def add_servers_to_grid(self):
-        """Adds server sections to a grid layout with 3 columns"""
+        """Adds server sections to a grid layout with 3 columns, or a collapsible tile per group in the grouped view"""
         # Create a scroll area
         scroll_area = QScrollArea()
         scroll_area.setWidgetResizable(True)
@@ -242,32 +623,114 @@ class MainWindow(QMainWindow):
         
         # Create the container widget and grid layout
         grid_container = QWidget()
-        grid_layout = QGridLayout(grid_container)
-        grid_layout.setSpacing(20)  # Add some spacing between server sections
-        
-        # Add servers to the grid
-        for index, server_name in enumerate(self.servers):
-            row = index // 3  # Every 3 servers, move to the next row
-            col = index % 3   # 0 for first column, 1 for second column, 2 for third column
-            
-            server_section = self.create_server_section(server_name)
-            grid_layout.addLayout(server_section, row, col)  # Place in grid
+        self.status_bars = [None] * len(self.model)
+        self.sparklines = [None] * len(self.model)
+        self.group_headers = {}
+        if self.grouped_view:
+            tiles_layout = QVBoxLayout(grid_container)
+            tiles_layout.setSpacing(10)
+            for group in self.model.groups.values():
+                tiles_layout.addWidget(self.create_group_tile(group))
+            tiles_layout.addStretch()
+        else:
+            grid_layout = QGridLayout(grid_container)
+            grid_layout.setSpacing(20)  # Add some spacing between server sections
+            self.add_server_sections(grid_layout, self.model)
+        self.btn_group_view.setText("Show All Servers" if self.grouped_view else "Group Servers")
 
         # Set the grid container as the scroll area's widget
         scroll_area.setWidget(grid_container)
         
-        # Add the scroll area to the middle layout
-        self.middle_layout.addWidget(scroll_area)  # Add to the main layout
+        # The grid is always the first page of the middle layout
+        self.middle_layout.insertWidget(0, scroll_area)
+        self.grid_page = scroll_area
 
-    def setup_logs_section(self, parent_layout):
-        log_container = QWidget()
-        log_layout = QVBoxLayout(log_container)
+    def add_server_sections(self, grid_layout, states):
+        """places a section per server in the grid, 3 to a row"""
+        for position, state in enumerate(states):
+            row = position // 3  # Every 3 servers, move to the next row
+            col = position % 3   # 0 for first column, 1 for second column, 2 for third column
+            
+            server_section = self.create_server_section(state)
+            grid_layout.addLayout(server_section, row, col)  # Place in grid
+
+    def create_group_tile(self, group:ServerGroup) -> QWidget:
+        """a group's tile, a header with its aggregates that expands into the group's servers when clicked.
+        The server sections are only created while the group is expanded"""
+        tile = QWidget()
+        tile_layout = QVBoxLayout(tile)
+        tile_layout.setContentsMargins(0, 0, 0, 0)
+        header = QPushButton(tile)
+        header.clicked.connect(lambda checked=False, name=group.name: self.toggle_group(name))
+        tile_layout.addWidget(header)
+        self.group_headers[group.name] = header
+        if group.name in self.expanded_groups:
+            members = QWidget(tile)
+            grid_layout = QGridLayout(members)
+            grid_layout.setSpacing(20)
+            self.add_server_sections(grid_layout, group.members)
+            tile_layout.addWidget(members)
+        self.update_group_header(group)
+        return tile
+
+    def update_group_header(self, group:ServerGroup) -> None:
+        header = self.group_headers.get(group.name)
+        if header is None:
+            return
+        arrow = "▾" if group.name in self.expanded_groups else "▸"
+        text = f"{arrow} {group.name.upper()} ({len(group.members)})   {group.online} up / {group.offline} down"
+        if group.stopped:
+            text += f" / {group.stopped} stopped"
+        if group.worst_rtt is not None:
+            text += f"   worst rtt {group.worst_rtt * 1000:.0f} ms ({group.worst.name.title()})"
+        percentiles = group.sketch().percentiles("1h", (0.95,))
+        if percentiles is not None:
+            text += f"   p95 {percentiles[0.95] * 1000:.0f} ms (1h)"
+        header.setText(text)
+        color = STATUS_COLORS[not group.offline] if group.online or group.offline else "#555555"
+        header.setStyleSheet(f"text-align: left; background-color: {color};")
+
+    def refresh_group_tiles(self) -> None:
+        for group_name in self.group_headers:
+            self.update_group_header(self.model.groups[group_name])
+
+    def toggle_group(self, group_name:str) -> None:
+        """expands or collapses a group tile"""
+        if group_name in self.expanded_groups:
+            self.expanded_groups.discard(group_name)
+        else:
+            self.expanded_groups.add(group_name)
+        self.rebuild_grid()
+
+    def toggle_grouped_view(self) -> None:
+        self.grouped_view = not self.grouped_view
+        self.rebuild_grid()
+
+    def rebuild_grid(self) -> None:
+        """replaces the grid page only, the log and diagnostics pages keep their contents"""
+        showing_grid = self.middle_layout.currentIndex() == 0
+        scroll_position = self.grid_page.verticalScrollBar().value()
+        old_page = self.grid_page
+        self.middle_layout.removeWidget(old_page)
+        old_page.deleteLater()
+        self.add_servers_to_grid()
+        # the new page has no layout yet, the position is restored once it has
+        QTimer.singleShot(0, lambda: self.grid_page.verticalScrollBar().setValue(scroll_position))
+        if showing_grid:
+            self.middle_layout.setCurrentIndex(0)
+
+    def setup_logs_section(self, log_layout):
         log_label = QLabel("Logs", self)
         log_label.setAlignment(Qt.AlignLeft)
         log_label.setStyleSheet("font-size: 16px; font-weight: bold;")
         log_label.setFixedWidth(150)
         log_layout.addWidget(log_label)
 
+        if self.events is not None:
+            self.earlier_logs_button = QPushButton("Load Earlier Events", self)
+            self.earlier_logs_button.clicked.connect(self.load_earlier_log_rows)
+            log_layout.addWidget(self.earlier_logs_button, alignment=Qt.AlignLeft)
+
         self.log_table = QTableWidget(self)
         self.log_table.setColumnCount(3)  # Only 3 columns: Time, Status, Message
         self.log_table.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
@@ -292,131 +755,626 @@ class MainWindow(QMainWindow):
         self.log_table.resizeRowsToContents()
 
         log_layout.addWidget(self.log_table)
-        parent_layout.addWidget(log_container)
-        self.log_event("Log Section Initialized.")
+
+        pending_log_rows, self.pending_log_rows = self.pending_log_rows, []
+        for row in pending_log_rows:
+            self.add_log_row(*row)
+        if self.events is not None:
+            self.load_earlier_log_rows()
+
+    def load_earlier_log_rows(self) -> None:
+        """puts a page of events from before the table was built at its top, older pages follow on every click"""
+        with self.instrumentation.timer("log_history_page"):
+            self.events.flush(timeout=1)
+            events = self.events.query(end=self.log_table_since, kinds=LOG_VIEW_KINDS, before=self.log_history_cursor,
+                                       limit=LOG_HISTORY_ROWS)
+            for event in events:
+                status_text = ""
+                if event.server is not None and event.kind in EVENT_STATUS_LABELS:
+                    status_text = f"{event.server.title()}: {EVENT_STATUS_LABELS[event.kind]}"
+                timestamp = datetime.fromtimestamp(event.time).strftime("%Y-%m-%d %H:%M:%S")
+                self.log_table.insertRow(0)
+                self.log_table.setItem(0, 0, QTableWidgetItem(timestamp))
+                self.log_table.setItem(0, 1, QTableWidgetItem(status_text))
+                # a path trace keeps its hop list after the one line summary, the table shows the summary
+                self.log_table.setItem(0, 2, QTableWidgetItem(event.message.split("\n", 1)[0]
+                                                              or event.kind.replace("_", " ")))
+        if events:
+            self.log_history_cursor = events[-1].cursor
+        if len(events) < LOG_HISTORY_ROWS:
+            self.earlier_logs_button.setEnabled(False)
+            self.earlier_logs_button.setText("No Earlier Events")
+
+    def setup_diagnostics_section(self, diagnostics_layout):
+        diagnostics_label = QLabel("Diagnostics", self)
+        diagnostics_label.setStyleSheet("font-size: 16px; font-weight: bold;")
+        diagnostics_layout.addWidget(diagnostics_label)
+
+        self.diagnostics_text = QPlainTextEdit(self)
+        self.diagnostics_text.setReadOnly(True)
+        self.diagnostics_text.setStyleSheet("font-family: monospace; font-size: 12px;")
+        diagnostics_layout.addWidget(self.diagnostics_text)
+
+        dump_button = QPushButton("Dump JSON", self)
+        dump_button.clicked.connect(self.dump_diagnostics)
+        diagnostics_layout.addWidget(dump_button, alignment=Qt.AlignRight)
+
+    def setup_timeline_section(self, timeline_layout):
+        from timeline import DEFAULT_ZOOM, ZOOM_LEVELS, TimelineView
+        controls = QHBoxLayout()
+        timeline_label = QLabel("Availability", self)
+        timeline_label.setAlignment(Qt.AlignCenter)
+        controls.addWidget(timeline_label)
+        controls.addStretch()
+        self.timeline_view = TimelineView(self.availability, lambda: [state.name for state in self.model],
+                                          instrumentation=self.instrumentation)
+        for zoom in ZOOM_LEVELS:
+            button = QPushButton(zoom, self)
+            button.setCheckable(True)
+            button.setAutoExclusive(True)
+            button.setChecked(zoom == DEFAULT_ZOOM)
+            button.clicked.connect(lambda _, zoom=zoom: self.timeline_view.set_zoom(zoom))
+            controls.addWidget(button)
+        now_button = QPushButton("Now", self)
+        now_button.clicked.connect(self.timeline_view.go_to_now)
+        controls.addWidget(now_button)
+        timeline_layout.addLayout(controls)
+        timeline_layout.addWidget(self.timeline_view)
+        if not self.availability_requested:
+            self.availability_requested = True
+            names = [state.name for state in self.model]
+            threading.Thread(target=self.load_availability, args=(names,), name="availability-load",
+                             daemon=True).start()
+
+    def load_availability(self, names:List[str]) -> None:
+        """reads past transitions out of the event store, and out of the logs for the time before it, runs on its
+        own thread"""
+        loaded = 0
+        end = None
+        if self.events is not None:
+            try:
+                loaded += self.availability.load_events(self.events, names)
+                first = self.events.first_time()
+                end = datetime.fromtimestamp(first) if first is not None else None
+            except sqlite3.Error as e:
+                print(f"could not read the availability history from the event store: {e}")
+        try:
+            loaded += self.availability.load_log(self.log, names, end=end)
+        except (OSError, ValueError) as e:
+            print(f"could not read the availability history from the logs: {e}")
+        self.availability_loaded.emit(loaded)
+
+    def on_availability_loaded(self, loaded:int) -> None:
+        if self.timeline_view is not None:
+            self.timeline_view.reset_rows()
+
+    def advance_timeline(self) -> None:
+        if self.timeline_view is not None and self.middle_layout.currentIndex() == 3:
+            self.timeline_view.advance()
+
+    def diagnostics(self) -> Dict:
+        """collects hot path timings, loop stalls and probe engine metrics into one dictionary"""
+        diagnostics = self.instrumentation.snapshot()
+        diagnostics["event_loop"] = self.watchdog.to_dict()
+        diagnostics["probe_engine"] = self.probe_engine.metrics()
+        diagnostics["servers"] = len(self.model)
+        diagnostics["rollups"] = self.rollups.metrics()
+        diagnostics["anomalies"] = self.anomalies.metrics()
+        diagnostics["percentiles"] = self.percentile_metrics()
+        diagnostics["samples"] = self.samples.metrics() if self.samples is not None else None
+        diagnostics["events"] = self.events.metrics() if self.events is not None else None
+        diagnostics["alerts"] = self.alerts.metrics() if self.alerts is not None else None
+        diagnostics["path_traces"] = self.path_tracer.metrics() if self.path_tracer is not None else None
+        diagnostics["dependencies"] = {
+            "unreachable_via_parent": sum(1 for state in self.model if state.via_parent),
+            "suppressed_events": self.model.suppressed_events,
+        }
+        return diagnostics
+
+    def percentile_metrics(self) -> Dict:
+        """the fleet's and every group's rtt percentiles per window, merged from the servers' sketches"""
+        sketches = [state.quantiles for state in self.model if state.quantiles is not None]
+        return {
+            "sketches": len(sketches),
+            "bytes": sum(sketch.nbytes for sketch in sketches),
+            "fleet": report(merged(group.sketch() for group in self.model.groups.values())),
+            "groups": {name: report(group.sketch()) for name, group in self.model.groups.items()},
+        }
+
+    def toggle_diagnostics(self):
+        """shows the hidden diagnostics pane, or goes back to the servers if it is already showing"""
+        self.switch_view(0 if self.middle_layout.currentIndex() == 2 else 2)
+        self.refresh_diagnostics()
+
+    def refresh_diagnostics(self):
+        if self.diagnostics_text is None or self.middle_layout.currentIndex() != 2:
+            return
+        self.diagnostics_text.setPlainText(json.dumps(self.diagnostics(), indent=4, default=str))
+
+    def dump_diagnostics(self):
+        from instrumentation import dump_json
+        path = datetime.now().strftime("gcs_diagnostics_%Y_%m_%d_%H%M%S.json")
+        dump_json(path, self.diagnostics())
+        self.log_event(f"Diagnostics written to {path}")
+
+    def start_profile(self, mode:str=None, duration:float=None) -> None:
+        """starts a profile capture that stops itself after duration seconds, monitoring carries on meanwhile"""
+        from profiler import DEFAULT_DURATION, DEFAULT_MODE, ProfileController
+        if self.profiler is None:
+            self.profiler = ProfileController(on_finished=self.on_profile_finished)
+        mode = mode or DEFAULT_MODE
+        duration = duration or DEFAULT_DURATION
+        if self.profiler.start(mode=mode, duration=duration):
+            self.profile_timer.start(int(duration * 1000))
+            self.log_event(f"Profiling started ({mode}, {duration:.0f} s).")
+
+    def stop_profile(self) -> None:
+        self.profile_timer.stop()
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def toggle_profile(self) -> None:
+        if self.profiler is not None and self.profiler.running:
+            self.stop_profile()
+        else:
+            self.start_profile()
+
+    def check_profile_trigger(self) -> None:
+        from profiler import read_trigger
+        request = read_trigger()
+        if request is not None:
+            self.start_profile(mode=request["mode"], duration=request["duration"])
+
+    def on_profile_finished(self, output:Dict) -> None:
+        files = ", ".join(output[key] for key in ("collapsed", "pstats", "summary") if key in output)
+        self.log_event(f"Profiling finished after {output['seconds']} s, written to {files}")
 
     def setup_timers(self):
-        """sets up timers for each server
+        """schedules every server's periodic probe on the probe engine, the first ticks are spread evenly over the
+        interval so the fleet is not probed in one burst every PROBE_INTERVAL
         """
-        for server_name in self.servers:
-            print(f"creating timer for {server_name}")
-            server_ip = self.servers[server_name]["ip"]
-            self.servers[server_name]["timer"] = QTimer(self)
-            self.servers[server_name]["timer"].timeout.connect(partial(self.ping_server, server_name=server_name, server_ip=server_ip))
-            self.servers[server_name]["timer"].start(5000)
-
-    def log_event(self, message:str, add_headers:bool=False, status_text:str=None) -> None:
+        count = len(self.model) or 1
+        self.slowed_servers.clear()
+        for state in self.model:
+            delay = PROBE_INTERVAL * (1 + state.index / count)
+            self.probe_engine.schedule(state.name, state.ip, config=state.config, delay=delay)
+            self.record_event(KIND_MONITORING_STARTED, state.name)
+
+    def log_event(self, message:str, add_headers:bool=False, status_text:str=None, kind:str=KIND_MESSAGE,
+                  server_name:str=None) -> None:
         """Logs the current status of servers to the table and log file.
 
         :param message: message to log
         :type message: str
         :param status_text: optional status text to display, if None will show all server statuses
         :type status_text: str
+        :param kind: kind of the event in the event store, None to leave it out of the store, defaults to KIND_MESSAGE
+        :type kind: str
+        :param server_name: server the event is about, defaults to None
+        :type server_name: str
         """
         print(message, add_headers)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        now = datetime.now()
+        timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+
+        # Use provided status text or get all server statuses
+        if status_text is None:
+            status_text = ""
+            for state in self.model:
+                status_text += f"{state.name.title()}: {state.status_label()}\n"
 
-        # Update log table
+        with self.instrumentation.timer("log_table_update"):
+            self.add_log_row(timestamp, status_text, message)
+
+        with self.instrumentation.timer("log_write"):
+            self.write_log_line(now, status_text, message, add_headers)
+        if kind is not None:
+            self.record_event(kind, server_name, message, now.timestamp())
+
+    def record_event(self, kind:str, server_name:str=None, message:str="", when:float=None) -> None:
+        """queues an event for the event store, it is written on the store's own thread"""
+        if self.events is not None:
+            self.events.record(kind, server_name, message, when)
+
+    def add_log_row(self, timestamp:str, status_text:str, message:str) -> None:
+        """appends a row to the log table and scrolls to it, or keeps it for later if the table is not built yet"""
+        if self.log_table is None:
+            self.pending_log_rows.append((timestamp, status_text, message))
+            return
         row_position = self.log_table.rowCount()
         self.log_table.insertRow(row_position)
         
         # Add timestamp
         self.log_table.setItem(row_position, 0, QTableWidgetItem(timestamp))
-        
-        # Use provided status text or get all server statuses
-        if status_text is None:
-            status_text = ""
-            for server_name in self.servers:
-                status = self.get_server_status(server_name)
-                status_text += f"{server_name.title()}: {status}\n"
-        
         self.log_table.setItem(row_position, 1, QTableWidgetItem(status_text.strip()))
         
         # Add message
         self.log_table.setItem(row_position, 2, QTableWidgetItem(message))
 
-        # Ensure headers are written if they are missing
-        log_file_exists = os.path.exists(self.log_file)
-        if not log_file_exists or add_headers or os.stat(self.log_file).st_size == 0:
-            headers = "Timestamp              | Server Statuses | Message"
-            divider = "-" * 100
-            
-            with open(self.log_file, 'a') as log_file:
-                log_file.write(f"{headers}\n{divider}\n")
-
-        # Append the log entry
-        log_message = f"{timestamp:<22}| {status_text.strip():<50}| {message}"
-        
-        with open(self.log_file, 'a') as log_file:
-            log_file.write(log_message + "\n")
-            
         # Scroll to the latest entry
         self.log_table.scrollToBottom()
         # Select the latest row to highlight it
         self.log_table.selectRow(row_position)
 
-    def update_status_bar(self, status_bar, color:str):
+    def log_header(self) -> str:
+        headers = "Timestamp              | Server Statuses | Message"
+        divider = "-" * 100
+        return f"{headers}\n{divider}\n"
+
+    def write_log_line(self, now:datetime, status_text:str, message:str, add_headers:bool=False) -> None:
+        """appends a line to the log file, a new file starts with the headers on its own"""
+        if add_headers:
+            self.log.write(self.log_header(), now)
+
+        # Append the log entry
+        timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+        log_message = f"{timestamp:<22}| {status_text.strip():<50}| {message}"
+        self.log.write(log_message + "\n", now)
+
+    def status_color(self, state:ServerState) -> str:
+        if state.via_parent and state.status is not None:
+            return VIA_PARENT_COLOR
+        if state.degraded and not state.stale:
+            return DEGRADED_COLOR
+        if state.anomalous and state.status and not state.stale:
+            return ANOMALY_COLOR
+        colors = STALE_STATUS_COLORS if state.stale else STATUS_COLORS
+        return colors[bool(state.status)]
+
+    def update_status_bar(self, status_bar, color:str, stale:bool=False, tooltip:str=""):
         """updates status bar to correct color
 
         :param status_bar: status bar object
         :type status_bar: status bar object
         :param color: color of bar, green or red
         :type color: str
+        :param stale: whether the color is the last known state from a previous run, drawn with a dashed border
+        :type stale: bool
+        :param tooltip: tooltip of the bar, defaults to none
+        :type tooltip: str
         """
-        status_bar.setStyleSheet(f"background-color: {color}; border: 1px solid black;")
-        
-    def ping_server(self, server_name:str, server_ip:str) -> None:
-        """pings the given ip address and updates the status and status bar for the server
+        with self.instrumentation.timer("repaint"):
+            border = "1px dashed #aaaaaa" if stale else "1px solid black"
+            status_bar.setStyleSheet(f"background-color: {color}; border: {border};")
+            status_bar.setToolTip("Last known state, waiting for the first probe" if stale else tooltip)
+
+    def repaint_server(self, state:ServerState) -> None:
+        status_bar = self.status_bars[state.index] if state.index < len(self.status_bars) else None
+        if status_bar is not None:
+            tooltip = ""
+            if state.via_parent:
+                tooltip = f"Unreachable via parent {state.parent.name.title()}"
+            elif state.status is False and state.path is not None:
+                tooltip = state.path.to_text()
+            elif state.anomalous:
+                tooltip = self.anomaly_tooltip(state)
+            elif state.burst is not None:
+                tooltip = f"Last burst: {state.burst.summary()}"
+            self.update_status_bar(status_bar, self.status_color(state), stale=state.stale, tooltip=tooltip)
+
+    def anomaly_tooltip(self, state:ServerState) -> str:
+        baseline = self.anomalies.baseline(state.index)
+        if baseline is None:
+            return "Anomalous"
+        rtt = baseline["rtt"]
+        return (f"Anomalous, usual rtt {rtt['mean'] * 1000:.1f} ± {rtt['stdev'] * 1000:.1f} ms, "
+                f"usual loss {baseline['loss']['mean']:.0%}")
+
+    def detect_anomalies(self) -> None:
+        """folds the results since the last sweep into every server's baseline, flags servers whose rtt or loss
+        stayed far above it and clears the ones back within it"""
+        with self.instrumentation.timer("anomaly_sweep"):
+            flagged, cleared = self.anomalies.sweep()
+        for index, description in flagged.items():
+            state = self.model.states[index]
+            if not state.status or state.via_parent:
+                self.anomalies.clear(index)
+                continue
+            state.anomalous = True
+            self.repaint_server(state)
+            self.log_event(f"{state.name.title()} Server latency is anomalous: {description}.",
+                           status_text=f"{state.name.title()}: Anomalous", kind=KIND_ANOMALY, server_name=state.name)
+        for index in cleared:
+            state = self.model.states[index]
+            if not state.anomalous:
+                continue
+            state.anomalous = False
+            self.repaint_server(state)
+            self.log_event(f"{state.name.title()} Server latency is back to normal.",
+                           status_text=f"{state.name.title()}: Online", kind=KIND_ANOMALY_CLEARED,
+                           server_name=state.name)
+
+    def probe_done(self, result:ProbeResult) -> None:
+        """runs on the probe worker that finished the probe: times it there, off the gui thread, and hands it over"""
+        self.instrumentation.observe("probe", result.finished_at - result.started_at)
+        self.instrumentation.observe("probe_queue_wait", result.queue_wait)
+        self.probe_finished.emit(result)
+
+    def on_probe_result(self, result:ProbeResult) -> None:
+        """updates the status and status bar for the server from a finished probe, runs on the gui thread
 
-        :param name: name of server
-        :type name: str
-        :param ip: ip address of server
-        :type ip: str
+        :param result: result handed over by the probe engine
+        :type result: ProbeResult
         """
-        
-        print(f"pinging {server_name} with ip {server_ip}")
-        try:
-            response = ping(server_ip, timeout=2)  # Timeout set to 2 seconds
-            if response is not None:  # If response is a valid number, the server is reachable
-                if not self.servers[server_name]["status"]:
-                    self.servers[server_name]["status"] = True
-                    self.update_status_bar(self.servers[server_name]["status_bar"], "green")
-                    status_text = f"{server_name.title()}: Online"
-                    self.log_event(f"{server_name.title()} Server became reachable.", status_text=status_text)
-            else:  # If response is None, server is unreachable
-                if self.servers[server_name]["status"]:  # Status changed to unreachable
-                    self.servers[server_name]["status"] = False
-                    self.update_status_bar(self.servers[server_name]["status_bar"], "red")
-                    status_text = f"{server_name.title()}: Offline"
-                    self.log_event(f"{server_name.title()} Server became unreachable.", status_text=status_text)
-        except Exception as e:
-            self.servers[server_name]["status"] = False
-            self.update_status_bar(self.servers[server_name]["status_bar"], "red")
+        with self.instrumentation.timer("model_update"):
+            self.apply_probe_result(result)
+
+    def apply_probe_result(self, result:ProbeResult) -> None:
+        server_name = result.server_name
+        # a server's first status of the run is not a transition worth alerting on, unless it is known from the snapshot
+        previous = self.model.get(server_name)
+        confirmed = previous is not None and (previous.probes > 0 or previous.stale)
+        # the server may have been stopped or removed while its probe was running
+        state, event, repaint = self.model.apply_result(result)
+        self.sweep_checked(server_name)
+        if state is None:
+            return
+        if state.status and server_name in self.slowed_servers:
+            # answered on its own behind a down parent, it is probed like any other reachable server again
+            self.slowed_servers.discard(server_name)
+            self.probe_engine.schedule(server_name, state.ip, config=state.config)
+        now = time.time()
+        self.availability.record(server_name, now, STATE_DOWN if state.via_parent else state_code(state.status))
+        self.rollups.add(server_name, now, result.rtt if result.reachable else None,
+                         up=bool(state.status) and not state.via_parent)
+        if self.samples is not None:
+            flags = ((FLAG_REACHABLE if result.reachable else 0) | (FLAG_ERROR if result.error is not None else 0)
+                     | (FLAG_HTTP if result.http is not None else 0) | (FLAG_VIA_PARENT if state.via_parent else 0)
+                     | (FLAG_DEGRADED if state.degraded else 0))
+            self.samples.append(server_name, now, result.rtt if result.reachable else None, flags)
+        if state.status and result.rtt is not None:
+            self.anomalies.observe(state.index, result.rtt, result.burst.loss if result.burst is not None else 0.0)
+        elif not state.status:
+            self.anomalies.clear(state.index)
+        if repaint:
+            self.repaint_server(state)
+        sparkline = self.sparklines[state.index] if state.index < len(self.sparklines) else None
+        if sparkline is not None:
+            sparkline.update()
+
+        # a parent's transition is logged once for everything behind it, its dependents are not logged one by one
+        dependents = ""
+        if self.model.has_children(state):
+            if state.status is False:
+                marked = self.parent_went_down(state)
+                if marked:
+                    dependents = f" {len(marked)} servers behind it marked unreachable via parent."
+            elif event == EVENT_ONLINE:
+                rechecked = self.parent_came_back(state)
+                if rechecked:
+                    dependents = f" Rechecking {len(rechecked)} servers behind it."
+
+        if event == EVENT_ERROR:
+            status_text = f"{server_name.title()}: Offline"
+            self.log_event(f"Ping failed for {server_name.title()} Server: {result.error}{dependents}",
+                           status_text=status_text, kind=KIND_ERROR, server_name=server_name)
+        elif event == EVENT_ONLINE:
+            status_text = f"{server_name.title()}: Online"
+            self.log_event(f"{server_name.title()} Server became reachable.{dependents}", status_text=status_text,
+                           kind=KIND_UP, server_name=server_name)
+        elif event == EVENT_OFFLINE:
+            status_text = f"{server_name.title()}: Offline"
+            self.log_event(f"{server_name.title()} Server became unreachable.{dependents}", status_text=status_text,
+                           kind=KIND_DOWN, server_name=server_name)
+        elif event == EVENT_DEGRADED:
+            self.log_event(f"{server_name.title()} Server is degraded: {result.burst.summary()}.",
+                           status_text=f"{server_name.title()}: Degraded", kind=KIND_DEGRADED, server_name=server_name)
+        elif event == EVENT_RECOVERED:
+            self.log_event(f"{server_name.title()} Server recovered: {result.burst.summary()}.",
+                           status_text=f"{server_name.title()}: Online", kind=KIND_RECOVERED, server_name=server_name)
+        elif dependents:
             status_text = f"{server_name.title()}: Offline"
-            self.log_event(f"Ping failed for {server_name.title()} Server: {e}", status_text=status_text)
+            self.log_event(f"{server_name.title()} Server is unreachable.{dependents}", status_text=status_text,
+                           server_name=server_name)
+        if event in (EVENT_OFFLINE, EVENT_ERROR):
+            self.request_path_trace(state)
+        if event in (EVENT_ONLINE, EVENT_OFFLINE, EVENT_ERROR) and confirmed and self.alerts is not None:
+            detail = (result.error or "") if event == EVENT_ERROR else ""
+            detail = (detail + dependents).strip()
+            self.alerts.submit(Transition(server_name, state.group.name, UP if event == EVENT_ONLINE else DOWN, detail))
+
+    def request_path_trace(self, state:ServerState) -> None:
+        """traces the path to a server that just went down in the background, the hops are logged and shown in the
+        tile's tooltip once the trace is done"""
+        # taken after the transition was logged, so the trace's event sorts right after it
+        self.traced_transitions[state.name] = time.time()
+        if self.path_tracer is None:
+            from path_trace import PathTracer
+            self.path_tracer = PathTracer(on_finished=self.path_traced.emit)
+        self.path_tracer.request(state.name, state.ip)
+
+    def on_path_traced(self, server_name:str, trace) -> None:
+        transition_at = self.traced_transitions.pop(server_name, None)
+        state = self.model.get(server_name)
+        if state is None:
+            return
+        state.path = trace
+        self.repaint_server(state)
+        message = f"Path to {server_name.title()} Server: {trace.summary()}"
+        self.log_event(message, status_text=f"{server_name.title()}: {state.status_label()}", kind=None)
+        # stored at the time of the transition it explains, with the full hop list
+        self.record_event(KIND_PATH_TRACE, server_name, f"{message}\n{trace.to_text()}", transition_at)
+
+    def parent_went_down(self, parent:ServerState) -> List[ServerState]:
+        """marks the servers behind a down parent and slows their probes to PARENT_DOWN_INTERVAL, they are unlikely to
+        answer and would each wait out a full timeout"""
+        marked = self.model.mark_via_parent(parent)
+        now = time.time()
+        for state in marked:
+            self.availability.record(state.name, now, STATE_DOWN)
+            self.anomalies.clear(state.index)
+            self.probe_engine.schedule(state.name, state.ip, config=state.config, interval=PARENT_DOWN_INTERVAL)
+            self.probe_engine.cancel(state.name)
+            self.slowed_servers.add(state.name)
+            self.repaint_server(state)
+        return marked
+
+    def parent_came_back(self, parent:ServerState) -> List[ServerState]:
+        """probes the servers behind a recovered parent right away and puts every one slowed down behind it back on
+        the normal interval, including those that answered on their own in the meantime"""
+        rechecked = []
+        for state in self.model.descendants(parent):
+            if state.status is None:
+                continue
+            if state.name in self.slowed_servers:
+                self.slowed_servers.discard(state.name)
+                self.probe_engine.schedule(state.name, state.ip, config=state.config)
+            if state.via_parent:
+                rechecked.append(state)
+        self.probe_engine.sweep(rechecked, priority=PRIORITY_HIGH)
+        return rechecked
+
+    def update_probe_metrics(self) -> None:
+        """shows the probe engine's effective rate and queue state under the title"""
+        metrics = self.probe_engine.metrics()
+        self.probe_metrics_label.setText(
+            f"Packets: {metrics['packets_per_second']:.1f}/s of {metrics['packets_per_second_limit']:.0f}/s"
+            f" | queued {metrics['queued']} | in flight {metrics['in_flight']}"
+            f" | subnets at cap {metrics['subnets_at_cap']}"
+        )
+
+    def closeEvent(self, event) -> None:
+        self.save_state_snapshot(wait=True)
+        self.flush_samples()
+        if self.samples is not None:
+            self.samples.close()
+        self.stop_profile()
+        self.log.close()
+        self.watchdog.stop()
+        self.probe_engine.stop()
+        if self.path_tracer is not None:
+            self.path_tracer.stop()
+        if self.alerts is not None:
+            self.alerts.stop(timeout=2)
+        if self.timeline_view is not None:
+            self.timeline_view.stop()
+        if self.export_cancel is not None:
+            self.export_cancel.set()
+        if self.events is not None:
+            self.events.close(timeout=2)
+        super().closeEvent(event)
     
     def stop_ping(self, server_name:str) -> None:
-        self.servers[server_name]["timer"].stop()
-        self.update_status_bar(self.servers[server_name]["status_bar"], "red")
-        self.servers[server_name]["status"] = None
-        self.log_event(f"{server_name.title()} Server monitoring stopped.")
+        state = self.model[server_name]
+        self.probe_engine.unschedule(server_name)
+        self.slowed_servers.discard(server_name)
+        self.model.set_status(state, None)
+        self.sweep_checked(server_name)
+        self.anomalies.clear(state.index)
+        self.availability.record(server_name, time.time(), STATE_UNKNOWN)
+        self.repaint_server(state)
+        self.log_event(f"{server_name.title()} Server monitoring stopped.", kind=KIND_MONITORING_STOPPED,
+                       server_name=server_name)
         
     def get_server_status(self, server_name:str):
-        if self.servers[server_name]["status"] is None:
-            return "Stopped"
-        return "Online" if self.servers[server_name]["status"] else "Offline"
+        return self.model[server_name].status_label()
     
     def switch_view(self, index):
-        """Switches between Server List and Table"""
+        """Switches between Server List and Table, building the page the first time it is shown"""
+        if index == 1 and self.log_table is None:
+            with self.instrumentation.timer("build_log_page"):
+                self.setup_logs_section(self.log_page.layout())
+        if index == 2 and self.diagnostics_text is None:
+            self.setup_diagnostics_section(self.diagnostics_page.layout())
+        if index == 3 and self.timeline_view is None:
+            self.setup_timeline_section(self.timeline_page.layout())
         self.middle_layout.setCurrentIndex(index)
 
 
-def run_app(width=1200, height=600, logo_path="gcs_logo.png"):
-    log_file = datetime.now().strftime("gcs_control_panel_log_%Y_%m_%d.txt")
+def measure_instrumentation(servers:int=MEASURE_INSTRUMENTATION_SERVERS, rounds:int=MEASURE_INSTRUMENTATION_ROUNDS,
+                            results:int=20) -> Dict:
+    """times the probe result and repaint paths with instrumentation on and off and prints the overhead as json
+
+    A window on a synthetic fleet is built in a scratch directory and its probe engine stopped, so only the results
+    fed in here reach it. Rounds alternate between on and off so drift hits both alike, the median round counts.
+
+    :param servers: servers of the synthetic fleet, defaults to MEASURE_INSTRUMENTATION_SERVERS
+    :type servers: int, optional
+    :param rounds: rounds with each setting, defaults to MEASURE_INSTRUMENTATION_ROUNDS
+    :type rounds: int, optional
+    :param results: results per server and round, defaults to 20
+    :type results: int, optional
+    :return: microseconds per result of each path, on and off, and the overhead in percent
+    :rtype: Dict
+    """
+    import statistics
+    import tempfile
+    app = QApplication.instance() or QApplication(sys.argv)
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            with open(JSON_FILE, "w") as file:
+                json.dump({f"bench {index}": {"ip": f"192.0.2.{index + 1}"} for index in range(servers)}, file)
+            window = MainWindow(1200, 600, "")
+            window.probe_engine.stop()
+            window.show()
+            app.processEvents()
+            states = list(window.model)
+
+            def probe_results():
+                # steady state: every server answers, with a little rtt jitter and no transitions
+                for step in range(results):
+                    for state in states:
+                        window.on_probe_result(ProbeResult(state.name, state.ip, True, 0.02 + (step % 5) * 0.001))
+
+            def repaints():
+                # every repaint changes the tile's color, as on a transition
+                for step in range(results):
+                    for state in states:
+                        state.status = step % 2 == 0
+                        window.repaint_server(state)
+                for state in states:
+                    state.status = True
+
+            report = {}
+            for name, path in (("probe_result", probe_results), ("repaint", repaints)):
+                timings = {True: [], False: []}
+                for _ in range(rounds):
+                    for enabled in (True, False):
+                        window.instrumentation.enabled = enabled
+                        started = time.perf_counter()
+                        path()
+                        timings[enabled].append((time.perf_counter() - started) / (results * len(states)))
+                        app.processEvents()  # lets the heartbeat through, a round is not a stall
+                on, off = statistics.median(timings[True]), statistics.median(timings[False])
+                report[name] = {"on_us": round(on * 1e6, 2), "off_us": round(off * 1e6, 2),
+                                "overhead_percent": round((on / off - 1) * 100, 2)}
+            window.instrumentation.enabled = True
+            window.close()
+        finally:
+            os.chdir(previous)
+    print(json.dumps(report))
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="GCS server control panel")
+    parser.add_argument("--measure-startup", action="store_true",
+                        help="print time to first frame and to first full status as json, then exit")
+    parser.add_argument("--measure-instrumentation", action="store_true",
+                        help="print the overhead of the timing instrumentation on the probe result and repaint "
+                             "paths as json, measured on a synthetic fleet in a scratch directory, then exit")
+    parser.add_argument("--no-instrumentation", action="store_true",
+                        help="leave out the timing histograms of the diagnostics pane, the stall watchdog still runs")
+    parser.add_argument("--hourly-baselines", action="store_true",
+                        help="compare latency with its usual level at the same hour of the day")
+    return parser.parse_known_args(argv)[0]  # anything else is left for qt
+
+
+def run_app(width=1200, height=600, logo_path="gcs_logo.png", measure_startup=False, hourly_baselines=False,
+            instrument=True):
     app = QApplication(sys.argv)
-    window = MainWindow(width, height, logo_path, log_file)
+    window = MainWindow(width, height, logo_path, measure_startup=measure_startup, hourly_baselines=hourly_baselines,
+                        instrument=instrument)
     window.show()
     sys.exit(app.exec_())
 
 
-run_app()
+if __name__ == "__main__":
+    args = parse_args()
+    if args.measure_instrumentation:
+        measure_instrumentation()
+    else:
+        run_app(measure_startup=args.measure_startup, hourly_baselines=args.hourly_baselines,
+                instrument=not args.no_instrumentation)
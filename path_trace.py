@@ -0,0 +1,244 @@
+"""TTL-stepped ICMP path traces, the panel's built-in traceroute.
+
+A trace sends one echo request per TTL from 1 to MAX_HOPS on a single raw socket and collects the "time exceeded"
+answers of the routers along the way, so the whole path costs one timeout instead of one per hop. Raw ICMP sockets
+need root (CAP_NET_RAW) on linux and administrator rights on windows, without them a trace reports that as its error.
+"""
+import os
+import random
+import select
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from probe_engine import subnet_of
+
+MAX_HOPS = 30
+TRACE_TIMEOUT = 2.0  # seconds to wait for the answers of a trace after sending it
+TRACE_WORKERS = 2  # traces running at once, separate from the probe workers so they never delay a probe
+MAX_PENDING_TRACES = 64  # subnets waiting for a trace, further requests are dropped during a large outage
+CACHE_SECONDS = 300  # a subnet's trace is reused for this long
+
+ICMP_ECHO_REPLY = 0
+ICMP_DESTINATION_UNREACHABLE = 3
+ICMP_ECHO_REQUEST = 8
+ICMP_TIME_EXCEEDED = 11
+_ICMP_HEADER = struct.Struct("!BBHHH")  # type, code, checksum, identifier, sequence
+_PAYLOAD = b"gcs-path-trace"
+
+
+class Hop:
+    __slots__ = ("ttl", "address", "rtt")
+
+    def __init__(self, ttl: int, address: Optional[str] = None, rtt: Optional[float] = None) -> None:
+        self.ttl = ttl
+        self.address = address  # None when nothing answered at this ttl
+        self.rtt = rtt  # seconds
+
+    def __str__(self) -> str:
+        if self.address is None:
+            return f"{self.ttl:>2}  *"
+        return f"{self.ttl:>2}  {self.address}  {self.rtt * 1000:.1f} ms"
+
+
+class PathTrace:
+    """hops towards a target, up to the destination or the last router that answered"""
+
+    __slots__ = ("target", "subnet", "hops", "reached", "error", "finished_at")
+
+    def __init__(self, target: str, hops: Optional[List[Hop]] = None, reached: bool = False,
+                 error: Optional[str] = None) -> None:
+        self.target = target
+        self.subnet = subnet_of(target)
+        self.hops = hops or []
+        self.reached = reached  # whether the target itself answered
+        self.error = error
+        self.finished_at = time.time()
+
+    def summary(self) -> str:
+        """one line version for the log"""
+        if self.error is not None:
+            return f"trace to {self.target} failed: {self.error}"
+        path = " > ".join(hop.address or "*" for hop in self.hops) or "no answers"
+        ending = "reached" if self.reached else "did not reach"
+        return f"{path} ({ending} {self.target} in {len(self.hops)} hops)"
+
+    def to_text(self) -> str:
+        """the hop list, one hop per line like traceroute prints it"""
+        if self.error is not None:
+            return self.summary()
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.finished_at))
+        lines = [f"path to {self.target} at {when}"] + [str(hop) for hop in self.hops]
+        if not self.reached:
+            lines.append(f"    {self.target} did not answer")
+        return "\n".join(lines)
+
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _echo_request(identifier: int, sequence: int) -> bytes:
+    header = _ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    checksum = _checksum(header + _PAYLOAD)
+    return _ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence) + _PAYLOAD
+
+
+def _parse_answer(packet: bytes, identifier: int):
+    """(icmp type, ttl the answer belongs to) of a packet from the raw socket, None if it is not ours"""
+    header_length = (packet[0] & 0x0F) * 4
+    if len(packet) < header_length + _ICMP_HEADER.size:
+        return None
+    icmp_type, _, _, answer_id, sequence = _ICMP_HEADER.unpack_from(packet, header_length)
+    if icmp_type in (ICMP_TIME_EXCEEDED, ICMP_DESTINATION_UNREACHABLE):
+        # the error quotes the ip header and the first 8 bytes of the echo request that caused it
+        inner = header_length + _ICMP_HEADER.size
+        if len(packet) < inner + 1:
+            return None
+        inner_header_length = (packet[inner] & 0x0F) * 4
+        if len(packet) < inner + inner_header_length + _ICMP_HEADER.size:
+            return None
+        _, _, _, answer_id, sequence = _ICMP_HEADER.unpack_from(packet, inner + inner_header_length)
+    elif icmp_type != ICMP_ECHO_REPLY:
+        return None
+    if answer_id != identifier:
+        return None
+    return icmp_type, sequence
+
+
+def trace_path(target: str, max_hops: int = MAX_HOPS, timeout: float = TRACE_TIMEOUT) -> PathTrace:
+    """traces the path to an ipv4 target on the calling thread
+
+    :param target: ip address or host name
+    :type target: str
+    :param max_hops: highest ttl to try, defaults to MAX_HOPS
+    :type max_hops: int, optional
+    :param timeout: seconds to wait for answers, defaults to TRACE_TIMEOUT
+    :type timeout: float, optional
+    :rtype: PathTrace
+    """
+    try:
+        address = socket.gethostbyname(target.strip())
+    except (OSError, UnicodeError) as e:
+        return PathTrace(target, error=f"could not resolve: {e}")
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+    except PermissionError:
+        return PathTrace(target, error="raw icmp sockets need root or administrator rights")
+    except OSError as e:
+        return PathTrace(target, error=str(e))
+
+    identifier = (os.getpid() ^ random.getrandbits(16)) & 0xFFFF
+    sent = {}
+    answers = {}
+    last_ttl = None  # lowest ttl at which the target answered, or a router said it is unreachable
+    with sock:
+        try:
+            for ttl in range(1, max_hops + 1):
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+                sent[ttl] = time.perf_counter()
+                sock.sendto(_echo_request(identifier, ttl), (address, 0))
+        except OSError as e:
+            return PathTrace(target, error=str(e))
+        deadline = time.perf_counter() + timeout
+        while True:
+            if last_ttl is not None and all(ttl in answers for ttl in range(1, last_ttl + 1)):
+                break
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                break
+            packet, (source, _) = sock.recvfrom(1500)
+            received = time.perf_counter()
+            answer = _parse_answer(packet, identifier)
+            if answer is None:
+                continue
+            icmp_type, ttl = answer
+            if ttl not in sent or ttl in answers:
+                continue
+            answers[ttl] = (icmp_type, Hop(ttl, source, received - sent[ttl]))
+            if icmp_type != ICMP_TIME_EXCEEDED:
+                last_ttl = ttl if last_ttl is None else min(last_ttl, ttl)
+
+    if last_ttl is None:
+        last_ttl = max(answers) if answers else 0
+    hops = [answers[ttl][1] if ttl in answers else Hop(ttl) for ttl in range(1, last_ttl + 1)]
+    reached = last_ttl in answers and answers[last_ttl][0] == ICMP_ECHO_REPLY
+    return PathTrace(target, hops, reached)
+
+
+class PathTracer:
+    """runs path traces on a small pool of its own and shares them per subnet.
+
+    A request for a subnet whose trace is fresh is answered from the cache, one for a subnet that is already being
+    traced waits for that trace, so a subnet that fails all at once costs a single trace.
+    """
+
+    def __init__(self, on_finished: Callable[[str, PathTrace], None], workers: int = TRACE_WORKERS,
+                 cache_seconds: float = CACHE_SECONDS) -> None:
+        """
+        :param on_finished: called with the server name and its trace, from a trace worker thread
+        :type on_finished: Callable[[str, PathTrace], None]
+        :param workers: traces running at once, defaults to TRACE_WORKERS
+        :type workers: int, optional
+        :param cache_seconds: seconds a subnet's trace is reused, defaults to CACHE_SECONDS
+        :type cache_seconds: float, optional
+        """
+        self.on_finished = on_finished
+        self.cache_seconds = cache_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="path-trace")
+        self._lock = threading.Lock()
+        self._cache = {}  # subnet -> PathTrace
+        self._waiting = {}  # subnet -> server names waiting for the trace in progress
+        self._counts = {"traces": 0, "cache_hits": 0, "shared": 0, "dropped": 0}
+
+    def request(self, server_name: str, ip: str) -> bool:
+        """asks for the path to a server, the answer comes back through on_finished
+
+        :return: False if the request was dropped because too many traces are pending
+        :rtype: bool
+        """
+        subnet = subnet_of(ip)
+        with self._lock:
+            cached = self._cache.get(subnet)
+            if cached is not None and time.time() - cached.finished_at < self.cache_seconds:
+                self._counts["cache_hits"] += 1
+            elif subnet in self._waiting:
+                self._counts["shared"] += 1
+                self._waiting[subnet].append(server_name)
+                return True
+            elif len(self._waiting) >= MAX_PENDING_TRACES:
+                self._counts["dropped"] += 1
+                return False
+            else:
+                self._counts["traces"] += 1
+                self._waiting[subnet] = [server_name]
+                self._executor.submit(self._run, subnet, ip)
+                return True
+        self.on_finished(server_name, cached)
+        return True
+
+    def _run(self, subnet: str, ip: str) -> None:
+        try:
+            trace = trace_path(ip)
+        except Exception as e:
+            trace = PathTrace(ip, error=str(e) or type(e).__name__)
+        with self._lock:
+            self._cache[subnet] = trace
+            waiting = self._waiting.pop(subnet, [])
+        for server_name in waiting:
+            self.on_finished(server_name, trace)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return dict(self._counts, pending=len(self._waiting), cached_subnets=len(self._cache))
+
+    def stop(self) -> None:
+        self._executor.shutdown(wait=False)
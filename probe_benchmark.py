@@ -0,0 +1,323 @@
+"""Load benchmark for the probe engines.
+
+Generates servers.json style fleets of loopback addresses (127.0.0.0/8 always answers) mixed with blackholed
+addresses that time out, sweeps each fleet once with every configured engine and writes the measurements as JSON
+so runs from different releases can be compared. The memory the server model needs per server is measured for
+every fleet size as well.
+
+Unless --pps is given the packet rate is scaled with the fleet, so a large fleet measures the engine rather than
+the token bucket, and a sweep cut short by --max-seconds reports a projected time to complete. The blackholed
+addresses are spread over several /24s like a real outage, not queued behind one subnet's in-flight cap.
+
+    python probe_benchmark.py --sizes 100,1000 --engines engine,sequential --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List
+
+from probe_engine import BURST, PACKETS_PER_SECOND, PING_TIMEOUT, SUBNET_MAX_IN_FLIGHT, WORKERS, ProbeEngine, run_probe
+from server_state import ServerModel
+
+DEFAULT_SIZES = [100, 1000, 10000, 50000]
+DEFAULT_ENGINES = ["engine", "sequential"]
+# TEST-NET-1 to 3, reserved for documentation so nothing should answer, then the /24s of 198.18.0.0/15, reserved
+# for benchmarks
+BLACKHOLE_PREFIXES = (["192.0.2.", "198.51.100.", "203.0.113."]
+                      + [f"198.{18 + block // 256}.{block % 256}." for block in range(512)])
+BLACKHOLE_SUBNETS = 3  # /24s the blackholed addresses are spread over by default
+SWEEP_SECONDS = 10  # without --pps the rate is scaled so the token bucket alone would let a sweep finish this fast
+MAX_SECONDS = 600  # sweeps are given at least this long, or three times what the token bucket needs if that is more
+JITTER_INTERVAL = 0.01  # seconds between ticks of the jitter probe
+
+
+def generate_fleet(size: int, timeout_fraction: float = 0.05, blackhole_subnets: int = BLACKHOLE_SUBNETS) -> Dict:
+    """builds a fleet in the servers.json format, mostly loopback addresses plus a share of blackholed ones
+
+    :param size: number of servers
+    :type size: int
+    :param timeout_fraction: share of servers that should time out, defaults to 0.05
+    :type timeout_fraction: float, optional
+    :param blackhole_subnets: /24s of BLACKHOLE_PREFIXES the addresses that time out are spread over round robin,
+        defaults to BLACKHOLE_SUBNETS
+    :type blackhole_subnets: int, optional
+    :return: dictionary of server name to {"ip": address}
+    :rtype: Dict
+    """
+    prefixes = BLACKHOLE_PREFIXES[:max(1, blackhole_subnets)]
+    fleet = {}
+    timeouts = int(size * timeout_fraction)
+    for index in range(size - timeouts):
+        # skip .0 and .255 so every address is a plain host address
+        block, host = divmod(index, 254)
+        fleet[f"loopback {index}"] = {"ip": f"127.{block // 256 % 256}.{block % 256}.{host + 1}"}
+    for index in range(timeouts):
+        host, prefix = divmod(index, len(prefixes))
+        fleet[f"blackhole {index}"] = {"ip": f"{prefixes[prefix]}{host % 254 + 1}"}
+    return fleet
+
+
+def write_fleet(fleet: Dict, directory: str) -> str:
+    """writes the fleet as a servers.json file into directory and returns its path"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"servers_{len(fleet)}.json")
+    with open(path, "w") as file:
+        json.dump(fleet, file, indent=4)
+    return path
+
+
+def current_rss():
+    """resident set size of this process in bytes, None if it can not be read on this platform"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return None
+
+
+def percentiles(values: List[float], scale: float = 1000.0) -> Dict:
+    """p50, p99 and max of values, scaled to milliseconds by default"""
+    if not values:
+        return {"p50": None, "p99": None, "max": None}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * scale
+    return {"p50": round(pick(0.50), 3), "p99": round(pick(0.99), 3), "max": round(ordered[-1] * scale, 3)}
+
+
+class JitterProbe:
+    """ticks every JITTER_INTERVAL on its own thread and records how late each tick was.
+
+    Lateness grows when the probe threads hold the gil or the machine is loaded, the same thing that makes timers
+    fire late on the gui thread.
+    """
+
+    def __init__(self, interval: float = JITTER_INTERVAL) -> None:
+        self.interval = interval
+        self.lateness = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="jitter-probe", daemon=True)
+
+    def _run(self) -> None:
+        expected = time.perf_counter() + self.interval
+        while not self._stop.wait(max(0.0, expected - time.perf_counter())):
+            now = time.perf_counter()
+            self.lateness.append(max(0.0, now - expected))
+            expected = now + self.interval
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def sweep_with_engine(fleet: Dict, deadline: float, packets_per_second: float, burst: float,
+                      subnet_max_in_flight: int, workers: int, timeout: float) -> List:
+    """probes every server once through a ProbeEngine and returns the results that finished before the deadline"""
+    results = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def on_result(result):
+        with lock:
+            results.append(result)
+            if len(results) == len(fleet):
+                done.set()
+
+    engine = ProbeEngine(on_result=on_result, packets_per_second=packets_per_second, burst=burst,
+                         subnet_max_in_flight=subnet_max_in_flight, workers=workers, timeout=timeout)
+    engine.start()
+    for server_name, server in fleet.items():
+        engine.submit(server_name, server["ip"], config=server)
+    done.wait(max(0.0, deadline - time.perf_counter()))
+    engine.stop()
+    with lock:
+        return list(results)
+
+
+def sweep_sequential(fleet: Dict, deadline: float, timeout: float) -> List:
+    """probes every server one after another on one thread, the way the panel did before the probe engine"""
+    results = []
+    for server_name, server in fleet.items():
+        if time.perf_counter() >= deadline:
+            break
+        started_at = time.monotonic()
+        result = run_probe(server_name, server["ip"], server, timeout=timeout)
+        result.queued_at = result.started_at = started_at
+        result.finished_at = time.monotonic()
+        results.append(result)
+    return results
+
+
+def measure_model_memory(fleet: Dict) -> Dict:
+    """bytes allocated per server by parsing the fleet's json and by building the server model from it. Names and
+    addresses are shared with the parsed json, so the model's figure is what it adds on top
+
+    :rtype: Dict
+    """
+    text = json.dumps(fleet)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        parsed = json.loads(text)
+        after_parse = tracemalloc.get_traced_memory()[0]
+        model = ServerModel(parsed)
+        after_model = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    size = len(model) or 1
+    return {
+        "fleet_size": len(model),
+        "json_bytes_per_server": round((after_parse - before) / size, 1),
+        "model_bytes_per_server": round((after_model - after_parse) / size, 1),
+    }
+
+
+def sweep_settings(size: int, args) -> Dict:
+    """packet rate, token bucket burst and time limit of a sweep of size servers, scaled with the fleet where the
+    arguments leave them out"""
+    pps = args.pps if args.pps is not None else max(PACKETS_PER_SECOND, size / SWEEP_SECONDS)
+    burst = args.burst if args.burst is not None else max(BURST, pps)
+    max_seconds = args.max_seconds if args.max_seconds is not None else max(MAX_SECONDS, 3 * size / pps)
+    return {"packets_per_second": pps, "burst": burst, "max_seconds": max_seconds}
+
+
+def run_benchmark(engine: str, fleet: Dict, args) -> Dict:
+    """sweeps the fleet once with the named engine and measures it
+
+    :return: one result record for the output json
+    :rtype: Dict
+    """
+    settings = sweep_settings(len(fleet), args)
+    rss_before = current_rss()
+    cpu_before = time.process_time()
+    start = time.perf_counter()
+    deadline = start + settings["max_seconds"]
+    with JitterProbe() as jitter:
+        if engine == "sequential":
+            results = sweep_sequential(fleet, deadline, args.timeout)
+        else:
+            results = sweep_with_engine(fleet, deadline, settings["packets_per_second"], settings["burst"],
+                                        args.subnet_cap, args.workers, args.timeout)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_before
+    rss_after = current_rss()
+    bucket_seconds = (round(max(0.0, len(fleet) - settings["burst"]) / settings["packets_per_second"], 2)
+                      if engine == "engine" else None)
+
+    return {
+        "engine": engine,
+        "fleet_size": len(fleet),
+        "completed": len(results),
+        "incomplete": len(results) < len(fleet),
+        "reachable": sum(1 for result in results if result.reachable),
+        "unreachable": sum(1 for result in results if not result.reachable),
+        "errors": sum(1 for result in results if result.error is not None),
+        "sweep_seconds": round(elapsed, 4),
+        # the whole sweep's time at the rate the finished part went, but no less than the token bucket allows. The
+        # measured time for complete sweeps
+        "projected_sweep_seconds": (round(elapsed if len(results) == len(fleet) else max(
+            elapsed * len(fleet) / len(results), bucket_seconds or 0.0), 2) if results else None),
+        # the least the token bucket allows, a sweep close to it measures the bucket rather than the engine
+        "bucket_seconds": bucket_seconds,
+        **settings,
+        "probes_per_second": round(len(results) / elapsed, 2) if elapsed else None,
+        "cpu_seconds": round(cpu, 4),
+        "cpu_percent": round(100.0 * cpu / elapsed, 2) if elapsed else None,
+        "rss_before_bytes": rss_before,
+        "rss_after_bytes": rss_after,
+        "scheduling_jitter_ms": percentiles(jitter.lateness),
+        "queue_wait_ms": percentiles([result.queue_wait for result in results]),
+        "probe_time_ms": percentiles([result.finished_at - result.started_at for result in results]),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the probe engines against loopback fleets.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma separated fleet sizes (default: %(default)s)")
+    parser.add_argument("--engines", default=",".join(DEFAULT_ENGINES),
+                        help="comma separated engines to run, 'engine' and/or 'sequential' (default: %(default)s)")
+    parser.add_argument("--timeout-fraction", type=float, default=0.05,
+                        help="share of servers that are blackholed and time out (default: %(default)s)")
+    parser.add_argument("--blackhole-subnets", type=int, default=BLACKHOLE_SUBNETS,
+                        help=f"/24s the addresses that time out are spread over, up to {len(BLACKHOLE_PREFIXES)} "
+                             f"(default: %(default)s)")
+    parser.add_argument("--pps", type=float,
+                        help=f"engine packets per second (default: fleet size / {SWEEP_SECONDS}, at least "
+                             f"{PACKETS_PER_SECOND})")
+    parser.add_argument("--burst", type=float, help=f"engine token bucket burst (default: the rate, at least {BURST})")
+    parser.add_argument("--subnet-cap", type=int, default=SUBNET_MAX_IN_FLIGHT, help="engine in-flight cap per subnet")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="engine worker threads")
+    parser.add_argument("--timeout", type=float, default=PING_TIMEOUT, help="probe timeout in seconds")
+    parser.add_argument("--max-seconds", type=float,
+                        help="give up on a sweep after this long and report it as incomplete (default: three times "
+                             f"what the token bucket needs, at least {MAX_SECONDS})")
+    parser.add_argument("--fleet-dir", default="benchmark_fleets", help="where the generated servers.json files go")
+    parser.add_argument("--output", default="probe_benchmark_results.json", help="json file to write results to")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    engines = [engine.strip() for engine in args.engines.split(",") if engine.strip()]
+    for engine in engines:
+        if engine not in ("engine", "sequential"):
+            sys.exit(f"unknown engine {engine!r}, expected 'engine' or 'sequential'")
+
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "packets_per_second": args.pps, "burst": args.burst, "subnet_max_in_flight": args.subnet_cap,
+            "workers": args.workers, "timeout": args.timeout, "timeout_fraction": args.timeout_fraction,
+            "blackhole_subnets": args.blackhole_subnets, "max_seconds": args.max_seconds,
+        },
+        "runs": [],
+        "model_memory": [],
+    }
+    for size in sizes:
+        fleet = generate_fleet(size, args.timeout_fraction, args.blackhole_subnets)
+        fleet_path = write_fleet(fleet, args.fleet_dir)
+        memory = measure_model_memory(fleet)
+        report["model_memory"].append(memory)
+        print(f"server model for {size} servers: {memory['model_bytes_per_server']} bytes per server")
+        for engine in engines:
+            print(f"sweeping {size} servers from {fleet_path} with {engine}...")
+            run = run_benchmark(engine, fleet, args)
+            run["fleet_file"] = fleet_path
+            report["runs"].append(run)
+            print(f"  {run['completed']}/{size} in {run['sweep_seconds']} s, {run['probes_per_second']} probes/s, "
+                  f"cpu {run['cpu_seconds']} s, jitter p99 {run['scheduling_jitter_ms']['p99']} ms")
+            if run["incomplete"]:
+                print(f"  incomplete, projected to take {run['projected_sweep_seconds']} s")
+
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=4)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
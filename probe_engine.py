@@ -0,0 +1,433 @@
+import heapq
+import ipaddress
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional
+
+from ping3 import ping
+
+from burst_probe import burst_settings
+from rate_limiter import RateMeter, TokenBucket
+
+PING_TIMEOUT = 2  # seconds
+PACKETS_PER_SECOND = 20  # global probe budget, keeps upstream routers from rate limiting our echoes
+BURST = 20
+SUBNET_MAX_IN_FLIGHT = 16  # probes in flight at once towards the same /24
+WORKERS = 32
+PROBE_INTERVAL = 5  # seconds between the scheduled probes of a server
+PARENT_DOWN_INTERVAL = 60  # seconds between probes of a server whose depends_on parent is down
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+def subnet_of(ip: str) -> str:
+    """returns the subnet a target is grouped under for the in-flight cap, /24 for ipv4 and /64 for ipv6.
+    Host names are not resolved here, they are each their own group.
+
+    :param ip: ip address or host name
+    :type ip: str
+    :return: subnet in cidr notation, or the host name
+    :rtype: str
+    """
+    try:
+        address = ipaddress.ip_address(ip.strip())
+    except ValueError:
+        return ip.strip().lower()
+    prefix = 24 if address.version == 4 else 64
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+def probe_packets(config: Optional[Dict]) -> int:
+    """echo requests a probe of the server sends, what it costs in the packets per second budget"""
+    burst = burst_settings(config)
+    return burst["count"] if burst is not None and not (config or {}).get("http") else 1
+
+
+class ProbeRequest:
+    __slots__ = ("priority", "seq", "server_name", "ip", "config", "subnet", "packets", "queued_at", "cancelled")
+
+    def __init__(self, priority, seq, server_name, ip, config, subnet):
+        self.priority = priority
+        self.seq = seq
+        self.server_name = server_name
+        self.ip = ip
+        self.config = config
+        self.subnet = subnet
+        self.packets = probe_packets(config)
+        self.queued_at = time.monotonic()
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class ProbeResult:
+    """outcome of one probe, handed to the engine's on_result callback from a worker thread"""
+
+    __slots__ = ("server_name", "ip", "reachable", "rtt", "error", "http", "burst", "queued_at", "started_at",
+                 "finished_at")
+
+    def __init__(self, server_name: str, ip: str, reachable: bool, rtt: Optional[float] = None,
+                 error: Optional[str] = None, http=None, burst=None) -> None:
+        self.server_name = server_name
+        self.ip = ip
+        self.reachable = reachable
+        self.rtt = rtt  # seconds
+        self.error = error  # set when the probe itself raised, not when the server was simply unreachable
+        self.http = http  # HttpProbeResult for servers checked over http
+        self.burst = burst  # BurstResult for servers probed in bursts, rtt is then the burst's mean
+        self.queued_at = None
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def queue_wait(self) -> float:
+        return self.started_at - self.queued_at
+
+
+def run_probe(server_name: str, ip: str, config: Optional[Dict] = None, http_prober=None,
+              timeout: float = PING_TIMEOUT, jitter: Optional[float] = None) -> ProbeResult:
+    """probes one server right away on the calling thread, an http check if the server has an "http" section,
+    a burst of icmp echoes if it has a "burst" section, a single icmp echo otherwise
+
+    :param server_name: name of server
+    :type server_name: str
+    :param ip: ip address of server
+    :type ip: str
+    :param config: the server's entry from servers.json, defaults to None
+    :type config: Dict, optional
+    :param http_prober: prober to use for http checks, defaults to None
+    :type http_prober: HttpProber, optional
+    :param timeout: icmp timeout in seconds, defaults to PING_TIMEOUT
+    :type timeout: float, optional
+    :param jitter: the server's jitter after its previous burst, defaults to None
+    :type jitter: float, optional
+    :rtype: ProbeResult
+    """
+    try:
+        http_config = (config or {}).get("http")
+        if http_config:
+            if http_prober is None:
+                from http_probe import HttpProber
+                http_prober = HttpProber()
+            http_result = http_prober.probe_config(ip, http_config)
+            return ProbeResult(server_name, ip, http_result.ok, rtt=http_result.total if http_result.ok else None,
+                               http=http_result)
+        burst = burst_settings(config)
+        if burst is not None:
+            from burst_probe import probe_burst
+            burst_result = probe_burst(ip, burst, jitter, timeout)
+            return ProbeResult(server_name, ip, burst_result.received > 0, rtt=burst_result.mean, burst=burst_result)
+        response = ping(ip, timeout=timeout)
+        # ping3 returns None on timeout and False on errors such as an unknown host
+        reachable = response is not None and response is not False
+        return ProbeResult(server_name, ip, reachable, rtt=response if reachable else None)
+    except Exception as e:
+        return ProbeResult(server_name, ip, False, error=str(e) or type(e).__name__)
+
+
+class ProbeEngine:
+    """runs probes on a pool of worker threads, admitting them through a global packets per second token bucket
+    and a cap on probes in flight per subnet.
+
+    Probes over either limit wait in per-subnet priority queues instead of being dropped. A ready heap holds the
+    head of every subnet queue that has room, so the next probe to send is found without scanning every subnet.
+    Periodic probes are scheduled on the engine as well, a heap of due times replaces one gui timer per server.
+    """
+
+    def __init__(self, on_result: Callable[[ProbeResult], None], packets_per_second: float = PACKETS_PER_SECOND,
+                 burst: float = BURST, subnet_max_in_flight: int = SUBNET_MAX_IN_FLIGHT, workers: int = WORKERS,
+                 timeout: float = PING_TIMEOUT) -> None:
+        """
+        :param on_result: called with every ProbeResult, from a worker thread
+        :type on_result: Callable[[ProbeResult], None]
+        :param packets_per_second: global probe rate, defaults to PACKETS_PER_SECOND
+        :type packets_per_second: float, optional
+        :param burst: probes that may be sent back to back after an idle period, defaults to BURST
+        :type burst: float, optional
+        :param subnet_max_in_flight: probes in flight per subnet, defaults to SUBNET_MAX_IN_FLIGHT
+        :type subnet_max_in_flight: int, optional
+        :param workers: worker threads, also the global in-flight limit, defaults to WORKERS
+        :type workers: int, optional
+        :param timeout: icmp timeout in seconds, defaults to PING_TIMEOUT
+        :type timeout: float, optional
+        """
+        self.on_result = on_result
+        self.bucket = TokenBucket(packets_per_second, burst)
+        self.subnet_max_in_flight = subnet_max_in_flight
+        self.workers = workers
+        self.timeout = timeout
+        self._http_prober = None  # created on the first http probe, keeps ssl out of startup
+
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._queues = {}  # subnet -> heap of ProbeRequest
+        self._ready = []  # heap of (priority, seq, subnet) for subnets that may send their head request
+        self._in_flight = {}  # subnet -> probes running
+        self._queued = {}  # server name -> queued ProbeRequest
+        self._running = set()  # server names with a probe running
+        self._subnets = {}  # ip -> subnet, so the address is parsed once
+        self._jitter = {}  # server name -> jitter after its last burst, carried into the next one
+        self._schedule = {}  # server name -> (ip, config, interval, generation) of servers probed periodically
+        self._due = []  # heap of (due time, generation, server name), entries of unscheduled servers go stale
+        self._meter = RateMeter()  # packets sent, a burst counts every echo so the rate compares to the bucket's
+        self._subnet_meters = {}  # subnet -> RateMeter of its packets
+        self._queue_wait = 0.0  # smoothed seconds a probe waited for admission
+        self._max_queue_wait = 0.0
+        self._executor = None
+        self._dispatcher = None
+        self._running_flag = False
+
+    def start(self) -> None:
+        if self._running_flag:
+            return
+        self._running_flag = True
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="probe")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="probe-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def stop(self) -> None:
+        """stops dispatching, queued probes are dropped and running ones finish in the background"""
+        with self._cond:
+            self._running_flag = False
+            self._queues.clear()
+            self._ready.clear()
+            self._queued.clear()
+            self._schedule.clear()
+            self._due.clear()
+            self._cond.notify_all()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        if self._http_prober is not None:
+            self._http_prober.close()
+
+    def http_prober(self):
+        """the shared HttpProber, imported and created on first use"""
+        if self._http_prober is None:
+            from http_probe import HttpProber
+            with self._cond:
+                if self._http_prober is None:
+                    self._http_prober = HttpProber()
+        return self._http_prober
+
+    def submit(self, server_name: str, ip: str, config: Optional[Dict] = None, priority: int = PRIORITY_NORMAL) -> bool:
+        """queues a probe of the server, a server that is already queued or running is not queued twice
+
+        :param server_name: name of server
+        :type server_name: str
+        :param ip: ip address of server
+        :type ip: str
+        :param config: the server's entry from servers.json, defaults to None
+        :type config: Dict, optional
+        :param priority: PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW, defaults to PRIORITY_NORMAL
+        :type priority: int, optional
+        :return: True if the probe was queued
+        :rtype: bool
+        """
+        with self._cond:
+            if server_name in self._queued or server_name in self._running:
+                return False
+            subnet = self._subnets.get(ip)
+            if subnet is None:
+                subnet = self._subnets[ip] = subnet_of(ip)
+            request = ProbeRequest(priority, next(self._seq), server_name, ip, config, subnet)
+            queue = self._queues.setdefault(subnet, [])
+            heapq.heappush(queue, request)
+            self._queued[server_name] = request
+            if queue[0] is request:
+                self._mark_ready(subnet)
+            self._cond.notify()
+            return True
+
+    def sweep(self, servers: Iterable, priority: int = PRIORITY_HIGH) -> int:
+        """queues one probe of every server at once, ahead of the periodic probes by default. The token bucket and
+        subnet caps still apply, so a large fleet is swept as fast as the limits allow and no faster
+
+        :param servers: servers with name, ip and config attributes, such as ServerState
+        :type servers: Iterable
+        :param priority: priority of the sweep's probes, defaults to PRIORITY_HIGH
+        :type priority: int, optional
+        :return: number of probes queued
+        :rtype: int
+        """
+        with self._cond:
+            return sum(self.submit(server.name, server.ip, config=server.config, priority=priority)
+                       for server in servers)
+
+    def schedule(self, server_name: str, ip: str, config: Optional[Dict] = None, interval: float = PROBE_INTERVAL,
+                 delay: Optional[float] = None) -> None:
+        """probes the server every interval seconds until it is unscheduled, rescheduling replaces the old entry
+
+        :param server_name: name of server
+        :type server_name: str
+        :param ip: ip address of server
+        :type ip: str
+        :param config: the server's entry from servers.json, defaults to None
+        :type config: Dict, optional
+        :param interval: seconds between probes, defaults to PROBE_INTERVAL
+        :type interval: float, optional
+        :param delay: seconds until the first probe, defaults to interval
+        :type delay: float, optional
+        """
+        with self._cond:
+            generation = next(self._seq)
+            self._schedule[server_name] = (ip, config, interval, generation)
+            due = time.monotonic() + (interval if delay is None else delay)
+            heapq.heappush(self._due, (due, generation, server_name))
+            self._cond.notify()
+
+    def unschedule(self, server_name: str) -> None:
+        """stops the server's periodic probes and drops a queued one"""
+        with self._cond:
+            self._schedule.pop(server_name, None)
+            self.cancel(server_name)
+
+    def _release_due(self, now: float) -> Optional[float]:
+        """queues the periodic probes that are due, caller holds the lock
+
+        :return: seconds until the next one is due, None if nothing is scheduled
+        :rtype: Optional[float]
+        """
+        while self._due and self._due[0][0] <= now:
+            due, generation, server_name = heapq.heappop(self._due)
+            entry = self._schedule.get(server_name)
+            if entry is None or entry[3] != generation:
+                continue
+            ip, config, interval, _ = entry
+            self.submit(server_name, ip, config=config)
+            # a late tick is not made up for, the next one keeps the interval from now
+            heapq.heappush(self._due, (max(due + interval, now), generation, server_name))
+        return self._due[0][0] - now if self._due else None
+
+    def cancel(self, server_name: str) -> None:
+        """drops a queued probe of the server, a probe that is already running still reports its result"""
+        with self._cond:
+            request = self._queued.pop(server_name, None)
+            if request is not None:
+                request.cancelled = True
+
+    def _mark_ready(self, subnet: str) -> None:
+        """pushes the subnet's head request onto the ready heap if the subnet has room, caller holds the lock"""
+        queue = self._queues.get(subnet)
+        if queue and self._in_flight.get(subnet, 0) < self.subnet_max_in_flight:
+            head = queue[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, subnet))
+
+    def _next_request(self) -> Optional[ProbeRequest]:
+        """pops the best request that its subnet has room for, caller holds the lock"""
+        while self._ready:
+            priority, seq, subnet = self._ready[0]
+            queue = self._queues.get(subnet)
+            # entries go stale when the head was sent, cancelled or beaten by a higher priority request
+            if not queue or queue[0].seq != seq or self._in_flight.get(subnet, 0) >= self.subnet_max_in_flight:
+                heapq.heappop(self._ready)
+                continue
+            if queue[0].cancelled:
+                heapq.heappop(self._ready)
+                heapq.heappop(queue)
+                self._after_head_change(subnet)
+                continue
+            return queue[0]
+        return None
+
+    def _after_head_change(self, subnet: str) -> None:
+        if self._queues.get(subnet):
+            self._mark_ready(subnet)
+        else:
+            self._queues.pop(subnet, None)
+
+    def _dispatch_loop(self) -> None:
+        with self._cond:
+            while self._running_flag:
+                next_due = self._release_due(time.monotonic())
+                if len(self._running) >= self.workers:
+                    # every worker is busy, tokens are only taken once a probe can start so the pacing holds.
+                    # _run notifies when a worker frees up
+                    self._cond.wait(next_due)
+                    continue
+                request = self._next_request()
+                if request is None:
+                    self._cond.wait(next_due)
+                    continue
+                # a burst takes one token per echo, never more than the bucket holds
+                packets = min(request.packets, self.bucket.burst)
+                wait = self.bucket.time_until(packets)
+                if wait > 0 or not self.bucket.try_take(packets):
+                    # re-check after the wait, a higher priority request may have arrived in the meantime
+                    self._cond.wait(max(wait, 0.001))
+                    continue
+
+                heapq.heappop(self._ready)
+                heapq.heappop(self._queues[request.subnet])
+                del self._queued[request.server_name]
+                self._running.add(request.server_name)
+                self._in_flight[request.subnet] = self._in_flight.get(request.subnet, 0) + 1
+                self._after_head_change(request.subnet)
+
+                now = time.monotonic()
+                waited = now - request.queued_at
+                self._queue_wait += (waited - self._queue_wait) / 8
+                self._max_queue_wait = max(self._max_queue_wait, waited)
+                self._meter.add(packets, now)
+                self._subnet_meters.setdefault(request.subnet, RateMeter()).add(packets, now)
+                self._executor.submit(self._run, request)
+
+    def _run(self, request: ProbeRequest) -> None:
+        started_at = time.monotonic()
+        try:
+            http_prober = self.http_prober() if (request.config or {}).get("http") else None
+            result = run_probe(request.server_name, request.ip, request.config, http_prober, self.timeout,
+                               self._jitter.get(request.server_name))
+            if result.burst is not None:
+                self._jitter[request.server_name] = result.burst.jitter
+        finally:
+            with self._cond:
+                self._running.discard(request.server_name)
+                self._in_flight[request.subnet] -= 1
+                if not self._in_flight[request.subnet]:
+                    del self._in_flight[request.subnet]
+                self._mark_ready(request.subnet)
+                self._cond.notify()
+        result.queued_at = request.queued_at
+        result.started_at = started_at
+        result.finished_at = time.monotonic()
+        self.on_result(result)
+
+    def metrics(self) -> Dict:
+        """effective rates and queue state of the engine
+
+        :return: dictionary of metrics, with a "subnets" entry holding per subnet numbers
+        :rtype: Dict
+        """
+        with self._cond:
+            now = time.monotonic()
+            subnets = {}
+            for subnet, meter in list(self._subnet_meters.items()):
+                rate = meter.rate(now)
+                in_flight = self._in_flight.get(subnet, 0)
+                queued = len(self._queues.get(subnet, ()))
+                if not rate and not in_flight and not queued:
+                    del self._subnet_meters[subnet]
+                    continue
+                subnets[subnet] = {"packets_per_second": round(rate, 2), "in_flight": in_flight, "queued": queued}
+            max_queue_wait, self._max_queue_wait = self._max_queue_wait, 0.0
+            return {
+                "packets_per_second": round(self._meter.rate(now), 2),
+                "packets_per_second_limit": self.bucket.rate,
+                "tokens_available": round(self.bucket.available(), 2),
+                "subnet_max_in_flight": self.subnet_max_in_flight,
+                "packets_total": self._meter.total,
+                "queued": len(self._queued),
+                "scheduled": len(self._schedule),
+                "in_flight": len(self._running),
+                "subnets_at_cap": sum(1 for n in self._in_flight.values() if n >= self.subnet_max_in_flight),
+                "avg_queue_wait": round(self._queue_wait, 4),
+                "max_queue_wait": round(max_queue_wait, 4),
+                "subnets": subnets,
+            }
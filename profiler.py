@@ -0,0 +1,260 @@
+"""On-demand profiling of the running panel.
+
+A capture is started from the panel with ctrl+shift+p, by sending the process SIGUSR2 (SIGBREAK on windows), or from
+another terminal with this module's command line, which drops a trigger file the panel picks up:
+
+    python profiler.py --duration 30 --mode sampling
+
+Sampling captures write a collapsed stack file (one "frame;frame;frame count" line per stack, readable by
+flamegraph.pl and speedscope) and a top-N summary. cProfile captures write a .pstats file and the same summary.
+"""
+import argparse
+import cProfile
+import io
+import json
+import math
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+TRIGGER_FILE = "gcs_profile.trigger"
+DEFAULT_DURATION = 30  # seconds
+DEFAULT_MODE = "sampling"
+MODES = ("sampling", "cprofile")
+SAMPLE_INTERVAL = 0.01  # seconds between stack samples, 100 Hz keeps the overhead around a percent
+TOP_N = 25
+
+
+class SamplingProfiler:
+    """samples the stacks of every thread from sys._current_frames on a background thread"""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.stacks = Counter()  # collapsed stack -> samples
+        self.samples = 0
+        self._labels = {}  # code object -> frame label, formatting is the expensive part of a sample
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+            self._labels[code] = label
+        return label
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)).replace(";", ","))
+                self.stacks[";".join(reversed(frames))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path: str) -> None:
+        with open(path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+    def summary(self, top: int = TOP_N) -> str:
+        """top functions by samples where they were running (self) and on the stack at all (total)"""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]  # the first entry is the thread name
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        thread_samples = sum(self.stacks.values()) or 1
+        lines = [f"{self.samples} samples every {self.interval * 1000:.0f} ms, {len(self.stacks)} distinct stacks", ""]
+        for title, counter in (("self", own), ("total", total)):
+            lines.append(f"top {top} by {title} samples:")
+            for frame, count in counter.most_common(top):
+                lines.append(f"{count:>8} {100.0 * count / thread_samples:6.2f}%  {frame}")
+            lines.append("")
+        return "\n".join(lines)
+
+
+class CProfileSession:
+    """deterministic profile of the thread that starts it, normally the gui thread"""
+
+    def __init__(self) -> None:
+        self.profile = cProfile.Profile()
+
+    def start(self) -> None:
+        self.profile.enable()
+
+    def stop(self) -> None:
+        self.profile.disable()
+
+    def write_stats(self, path: str) -> None:
+        self.profile.dump_stats(path)
+
+    def summary(self, top: int = TOP_N) -> str:
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats("tottime").print_stats(top)
+        stats.sort_stats("cumulative").print_stats(top)
+        return stream.getvalue()
+
+
+class ProfileController:
+    """runs one capture at a time and writes its output files when it stops.
+
+    The controller does not keep time itself, the caller stops the capture after the duration it asked for, which
+    lets a cProfile capture be stopped on the same thread that started it.
+    """
+
+    def __init__(self, output_dir: str = ".", on_finished: Optional[Callable[[Dict], None]] = None) -> None:
+        self.output_dir = output_dir
+        self.on_finished = on_finished
+        self.session = None
+        self.mode = None
+        self.started_at = None
+        self.duration = None
+
+    @property
+    def running(self) -> bool:
+        return self.session is not None
+
+    def start(self, mode: str = DEFAULT_MODE, duration: float = DEFAULT_DURATION) -> bool:
+        """starts a capture, returns False if one is already running
+
+        :param mode: "sampling" or "cprofile", defaults to DEFAULT_MODE
+        :type mode: str, optional
+        :param duration: seconds the caller intends to capture for, defaults to DEFAULT_DURATION
+        :type duration: float, optional
+        :rtype: bool
+        """
+        if self.running:
+            return False
+        if mode not in MODES:
+            raise ValueError(f"unknown profiler mode {mode!r}, expected 'sampling' or 'cprofile'")
+        self.session = SamplingProfiler() if mode == "sampling" else CProfileSession()
+        self.mode = mode
+        self.duration = duration
+        self.started_at = time.time()
+        self.session.start()
+        return True
+
+    def stop(self) -> Optional[Dict]:
+        """stops the capture and writes its files
+
+        :return: paths of the written files, None if nothing was running
+        :rtype: Optional[Dict]
+        """
+        if not self.running:
+            return None
+        session, self.session = self.session, None
+        session.stop()
+        base = os.path.join(self.output_dir, datetime.now().strftime("gcs_profile_%Y_%m_%d_%H%M%S"))
+        output = {"mode": self.mode, "seconds": round(time.time() - self.started_at, 1), "summary": base + ".txt"}
+        if isinstance(session, SamplingProfiler):
+            output["collapsed"] = base + ".collapsed"
+            session.write_collapsed(output["collapsed"])
+        else:
+            output["pstats"] = base + ".pstats"
+            session.write_stats(output["pstats"])
+        with open(output["summary"], "w") as file:
+            file.write(session.summary())
+        if self.on_finished is not None:
+            self.on_finished(output)
+        return output
+
+
+def read_trigger(path: str = TRIGGER_FILE) -> Optional[Dict]:
+    """reads and removes a trigger file left by the command line, None if there is none or it asks for an unknown
+    mode or a duration that is not a positive number
+
+    :return: dictionary with "mode" and "duration"
+    :rtype: Optional[Dict]
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as file:
+            request = json.load(file)
+    except (OSError, ValueError):
+        request = {}
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    if not isinstance(request, dict):
+        request = {}
+    mode = request.get("mode", DEFAULT_MODE)
+    try:
+        duration = float(request.get("duration", DEFAULT_DURATION))
+    except (TypeError, ValueError):
+        duration = math.nan
+    if mode not in MODES or not duration > 0 or math.isinf(duration):
+        print(f"ignoring profile trigger {path}: mode {mode!r}, duration {request.get('duration')!r}")
+        return None
+    return {"mode": mode, "duration": duration}
+
+
+def install_signal_handler(handler: Callable[[], None]) -> Optional[str]:
+    """calls handler when the process gets SIGUSR2, or SIGBREAK (ctrl+break) on windows
+
+    Python runs signal handlers on the main thread between bytecodes, the panel's heartbeat timer makes sure that
+    happens promptly while qt's event loop is waiting.
+
+    :return: name of the signal that was hooked, None if the platform has neither
+    :rtype: Optional[str]
+    """
+    for name in ("SIGUSR2", "SIGBREAK"):
+        signum = getattr(signal, name, None)
+        if signum is not None:
+            signal.signal(signum, lambda *_: handler())
+            return name
+    return None
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Start a profile capture in a running GCS control panel.")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="seconds to capture (default: %(default)s)")
+    parser.add_argument("--mode", choices=MODES, default=DEFAULT_MODE, help="profiler to run")
+    parser.add_argument("--dir", default=".", help="the panel's working directory, where the trigger file goes")
+    parser.add_argument("--pid", type=int, help="send the panel SIGUSR2 instead of writing a trigger file (posix only), "
+                                                "the panel then uses its default mode and duration")
+    args = parser.parse_args(argv)
+
+    if args.pid is not None:
+        if not hasattr(signal, "SIGUSR2"):
+            sys.exit("--pid needs SIGUSR2, use the trigger file on this platform")
+        os.kill(args.pid, signal.SIGUSR2)
+        print(f"sent SIGUSR2 to {args.pid}")
+        return
+    path = os.path.join(args.dir, TRIGGER_FILE)
+    with open(path, "w") as file:
+        json.dump({"mode": args.mode, "duration": args.duration}, file)
+    print(f"requested a {args.duration:.0f} s {args.mode} profile through {path}")
+
+
+if __name__ == "__main__":
+    main()
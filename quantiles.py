@@ -0,0 +1,305 @@
+"""Streaming rtt percentiles over the last hour, day and week for every server and group, without keeping samples.
+
+A sketch is a set of fixed log histograms with the rollups' bins (each bin RTT_BIN_GROWTH times wider than the one
+before, so a percentile is within 5% of the exact value), one per time slice. Each window is a ring of slices: the
+last hour is five 15 minute slices, the last day seven 4 hour slices and the last week eight days. A window always
+counts its current slice, so it covers its span plus up to one slice. A server's sketch is a few KB of 16 bit
+counts. Sketches of the same layout merge by adding the counts of matching slices, which is how group and fleet
+percentiles are made. They are saved sparsely with the state snapshot, a sketch loaded from it is only decoded
+when it is first used and one that has not changed since it was last encoded is not encoded again.
+"""
+import argparse
+import json
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from rollups import _bin_rtt, _rtt_bin
+from sample_store import _numpy
+
+RTT_BIN_CEILING = 5.0  # seconds, slower answers count in the last bin
+BINS = _rtt_bin(RTT_BIN_CEILING) + 1
+# window -> slice seconds and slices kept
+WINDOWS = {
+    "1h": (900, 5),
+    "24h": (4 * 3600, 7),
+    "7d": (86400, 8),
+}
+QUANTILES = (0.5, 0.95, 0.99)
+SERVER_COUNTS = "H"  # a server's counts, saturate at 65535 answers per slice and bin
+GROUP_COUNTS = "I"  # merged counts of a group or the fleet
+
+_LAYOUT = []  # (window, slice seconds, slices, first row)
+for _window, (_width, _slices) in WINDOWS.items():
+    _LAYOUT.append((_window, _width, _slices, sum(layout[2] for layout in _LAYOUT)))
+ROWS = sum(layout[2] for layout in _LAYOUT)
+_WINDOW_LAYOUT = {layout[0]: layout for layout in _LAYOUT}
+
+
+class QuantileSketch:
+    """rtt histograms of one server, or of several merged, per time slice of every window"""
+
+    __slots__ = ("_counts", "_slices", "typecode", "version", "_encoded", "_source")
+
+    def __init__(self, typecode: str = SERVER_COUNTS) -> None:
+        self._counts = array(typecode, bytes(array(typecode).itemsize * ROWS * BINS))  # ROWS rows of BINS counts
+        self._slices = array("q", [-1] * ROWS)  # slice number (time // slice seconds) each row holds, -1 for none
+        self.typecode = typecode
+        self.version = 0
+        self._encoded = None  # (version, to_bytes) of the last encoding, the only data of a sketch not yet decoded
+        self._source = None  # the sketch this one is a copy of, it is handed the copy's encoding
+
+    @property
+    def counts(self) -> array:
+        if self._counts is None:
+            self._decode()
+        return self._counts
+
+    @property
+    def slices(self) -> array:
+        if self._slices is None:
+            self._decode()
+        return self._slices
+
+    @property
+    def nbytes(self) -> int:
+        return self.counts.itemsize * len(self.counts) + self.slices.itemsize * len(self.slices)
+
+    def _claim(self, row: int, number: int) -> bool:
+        """points a row at a slice, emptying it when it held an older one. False for a slice older than the row's.
+        Only called on a decoded sketch"""
+        held = self._slices[row]
+        if held == number:
+            return True
+        if number < held:
+            return False
+        self._slices[row] = number
+        start = row * BINS
+        self._counts[start:start + BINS] = array(self.typecode, bytes(self._counts.itemsize * BINS))
+        return True
+
+    def add(self, when: float, rtt: float) -> None:
+        """counts an answered probe, rtt in seconds"""
+        counts = self.counts
+        rtt_bin = min(_rtt_bin(rtt), BINS - 1)
+        limit = (1 << (8 * counts.itemsize)) - 1
+        for _, width, slices, first in _LAYOUT:
+            number = int(when // width)
+            row = first + number % slices
+            if self._claim(row, number):
+                index = row * BINS + rtt_bin
+                if counts[index] < limit:
+                    counts[index] += 1
+        self.version += 1
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """adds another sketch's counts, slice by slice. Where the two hold different slices the newer one wins"""
+        numpy = _numpy()
+        limit = (1 << (8 * self.counts.itemsize)) - 1
+        if numpy is not None:
+            mine = numpy.frombuffer(self.counts, dtype=self.counts.typecode).reshape(ROWS, BINS)
+            theirs = numpy.frombuffer(other.counts, dtype=other.counts.typecode).reshape(ROWS, BINS)
+            if self.slices == other.slices and self.counts.itemsize > other.counts.itemsize:
+                # the usual case for sketches of the same fleet, 32 bit sums of 16 bit counts don't overflow
+                mine += theirs
+                self.version += 1
+                return
+            my_slices = numpy.frombuffer(self.slices, dtype=numpy.int64)
+            their_slices = numpy.frombuffer(other.slices, dtype=numpy.int64)
+            newer = their_slices > my_slices
+            mine[newer] = 0
+            my_slices[newer] = their_slices[newer]
+            same = (their_slices == my_slices) & (my_slices >= 0)
+            mine[same] = numpy.minimum(mine[same].astype(numpy.uint64) + theirs[same], limit)
+        else:
+            counts = self.counts
+            for row in range(ROWS):
+                number = other.slices[row]
+                if number < 0 or not self._claim(row, number):
+                    continue
+                start = row * BINS
+                for index in range(start, start + BINS):
+                    if other.counts[index]:
+                        counts[index] = min(limit, counts[index] + other.counts[index])
+        self.version += 1
+
+    def histogram(self, window: str, now: Optional[float] = None) -> List[int]:
+        """counts per bin over a window"""
+        _, width, slices, first = _WINDOW_LAYOUT[window]
+        oldest = int((time.time() if now is None else now) // width) - slices + 1
+        rows = [row for row in range(first, first + slices) if self.slices[row] >= oldest]
+        numpy = _numpy()
+        if numpy is not None:
+            counts = numpy.frombuffer(self.counts, dtype=self.counts.typecode).reshape(ROWS, BINS)
+            return counts[rows].sum(axis=0, dtype=numpy.int64).tolist()
+        histogram = [0] * BINS
+        for row in rows:
+            for rtt_bin, count in enumerate(self.counts[row * BINS:(row + 1) * BINS]):
+                histogram[rtt_bin] += count
+        return histogram
+
+    def percentiles(self, window: str, quantiles: Sequence[float] = QUANTILES,
+                    now: Optional[float] = None) -> Optional[Dict[float, float]]:
+        """rtt in seconds at each quantile over a window, None without answered probes in it"""
+        return histogram_percentiles(self.histogram(window, now), quantiles)
+
+    def copy(self) -> "QuantileSketch":
+        """a copy to encode on another thread while this one keeps counting, this one keeps the copy's encoding so
+        it is not encoded again if it hasn't changed by then"""
+        sketch = QuantileSketch.__new__(QuantileSketch)
+        sketch._counts = self.counts[:]
+        sketch._slices = self.slices[:]
+        sketch.typecode = self.typecode
+        sketch.version = self.version
+        sketch._encoded = None
+        sketch._source = self
+        return sketch
+
+    def cached_bytes(self) -> Optional[bytes]:
+        """what to_bytes returns, if the sketch has not changed since it was last encoded"""
+        encoded = self._encoded
+        return encoded[1] if encoded is not None and encoded[0] == self.version else None
+
+    def to_bytes(self) -> bytes:
+        """the slices, then the position and count of every non zero bin"""
+        data = self.cached_bytes()
+        if data is not None:
+            return data
+        numpy = _numpy()
+        if numpy is not None:
+            counts = numpy.frombuffer(self.counts, dtype=self.typecode)
+            positions = numpy.flatnonzero(counts).astype(numpy.uint16)
+            values = counts[positions].astype(numpy.uint32)
+            data = self.slices.tobytes() + positions.tobytes() + values.tobytes()
+        else:
+            positions = array("H", (index for index, count in enumerate(self.counts) if count))
+            values = array("I", (self.counts[index] for index in positions))
+            data = self.slices.tobytes() + positions.tobytes() + values.tobytes()
+        # one tuple assigned at once, a sketch read on another thread never pairs a version with another's bytes
+        self._encoded = (self.version, data)
+        if self._source is not None:
+            self._source._encoded = self._encoded
+        return data
+
+    @classmethod
+    def from_bytes(cls, data: bytes, typecode: str = SERVER_COUNTS) -> "QuantileSketch":
+        """reads what to_bytes wrote. The counts are filled in when the sketch is first used, a restart loads every
+        server's sketch and most are not looked at before their server answers
+
+        :raises ValueError: for data that does not fit the current layout
+        """
+        slices_size = array("q").itemsize * ROWS
+        if len(data) < slices_size or (len(data) - slices_size) % 6:
+            raise ValueError("not a quantile sketch of this layout")
+        sketch = cls.__new__(cls)
+        sketch._counts = sketch._slices = None
+        sketch.typecode = typecode
+        sketch.version = 0
+        sketch._encoded = (0, bytes(data))
+        sketch._source = None
+        return sketch
+
+    def _decode(self) -> None:
+        """fills in the counts and slices of a sketch read by from_bytes, positions outside the layout are dropped"""
+        data = self._encoded[1]
+        counts = array(self.typecode, bytes(array(self.typecode).itemsize * ROWS * BINS))
+        slices_size = array("q").itemsize * ROWS
+        entries = (len(data) - slices_size) // 6
+        positions = array("H", data[slices_size:slices_size + 2 * entries])
+        values = array("I", data[slices_size + 2 * entries:])
+        limit = (1 << (8 * counts.itemsize)) - 1
+        numpy = _numpy()
+        if numpy is not None:
+            positions = numpy.frombuffer(positions, dtype=numpy.uint16)
+            inside = positions < len(counts)
+            numpy.frombuffer(counts, dtype=self.typecode)[positions[inside]] = numpy.minimum(
+                numpy.frombuffer(values, dtype=numpy.uint32)[inside], limit)
+        else:
+            for position, value in zip(positions, values):
+                if position < len(counts):
+                    counts[position] = min(value, limit)
+        self._counts = counts
+        self._slices = array("q", data[:slices_size])
+
+
+def histogram_percentiles(histogram: Sequence[int], quantiles: Sequence[float] = QUANTILES) -> Optional[Dict]:
+    """rtt in seconds at each quantile of a histogram, the geometric middle of the bin it falls in"""
+    total = sum(histogram)
+    if not total:
+        return None
+    result = {}
+    pending = sorted(quantiles)
+    seen = 0
+    for rtt_bin, count in enumerate(histogram):
+        seen += count
+        while pending and seen >= pending[0] * total:
+            result[pending.pop(0)] = _bin_rtt(rtt_bin)
+        if not pending:
+            break
+    return {quantile: result[quantile] for quantile in quantiles}
+
+
+def merged(sketches: Iterable[QuantileSketch]) -> QuantileSketch:
+    """one sketch counting everything the given ones count, for groups and the fleet"""
+    combined = QuantileSketch(GROUP_COUNTS)
+    for sketch in sketches:
+        if sketch is not None:
+            combined.merge(sketch)
+    return combined
+
+
+def describe(percentiles: Optional[Dict[float, float]]) -> str:
+    """"p50 21.3 / p95 30.1 / p99 44.0 ms" """
+    if percentiles is None:
+        return "no answers"
+    return " / ".join(f"p{quantile * 100:g} {rtt * 1000:.1f}" for quantile, rtt in percentiles.items()) + " ms"
+
+
+def report(sketch: QuantileSketch, quantiles: Sequence[float] = QUANTILES, now: Optional[float] = None) -> Dict:
+    """every window's percentiles in milliseconds, None for windows without answers"""
+    result = {}
+    for window in WINDOWS:
+        percentiles = sketch.percentiles(window, quantiles, now)
+        result[window] = None if percentiles is None else {
+            f"p{quantile * 100:g}_ms": round(rtt * 1000, 2) for quantile, rtt in percentiles.items()}
+    return result
+
+
+def main(argv=None) -> None:
+    from server_state import group_of
+    from state_snapshot import SNAPSHOT_FILE, load_snapshot
+    parser = argparse.ArgumentParser(description="Report rtt percentiles from the GCS control panel's state snapshot.")
+    parser.add_argument("server", nargs="*", help="server names, every server when left out")
+    parser.add_argument("--group", action="append", help="merge the servers of a group, repeatable")
+    parser.add_argument("--quantile", type=float, action="append", help=f"default: {', '.join(map(str, QUANTILES))}")
+    parser.add_argument("--snapshot", default=SNAPSHOT_FILE, help="snapshot file (default: %(default)s)")
+    parser.add_argument("--servers", default="servers.json", help="servers file, for groups (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    quantiles = args.quantile or QUANTILES
+    sketches = {}
+    for server_name, known in load_snapshot(args.snapshot).items():
+        if known.get("quantiles"):
+            sketches[server_name] = QuantileSketch.from_bytes(known["quantiles"])
+    result = {}
+    if args.group:
+        try:
+            with open(args.servers) as file:
+                servers = json.load(file)
+        except (OSError, ValueError):
+            servers = {}
+        for group in args.group:
+            members = [name for name, server in servers.items() if group_of(name, server) == group]
+            result[group] = report(merged(sketches.get(name) for name in members), quantiles)
+    elif args.server:
+        lowered = {name.lower(): name for name in sketches}
+        for server_name in args.server:
+            sketch = sketches.get(lowered.get(server_name.lower()))
+            result[server_name] = report(sketch, quantiles) if sketch is not None else None
+    else:
+        result = {server_name: report(sketch, quantiles) for server_name, sketch in sketches.items()}
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import deque
+
+
+class TokenBucket:
+    """classic token bucket: tokens refill at rate per second up to burst, every send takes tokens.
+
+    Thread safe, callers that can not take a token ask how long to wait instead of spinning.
+    """
+
+    def __init__(self, rate: float, burst: float = None) -> None:
+        """
+        :param rate: tokens added per second
+        :type rate: float
+        :param burst: most tokens the bucket can hold, defaults to one second worth of tokens
+        :type burst: float, optional
+        """
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def try_take(self, tokens: float = 1) -> bool:
+        """takes tokens if enough are available
+
+        :return: True if the tokens were taken
+        :rtype: bool
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def time_until(self, tokens: float = 1) -> float:
+        """seconds until tokens will be available, 0 if they are available now"""
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = min(tokens, self.burst) - self._tokens
+            return 0.0 if missing <= 0 else missing / self.rate
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class RateMeter:
+    """counts events over a sliding window to report the effective rate per second.
+
+    Not thread safe on its own, the owner is expected to hold its own lock around it.
+    """
+
+    def __init__(self, window: float = 10.0) -> None:
+        self.window = window
+        self._events = deque()
+        self._in_window = 0
+        self.total = 0
+
+    def add(self, count: int = 1, now: float = None) -> None:
+        now = time.monotonic() if now is None else now
+        self._events.append((now, count))
+        self._in_window += count
+        self.total += count
+        self._expire(now)
+
+    def _expire(self, now: float) -> None:
+        while self._events and now - self._events[0][0] > self.window:
+            self._in_window -= self._events.popleft()[1]
+
+    def rate(self, now: float = None) -> float:
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        return self._in_window / self.window
@@ -0,0 +1,548 @@
+"""rolls probe results up into 1 minute, 15 minute and 1 hour aggregates with a retention of their own.
+
+Every result is folded into the open bucket of each resolution as it arrives, so nothing keeps raw samples and a
+report over a year reads a few thousand hourly buckets. The aggregates are kept in memory as packed records. Closed
+buckets are appended to segment files in ROLLUPS_DIR, one per resolution and day of bucket starts, so a save writes
+what closed since the last one and a day's segment is deleted once it is past its retention. Open buckets are only
+written at shutdown. They load as closed buckets and are merged with whatever the same bucket gets after the restart,
+a later record of a bucket replaces an earlier one. After a crash the coarser buckets since the last saved one are
+rebuilt from the finest resolution.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import struct
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ROLLUPS_DIR = "gcs_rollups"
+MAGIC = b"GCSR"
+VERSION = 2
+SEGMENT_SECONDS = 86400  # bucket starts per segment file
+
+# bucket width in seconds -> seconds its buckets are kept
+RESOLUTIONS = {
+    60: 2 * 86400,
+    900: 31 * 86400,
+    3600: 366 * 86400,
+}
+MAX_QUERY_POINTS = 1500  # a query without a resolution picks the finest one giving at most this many buckets
+MAX_SAMPLE_GAP = 120  # seconds a result accounts for at most, longer gaps (a restart) count as neither up nor down
+PRUNE_SLACK = 0.125  # buckets past their retention are dropped once they make up this share of it, not one at a time
+
+# p95 is read from a histogram with logarithmic bins, each RTT_BIN_GROWTH times wider than the one before, so it is
+# within 5% of the exact value without keeping any samples
+RTT_BIN_FLOOR = 0.0001
+RTT_BIN_GROWTH = 1.1
+_LOG_GROWTH = math.log(RTT_BIN_GROWTH)
+_SEGMENT_NAME = re.compile(r"^rollups_(?P<resolution>\d+)_(?P<day>\d+)\.dat$")
+
+# magic, version, followed by series entries. Files of VERSION 1 were one whole store, HEADER_V1 and the entries
+HEADER = struct.Struct("<4sH")
+HEADER_V1 = struct.Struct("<4sHI")  # magic, version, series count
+# name length, resolution, record count, followed by the name and the records
+SERIES_HEADER = struct.Struct("<HII")
+# bucket start, samples, lost samples, rtt min, avg, max and p95 (NaN without answers), seconds up
+RECORD = struct.Struct("<dIIfffff")
+
+
+def _rtt_bin(rtt: float) -> int:
+    return max(0, int(math.log(max(rtt, RTT_BIN_FLOOR) / RTT_BIN_FLOOR) / _LOG_GROWTH))
+
+
+def _bin_rtt(rtt_bin: int) -> float:
+    """geometric middle of a bin"""
+    return RTT_BIN_FLOOR * RTT_BIN_GROWTH ** (rtt_bin + 0.5)
+
+
+class Rollup:
+    """aggregate of one server's results over one bucket, rtts in seconds and None without answered probes"""
+
+    __slots__ = ("start", "resolution", "samples", "lost", "rtt_min", "rtt_avg", "rtt_max", "rtt_p95", "up_seconds")
+
+    def __init__(self, start: float, resolution: int, samples: int = 0, lost: int = 0,
+                 rtt_min: Optional[float] = None, rtt_avg: Optional[float] = None, rtt_max: Optional[float] = None,
+                 rtt_p95: Optional[float] = None, up_seconds: float = 0.0) -> None:
+        self.start = start
+        self.resolution = resolution
+        self.samples = samples
+        self.lost = lost
+        self.rtt_min = rtt_min
+        self.rtt_avg = rtt_avg
+        self.rtt_max = rtt_max
+        self.rtt_p95 = rtt_p95
+        self.up_seconds = up_seconds
+
+    @property
+    def loss(self) -> Optional[float]:
+        return self.lost / self.samples if self.samples else None
+
+    def to_dict(self) -> Dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def pack(self) -> bytes:
+        return RECORD.pack(self.start, self.samples, self.lost, *(math.nan if value is None else value for value in (
+            self.rtt_min, self.rtt_avg, self.rtt_max, self.rtt_p95)), self.up_seconds)
+
+    @classmethod
+    def unpack(cls, data, offset: int, resolution: int) -> "Rollup":
+        start, samples, lost, *rtts, up_seconds = RECORD.unpack_from(data, offset)
+        return cls(start, resolution, samples, lost, *(None if math.isnan(rtt) else rtt for rtt in rtts), up_seconds)
+
+    @classmethod
+    def combine(cls, rollups: Iterable["Rollup"]) -> Optional["Rollup"]:
+        """one aggregate over several buckets. Bucket p95s cannot be merged exactly, the result's p95 is the
+        sample weighted 95th percentile of them
+
+        :return: None for no rollups
+        :rtype: Optional[Rollup]
+        """
+        rollups = list(rollups)
+        if not rollups:
+            return None
+        answered = [rollup for rollup in rollups if rollup.rtt_avg is not None]
+        combined = cls(rollups[0].start, int(rollups[-1].start + rollups[-1].resolution - rollups[0].start),
+                       samples=sum(rollup.samples for rollup in rollups),
+                       lost=sum(rollup.lost for rollup in rollups),
+                       up_seconds=sum(rollup.up_seconds for rollup in rollups))
+        if answered:
+            weights = [rollup.samples - rollup.lost for rollup in answered]
+            combined.rtt_min = min(rollup.rtt_min for rollup in answered)
+            combined.rtt_max = max(rollup.rtt_max for rollup in answered)
+            combined.rtt_avg = sum(rollup.rtt_avg * weight for rollup, weight in zip(answered, weights)) / sum(weights)
+            target = 0.95 * sum(weights)
+            seen = 0
+            for weight, p95 in sorted(zip(weights, (rollup.rtt_p95 for rollup in answered)), key=lambda pair: pair[1]):
+                seen += weight
+                if seen >= target:
+                    combined.rtt_p95 = p95
+                    break
+        return combined
+
+
+class _OpenBucket:
+    """the bucket results are currently folded into"""
+
+    __slots__ = ("start", "samples", "lost", "rtt_sum", "rtt_min", "rtt_max", "bins", "up_seconds")
+
+    def __init__(self, start: float) -> None:
+        self.start = start
+        self.samples = 0
+        self.lost = 0
+        self.rtt_sum = 0.0
+        self.rtt_min = math.inf
+        self.rtt_max = 0.0
+        self.bins = {}  # histogram bin -> answered samples
+        self.up_seconds = 0.0
+
+    def add(self, rtt: Optional[float], up_seconds: float) -> None:
+        self.samples += 1
+        self.up_seconds += up_seconds
+        if rtt is None:
+            self.lost += 1
+            return
+        self.rtt_sum += rtt
+        self.rtt_min = min(self.rtt_min, rtt)
+        self.rtt_max = max(self.rtt_max, rtt)
+        rtt_bin = _rtt_bin(rtt)
+        self.bins[rtt_bin] = self.bins.get(rtt_bin, 0) + 1
+
+    def p95(self) -> float:
+        target = 0.95 * (self.samples - self.lost)
+        seen = 0
+        for rtt_bin in sorted(self.bins):
+            seen += self.bins[rtt_bin]
+            if seen >= target:
+                return min(self.rtt_max, max(self.rtt_min, _bin_rtt(rtt_bin)))
+        return self.rtt_max
+
+    def to_rollup(self, resolution: int) -> Rollup:
+        answered = self.samples - self.lost
+        if not answered:
+            return Rollup(self.start, resolution, self.samples, self.lost, up_seconds=self.up_seconds)
+        return Rollup(self.start, resolution, self.samples, self.lost, self.rtt_min, self.rtt_sum / answered,
+                      self.rtt_max, self.p95(), self.up_seconds)
+
+
+class RollupSeries:
+    """one server's closed buckets at one resolution, RECORD.size bytes each, plus the open bucket"""
+
+    __slots__ = ("resolution", "retention", "starts", "records", "open", "saved")
+
+    def __init__(self, resolution: int, retention: float = math.inf) -> None:
+        self.resolution = resolution
+        self.retention = retention
+        self.starts = array("d")  # bucket starts, searched with bisect
+        self.records = bytearray()
+        self.open = None
+        self.saved = 0  # leading closed buckets that are on disk as they are
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def add(self, when: float, rtt: Optional[float], up_seconds: float) -> None:
+        start = when - when % self.resolution
+        if self.open is not None and self.open.start != start:
+            if start < self.open.start:
+                return  # results arrive in order, one older than the open bucket is dropped
+            self.close()
+        if self.open is None:
+            if self.starts and start < self.starts[-1]:
+                return
+            self.open = _OpenBucket(start)
+        self.open.add(rtt, up_seconds)
+
+    def close(self) -> None:
+        """moves the open bucket to the closed records, dropping buckets past the retention every so often"""
+        if self.open is None:
+            return
+        rollup = self.open.to_rollup(self.resolution)
+        self.open = None
+        self.put(rollup.start, rollup.pack())
+        if self.starts[0] < rollup.start - self.retention * (1 + PRUNE_SLACK):
+            self.prune(rollup.start - self.retention)
+
+    def put(self, start: float, record: bytes) -> None:
+        """appends a closed bucket. One continuing the last bucket, which was saved before a restart, is merged
+        with it"""
+        if self.starts and self.starts[-1] == start:
+            rollup = Rollup.combine([Rollup.unpack(self.records, len(self.records) - RECORD.size, self.resolution),
+                                     Rollup.unpack(record, 0, self.resolution)])
+            rollup.resolution = self.resolution
+            self.records[-RECORD.size:] = rollup.pack()
+            self.saved = min(self.saved, len(self.starts) - 1)
+            return
+        self.starts.append(start)
+        self.records += record
+
+    def prune(self, before: float) -> int:
+        """drops closed buckets that start before a time, returns how many"""
+        cut = bisect_left(self.starts, before)
+        if cut:
+            del self.starts[:cut]
+            del self.records[:cut * RECORD.size]
+            self.saved = max(0, self.saved - cut)
+        return cut
+
+    def rollups(self, start: float, end: float) -> List[Rollup]:
+        """buckets overlapping [start, end), the open one included"""
+        first = bisect_right(self.starts, start - self.resolution)
+        last = bisect_left(self.starts, end)
+        rollups = [Rollup.unpack(self.records, index * RECORD.size, self.resolution) for index in range(first, last)]
+        if self.open is not None and start - self.resolution < self.open.start < end:
+            rollups.append(self.open.to_rollup(self.resolution))
+        return rollups
+
+
+class RollupStore:
+    """every server's rollups at every resolution in RESOLUTIONS"""
+
+    def __init__(self, resolutions: Optional[Dict[int, float]] = None) -> None:
+        """
+        :param resolutions: bucket width in seconds -> retention in seconds, defaults to RESOLUTIONS
+        :type resolutions: Dict[int, float], optional
+        """
+        self.resolutions = dict(sorted((resolutions or RESOLUTIONS).items()))
+        self._series: Dict[Tuple[str, int], RollupSeries] = {}
+        self._last_sample: Dict[str, float] = {}
+
+    def add(self, server_name: str, when: float, rtt: Optional[float], up: bool) -> None:
+        """folds one result into the open bucket of every resolution
+
+        :param when: unix time of the result
+        :type when: float
+        :param rtt: round trip time in seconds, None for a lost probe
+        :type rtt: Optional[float]
+        :param up: whether the server counted as up, the time since its previous result is added to its up seconds
+        :type up: bool
+        """
+        previous = self._last_sample.get(server_name)
+        self._last_sample[server_name] = when
+        elapsed = when - previous if previous is not None else 0.0
+        up_seconds = elapsed if up and 0 < elapsed <= MAX_SAMPLE_GAP else 0.0
+        for resolution in self.resolutions:
+            series = self._series.get((server_name, resolution))
+            if series is None:
+                series = self._series[(server_name, resolution)] = RollupSeries(resolution, self.resolutions[resolution])
+            series.add(when, rtt, up_seconds)
+
+    def flush(self, now: Optional[float] = None) -> int:
+        """closes open buckets that have ended and drops buckets past their retention, series left empty go away
+
+        :return: buckets dropped
+        :rtype: int
+        """
+        now = time.time() if now is None else now
+        dropped = 0
+        for key, series in list(self._series.items()):
+            if series.open is not None and series.open.start + series.resolution <= now:
+                series.close()
+            dropped += series.prune(now - self.resolutions.get(series.resolution, 0))
+            if not len(series) and series.open is None:
+                del self._series[key]
+        return dropped
+
+    def choose_resolution(self, start: float, end: float, max_points: int = MAX_QUERY_POINTS,
+                          now: Optional[float] = None) -> int:
+        """the finest resolution that still holds the start of the range and gives at most max_points buckets over
+        it, or the coarsest one if none does"""
+        now = time.time() if now is None else now
+        for resolution, retention in self.resolutions.items():
+            if start >= now - retention and (end - start) / resolution <= max_points:
+                return resolution
+        return max(self.resolutions)
+
+    def query(self, server_name: str, start: float, end: Optional[float] = None,
+              resolution: Optional[int] = None) -> List[Rollup]:
+        """a server's buckets over a time range
+
+        :param start: unix time
+        :type start: float
+        :param end: unix time, defaults to now
+        :type end: float, optional
+        :param resolution: bucket width, defaults to choose_resolution
+        :type resolution: int, optional
+        :rtype: List[Rollup]
+        """
+        end = time.time() if end is None else end
+        resolution = self.choose_resolution(start, end) if resolution is None else resolution
+        series = self._series.get((server_name, resolution))
+        return series.rollups(start, end) if series is not None else []
+
+    def summary(self, server_name: str, start: float, end: Optional[float] = None) -> Optional[Rollup]:
+        """one aggregate over a time range, read from the resolution choose_resolution picks for it. Buckets are
+        counted whole, so the finest resolution that reaches back far enough keeps the edges of a short range from
+        pulling in the rest of an hour"""
+        end = time.time() if end is None else end
+        return Rollup.combine(self.query(server_name, start, end, self.choose_resolution(start, end)))
+
+    def server_names(self) -> List[str]:
+        return sorted({server_name for server_name, _ in self._series})
+
+    def metrics(self) -> Dict:
+        buckets = {resolution: 0 for resolution in self.resolutions}
+        for (_, resolution), series in self._series.items():
+            buckets[resolution] = buckets.get(resolution, 0) + len(series)
+        return {
+            "series": len(self._series),
+            "buckets": {f"{resolution}s": count for resolution, count in buckets.items()},
+            "bytes": sum(len(series.records) + series.starts.itemsize * len(series.starts)
+                         for series in self._series.values()),
+        }
+
+    def capture(self, include_open: bool = False) -> List[Tuple[str, int, bytes]]:
+        """the closed buckets not saved yet, copied for write_rollups to write on another thread. They count as saved
+        from here on
+
+        :param include_open: take the open buckets as they are so far as well, for the save at shutdown
+        :type include_open: bool
+        :return: server name, resolution and packed records of every series with something to write
+        :rtype: List[Tuple[str, int, bytes]]
+        """
+        captured = []
+        for (server_name, resolution), series in self._series.items():
+            records = bytearray(series.records[series.saved * RECORD.size:]) if series.saved < len(series) else None
+            series.saved = len(series)
+            if include_open and series.open is not None:
+                rollup = series.open.to_rollup(resolution)
+                if series.starts and series.starts[-1] == rollup.start:
+                    # continues the last bucket, the record written replaces the one on disk
+                    rollup = Rollup.combine([Rollup.unpack(series.records, len(series.records) - RECORD.size,
+                                                           resolution), rollup])
+                    if records:
+                        del records[-RECORD.size:]
+                records = (records or bytearray()) + rollup.pack()
+            if records:
+                captured.append((server_name, resolution, bytes(records)))
+        return captured
+
+    def save(self, path: str = ROLLUPS_DIR) -> None:
+        """writes the buckets closed since the last save and the open ones as they are so far"""
+        write_rollups(path, self.capture(include_open=True), self.resolutions)
+
+    @classmethod
+    def load(cls, path: str = ROLLUPS_DIR, resolutions: Optional[Dict[int, float]] = None) -> "RollupStore":
+        """reads the segments written by write_rollups, or the single file of an older version (path + ".bin")
+        when there are none yet. Torn entries a crash left at the end of a segment are cut off"""
+        store = cls(resolutions)
+        if not os.path.isdir(path):
+            if os.path.exists(path + ".bin"):
+                store._load_v1(path + ".bin")
+            store.flush()
+            return store
+        segments = []
+        for name in os.listdir(path):
+            match = _SEGMENT_NAME.match(name)
+            if match is not None:
+                segments.append((int(match["resolution"]), int(match["day"]), os.path.join(path, name)))
+        for _, _, segment_path in sorted(segments):
+            try:
+                store._load_segment(segment_path)
+            except (OSError, ValueError) as e:
+                print(f"ignoring unreadable rollups {segment_path}: {e}")
+        store._rebuild()
+        store.flush()
+        return store
+
+    def _series_for(self, server_name: str, resolution: int) -> RollupSeries:
+        series = self._series.get((server_name, resolution))
+        if series is None:
+            series = self._series[(server_name, resolution)] = RollupSeries(
+                resolution, self.resolutions.get(resolution, math.inf))
+        return series
+
+    def _load_segment(self, path: str) -> None:
+        with open(path, "rb") as file:
+            data = file.read()
+        if len(data) < HEADER.size or HEADER.unpack_from(data, 0) != (MAGIC, VERSION):
+            raise ValueError("not a rollup segment")
+        offset = HEADER.size
+        while offset < len(data):
+            try:
+                name_length, resolution, count = SERIES_HEADER.unpack_from(data, offset)
+            except struct.error:
+                break
+            end = offset + SERIES_HEADER.size + name_length + count * RECORD.size
+            if end > len(data):
+                break
+            name_end = offset + SERIES_HEADER.size + name_length
+            server_name = data[offset + SERIES_HEADER.size:name_end].decode("utf-8", errors="replace")
+            series = self._series_for(server_name, resolution)
+            records = data[name_end:end]
+            starts = [fields[0] for fields in RECORD.iter_unpack(records)]
+            # records of a bucket already read replace it, they were written later
+            first = 0
+            while first < count and series.starts and starts[first] <= series.starts[-1]:
+                if starts[first] == series.starts[-1]:
+                    series.records[-RECORD.size:] = records[first * RECORD.size:(first + 1) * RECORD.size]
+                first += 1
+            series.starts.extend(starts[first:])
+            series.records += records[first * RECORD.size:]
+            series.saved = len(series)
+            offset = end
+        if offset < len(data):
+            print(f"cutting a torn entry off the end of {path}")
+            with open(path, "r+b") as file:
+                file.truncate(offset)
+
+    def _load_v1(self, path: str) -> None:
+        """reads the single file older versions rewrote on every save, its buckets are written out again as segments"""
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            magic, version, count = HEADER_V1.unpack_from(data, 0)
+            if magic != MAGIC or version != 1:
+                raise ValueError("not a rollup file")
+            offset = HEADER_V1.size
+            for _ in range(count):
+                name_length, resolution, records = SERIES_HEADER.unpack_from(data, offset)
+                offset += SERIES_HEADER.size
+                server_name = data[offset:offset + name_length].decode("utf-8", errors="replace")
+                offset += name_length
+                series = self._series_for(server_name, resolution)
+                series.records = bytearray(data[offset:offset + records * RECORD.size])
+                if len(series.records) != records * RECORD.size:
+                    raise ValueError("truncated")
+                series.starts = array("d", (fields[0] for fields in RECORD.iter_unpack(series.records)))
+                offset += records * RECORD.size
+        except (OSError, ValueError, struct.error) as e:
+            print(f"ignoring unreadable rollups {path}: {e}")
+            self._series.clear()
+
+    def _rebuild(self) -> None:
+        """fills in the coarser buckets a crash lost while they were open from the finest resolution's"""
+        finest, *coarser = self.resolutions
+        for (server_name, resolution), fine in list(self._series.items()):
+            if resolution != finest or not len(fine):
+                continue
+            for width in coarser:
+                series = self._series_for(server_name, width)
+                rebuilt_from = series.starts[-1] + width if len(series) else -math.inf
+                first = bisect_left(fine.starts, rebuilt_from)
+                buckets = {}
+                for index in range(first, len(fine)):
+                    start = fine.starts[index]
+                    buckets.setdefault(start - start % width, []).append(
+                        Rollup.unpack(fine.records, index * RECORD.size, finest))
+                for start, rollups in buckets.items():
+                    rollup = Rollup.combine(rollups)
+                    rollup.start = start
+                    series.put(start, rollup.pack())
+
+
+def write_rollups(path: str, captured: List[Tuple[str, int, bytes]],
+                  resolutions: Optional[Dict[int, float]] = None, now: Optional[float] = None) -> None:
+    """appends what RollupStore.capture took to the segments in a directory, then deletes the segments past their
+    resolution's retention. A failed write is cut off again, so a segment never holds half an entry while running
+
+    :param path: rollup directory
+    :type path: str
+    :param captured: RollupStore.capture's series
+    :type captured: List[Tuple[str, int, bytes]]
+    :param resolutions: bucket width in seconds -> retention in seconds, defaults to RESOLUTIONS
+    :type resolutions: Dict[int, float], optional
+    """
+    os.makedirs(path, exist_ok=True)
+    entries = {}  # (resolution, day) -> entries for that segment
+    for server_name, resolution, records in captured:
+        encoded = server_name.encode("utf-8")
+        position = 0
+        while position < len(records):
+            day = int(RECORD.unpack_from(records, position)[0] // SEGMENT_SECONDS)
+            end = len(records)
+            if int(RECORD.unpack_from(records, end - RECORD.size)[0] // SEGMENT_SECONDS) != day:
+                end = position + RECORD.size
+                while int(RECORD.unpack_from(records, end)[0] // SEGMENT_SECONDS) == day:
+                    end += RECORD.size
+            entries.setdefault((resolution, day), []).append(
+                SERIES_HEADER.pack(len(encoded), resolution, (end - position) // RECORD.size) + encoded
+                + records[position:end])
+            position = end
+    for (resolution, day), segment in sorted(entries.items()):
+        segment_path = os.path.join(path, f"rollups_{resolution}_{day}.dat")
+        size = os.path.getsize(segment_path) if os.path.exists(segment_path) else 0
+        with open(segment_path, "ab" if size >= HEADER.size else "wb") as file:
+            try:
+                if size < HEADER.size:
+                    size = 0
+                    file.write(HEADER.pack(MAGIC, VERSION))
+                file.write(b"".join(segment))
+                file.flush()
+                os.fsync(file.fileno())
+            except OSError:
+                file.truncate(size)
+                raise
+    now = time.time() if now is None else now
+    for name in os.listdir(path):
+        match = _SEGMENT_NAME.match(name)
+        retention = (resolutions or RESOLUTIONS).get(int(match["resolution"])) if match is not None else None
+        if retention is not None and (int(match["day"]) + 1) * SEGMENT_SECONDS <= now - retention:
+            os.remove(os.path.join(path, name))
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Report a server's availability and latency from the rollups.")
+    parser.add_argument("server", nargs="?", help="server name, every server when left out")
+    parser.add_argument("--days", type=float, default=30, help="length of the report (default: %(default)s)")
+    parser.add_argument("--dir", default=ROLLUPS_DIR, help="rollup directory (default: %(default)s)")
+    parser.add_argument("--buckets", action="store_true", help="print every bucket instead of a summary")
+    args = parser.parse_args(argv)
+
+    store = RollupStore.load(args.dir)
+    start = time.time() - args.days * 86400
+    report = {}
+    for server_name in [args.server] if args.server else store.server_names():
+        if args.buckets:
+            report[server_name] = [rollup.to_dict() for rollup in store.query(server_name, start)]
+        else:
+            summary = store.summary(server_name, start)
+            report[server_name] = summary.to_dict() if summary is not None else None
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
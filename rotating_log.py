@@ -0,0 +1,329 @@
+import glob
+import gzip
+import json
+import lzma
+import os
+import queue
+import re
+import threading
+from datetime import datetime
+from typing import Callable, Iterator, List, Optional
+
+LOG_FILE_PATTERN = "gcs_control_panel_log_%Y_%m_%d.txt"
+MAX_SEGMENT_BYTES = 10 * 1024 * 1024  # a day's log is split into segments of at most this size
+BLOCK_BYTES = 256 * 1024  # closed segments are compressed in independent blocks of about this many raw bytes
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+INDEX_SUFFIX = ".idx"
+COMPRESSIONS = {"gzip": ".gz", "lzma": ".xz"}
+
+_SEGMENT_NUMBER = re.compile(r"^(?P<base>.*?)(?:\.(?P<number>\d+))?$")
+
+
+def _compress(data: bytes, compression: str) -> bytes:
+    if compression == "lzma":
+        return lzma.compress(data)
+    return gzip.compress(data)
+
+
+def _decompress(data: bytes, compression: str) -> bytes:
+    if compression == "lzma":
+        return lzma.decompress(data)
+    return gzip.decompress(data)
+
+
+def _line_time(line: bytes) -> Optional[str]:
+    """timestamp at the start of a log line, None for headers and the continuation lines of multi-line statuses"""
+    head = line[:19].decode("ascii", errors="replace")
+    try:
+        datetime.strptime(head, TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+    return head
+
+
+def compress_segment(path: str, compression: str = "gzip", block_bytes: int = BLOCK_BYTES) -> str:
+    """compresses a closed log segment into independently compressed blocks and writes a sidecar index mapping each
+    block's time range to its byte range, then removes the plain segment.
+
+    Concatenated gzip members (and xz streams) are still a valid .gz (.xz) file, so the result opens with any
+    ordinary tool, while the index lets a search decompress only the blocks it needs.
+
+    :param path: plain text segment to compress
+    :type path: str
+    :param compression: "gzip" or "lzma", defaults to "gzip"
+    :type compression: str, optional
+    :return: path of the compressed segment
+    :rtype: str
+    """
+    target = path + COMPRESSIONS[compression]
+    blocks = []
+    with open(path, "rb") as source, open(target + ".tmp", "wb") as output:
+        raw_offset = 0
+        last_time = None
+        while True:
+            lines = source.readlines(block_bytes)
+            if not lines:
+                break
+            first_time = None
+            for line in lines:
+                line_time = _line_time(line)
+                if line_time is not None:
+                    first_time = first_time or line_time
+                    last_time = line_time
+            raw = b"".join(lines)
+            compressed = _compress(raw, compression)
+            blocks.append({
+                # continuation lines at the top of a block belong to the entry before it
+                "first": first_time or last_time,
+                "last": last_time,
+                "offset": output.tell(),
+                "length": len(compressed),
+                "raw_offset": raw_offset,
+                "raw_length": len(raw),
+            })
+            output.write(compressed)
+            raw_offset += len(raw)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(target + ".tmp", target)
+
+    times = [block["first"] for block in blocks if block["first"]] + [block["last"] for block in blocks if block["last"]]
+    index = {
+        "segment": os.path.basename(path),
+        "compression": compression,
+        "first": min(times) if times else None,
+        "last": max(times) if times else None,
+        "blocks": blocks,
+    }
+    with open(target + INDEX_SUFFIX, "w") as file:
+        json.dump(index, file, indent=1)
+    os.remove(path)
+    return target
+
+
+class RotatingLog:
+    """append-only text log that starts a new file every day and whenever the day's file passes max_bytes.
+
+    Closed segments are compressed on a background thread so writing a log line never waits for compression.
+    The first segment of a day keeps the old name (gcs_control_panel_log_2025_04_09.txt), further segments of the
+    same day get a number (gcs_control_panel_log_2025_04_09.1.txt).
+    """
+
+    def __init__(self, pattern: str = LOG_FILE_PATTERN, max_bytes: int = MAX_SEGMENT_BYTES,
+                 compression: Optional[str] = "gzip", header: Optional[Callable[[], str]] = None) -> None:
+        """
+        :param pattern: strftime pattern of the day's file name, defaults to LOG_FILE_PATTERN
+        :type pattern: str, optional
+        :param max_bytes: size at which a new segment is started, defaults to MAX_SEGMENT_BYTES
+        :type max_bytes: int, optional
+        :param compression: "gzip", "lzma" or None to leave closed segments uncompressed, defaults to "gzip"
+        :type compression: str, optional
+        :param header: returns the text written at the top of every new segment, defaults to None
+        :type header: Callable[[], str], optional
+        """
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression {compression!r}, expected one of {sorted(COMPRESSIONS)}")
+        self.pattern = pattern
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.header = header
+        self.path = None
+        self._file = None
+        self._day = None
+        self._queue = queue.Queue()
+        self._compressor = threading.Thread(target=self._compress_loop, name="log-compressor", daemon=True)
+        self._compressor.start()
+        self._queue_leftover_segments()
+
+    def _segment_path(self, day: str, number: int) -> str:
+        dated = datetime.strptime(day, "%Y-%m-%d").strftime(self.pattern)
+        if not number:
+            return dated
+        base, extension = os.path.splitext(dated)
+        return f"{base}.{number}{extension}"
+
+    def _segment_glob(self) -> str:
+        base, extension = os.path.splitext(re.sub(r"%[a-zA-Z]", "*", self.pattern))
+        return f"{base}*{extension}"
+
+    def _segment_day(self, path: str) -> Optional[str]:
+        """the day a segment file belongs to, None if the file does not follow the pattern"""
+        base, extension = os.path.splitext(path)
+        match = _SEGMENT_NUMBER.match(base)
+        pattern_base, _ = os.path.splitext(self.pattern)
+        try:
+            return datetime.strptime(match.group("base"), pattern_base).strftime("%Y-%m-%d")
+        except ValueError:
+            return None
+
+    def _segment_number(self, path: str) -> int:
+        number = _SEGMENT_NUMBER.match(os.path.splitext(path)[0]).group("number")
+        return int(number) if number else 0
+
+    def plain_segments(self) -> List[str]:
+        """uncompressed segment files, oldest first"""
+        segments = [path for path in glob.glob(self._segment_glob()) if self._segment_day(path) is not None]
+        return sorted(segments, key=lambda path: (self._segment_day(path), self._segment_number(path)))
+
+    def compressed_segments(self) -> List[str]:
+        segments = []
+        for extension in COMPRESSIONS.values():
+            for path in glob.glob(self._segment_glob() + extension):
+                if os.path.exists(path + INDEX_SUFFIX):
+                    segments.append(path)
+        return sorted(segments, key=lambda path: self._index(path).get("first") or "")
+
+    def _queue_leftover_segments(self) -> None:
+        """closed segments left uncompressed by an earlier run (or an older version) are compressed in the
+        background, today's newest segment stays open for appending"""
+        if self.compression is None:
+            return
+        today = datetime.now().strftime("%Y-%m-%d")
+        segments = self.plain_segments()
+        current = [path for path in segments if self._segment_day(path) == today][-1:]
+        for path in segments:
+            if path not in current:
+                self._queue.put(path)
+
+    def _closed(self, path: str) -> bool:
+        """whether a segment must not be appended to because it was already compressed or is full"""
+        if self.compression is not None and os.path.exists(path + COMPRESSIONS[self.compression]):
+            return True
+        return os.path.exists(path) and os.path.getsize(path) >= self.max_bytes
+
+    def _open(self, day: str) -> None:
+        numbers = [self._segment_number(path) for path in self.plain_segments() if self._segment_day(path) == day]
+        number = max(numbers) if numbers else 0
+        while self._closed(self._segment_path(day, number)):
+            number += 1
+        self.path = self._segment_path(day, number)
+        self._day = day
+        self._file = open(self.path, "a", encoding="utf-8")
+        if self._file.tell() == 0 and self.header is not None:
+            self._file.write(self.header())
+            self._file.flush()
+
+    def _close(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if self.compression is not None:
+            self._queue.put(self.path)
+
+    def write(self, text: str, when: Optional[datetime] = None) -> None:
+        """appends text to the segment for the given time, rotating first if the day changed or the segment is full
+
+        :param text: text to append, including its trailing newline
+        :type text: str
+        :param when: time of the entry, defaults to now
+        :type when: datetime, optional
+        """
+        day = (when or datetime.now()).strftime("%Y-%m-%d")
+        if self._file is not None and (day != self._day or self._file.tell() >= self.max_bytes):
+            self._close()
+        if self._file is None:
+            self._open(day)
+        self._file.write(text)
+        self._file.flush()
+
+    def close(self) -> None:
+        """closes the open segment, it is compressed by the next run once its day is over"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._queue.put(None)
+
+    def _compress_loop(self) -> None:
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+            try:
+                compress_segment(path, self.compression)
+            except OSError as e:
+                print(f"could not compress log segment {path}: {e}")
+
+    def wait_for_compression(self, timeout: Optional[float] = None) -> None:
+        """blocks until every queued segment has been compressed, used at shutdown and by tools"""
+        self.close()
+        self._compressor.join(timeout)
+
+    def _index(self, path: str) -> dict:
+        with open(path + INDEX_SUFFIX) as file:
+            return json.load(file)
+
+    def search(self, start: datetime, end: datetime, contains: Optional[str] = None) -> Iterator[str]:
+        """yields log entries between start and end from every segment, compressed or not.
+
+        Compressed segments are skipped entirely when their time range is outside the window and only the blocks
+        overlapping it are read and decompressed.
+
+        :param start: earliest entry time
+        :type start: datetime
+        :param end: latest entry time
+        :type end: datetime
+        :param contains: only yield entries containing this text, defaults to None
+        :type contains: str, optional
+        """
+        low = start.strftime(TIMESTAMP_FORMAT)
+        high = end.strftime(TIMESTAMP_FORMAT)
+        for path in self.compressed_segments():
+            index = self._index(path)
+            if index["first"] is None or index["last"] < low or index["first"] > high:
+                continue
+            with open(path, "rb") as file:
+                for block in index["blocks"]:
+                    if block["first"] is None or block["last"] < low or block["first"] > high:
+                        continue
+                    file.seek(block["offset"])
+                    raw = _decompress(file.read(block["length"]), index["compression"])
+                    yield from self._entries(raw.splitlines(keepends=True), low, high, contains)
+        for path in self.plain_segments():
+            day = self._segment_day(path)
+            if day < low[:10] or day > high[:10]:
+                continue
+            with open(path, "rb") as file:
+                yield from self._entries(file, low, high, contains)
+
+    def _entries(self, lines, low: str, high: str, contains: Optional[str]) -> Iterator[str]:
+        """groups lines into entries (a timestamped line plus its continuation lines) and filters them"""
+        entry = None
+        for line in lines:
+            line_time = _line_time(line)
+            if line_time is not None:
+                if entry is not None:
+                    yield from self._keep(entry, low, high, contains)
+                entry = [line_time, line.decode("utf-8", errors="replace")]
+            elif entry is not None and not line.startswith((b"Timestamp", b"---")):
+                entry[1] += line.decode("utf-8", errors="replace")
+        if entry is not None:
+            yield from self._keep(entry, low, high, contains)
+
+    def _keep(self, entry, low: str, high: str, contains: Optional[str]) -> Iterator[str]:
+        line_time, text = entry
+        if low <= line_time <= high and (contains is None or contains in text):
+            yield text
+
+
+def main(argv=None) -> None:
+    import argparse
+    parser = argparse.ArgumentParser(description="Search the GCS control panel logs, compressed or not.")
+    parser.add_argument("start", help='earliest time, "YYYY-MM-DD HH:MM:SS" or "YYYY-MM-DD"')
+    parser.add_argument("end", help='latest time, "YYYY-MM-DD HH:MM:SS" or "YYYY-MM-DD"')
+    parser.add_argument("--contains", help="only show entries containing this text")
+    parser.add_argument("--pattern", default=LOG_FILE_PATTERN, help="log file name pattern (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    def parse(value: str, end_of_day: bool) -> datetime:
+        if len(value) == 10:
+            value += " 23:59:59" if end_of_day else " 00:00:00"
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+    log = RotatingLog(pattern=args.pattern, compression=None)
+    for entry in log.search(parse(args.start, False), parse(args.end, True), args.contains):
+        print(entry, end="")
+
+
+if __name__ == "__main__":
+    main()
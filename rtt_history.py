@@ -0,0 +1,59 @@
+import math
+from array import array
+from typing import Iterator, Optional, Tuple
+
+HISTORY_SAMPLES = 128  # samples kept per server, a probe every 5 s fills this in about 10 minutes
+
+
+class RttHistory:
+    """ring buffer of a server's most recent probes, round trip time in seconds or NaN for a lost probe.
+
+    Kept in two flat arrays (about 1.5 KB per server) and only created on a server's first probe. ``version`` goes up
+    with every sample so readers can tell whether anything they derived from the history is out of date.
+    """
+
+    __slots__ = ("times", "rtts", "start", "count", "version")
+
+    def __init__(self, capacity: int = HISTORY_SAMPLES) -> None:
+        self.times = array("d", bytes(8 * capacity))
+        self.rtts = array("f", bytes(4 * capacity))
+        self.start = 0  # index of the oldest sample
+        self.count = 0
+        self.version = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, when: float, rtt: Optional[float]) -> None:
+        """records a probe, rtt None for a probe that got no answer"""
+        capacity = len(self.times)
+        index = (self.start + self.count) % capacity
+        if self.count == capacity:
+            self.start = (self.start + 1) % capacity
+        else:
+            self.count += 1
+        self.times[index] = when
+        self.rtts[index] = math.nan if rtt is None else rtt
+        self.version += 1
+
+    @property
+    def latest(self) -> Optional[float]:
+        if not self.count:
+            return None
+        return self.times[(self.start + self.count - 1) % len(self.times)]
+
+    def samples(self, since: float = 0.0) -> Iterator[Tuple[float, float]]:
+        """(time, rtt) pairs from oldest to newest, NaN rtts are lost probes"""
+        capacity = len(self.times)
+        for offset in range(self.count):
+            index = (self.start + offset) % capacity
+            if self.times[index] >= since:
+                yield self.times[index], self.rtts[index]
+
+    def loss(self, since: float = 0.0) -> Optional[float]:
+        """share of probes since the given time that got no answer, None without probes"""
+        total = lost = 0
+        for _, rtt in self.samples(since):
+            total += 1
+            lost += math.isnan(rtt)
+        return lost / total if total else None
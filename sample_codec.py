@@ -0,0 +1,545 @@
+"""compression of sealed sample store segments, in the spirit of Gorilla (Facebook's time series codec).
+
+A segment is cut into blocks of BLOCK_RECORDS records that can each be decoded on their own, with an index of their
+time ranges at the end of the file. Inside a block the records are grouped by server and stored as columns:
+
+- timestamps as delta-of-delta in TIME_RESOLUTION units, nearly always a few bits at a steady probe cadence
+- round trip times as float32 XORed with the server's previous one, rounded to RTT_MANTISSA_BITS of mantissa first
+- which probes were lost and the flags as run lengths
+
+Gorilla writes a control code in front of every value, which can only be decoded one value at a time. Here every
+column is bit packed in chunks of CHUNK_VALUES at one width (and shift) per chunk instead, so with numpy a whole
+block decodes with a few array operations: unpacking bits, cumulative sums for the timestamps and a cumulative XOR
+for the round trip times. Without numpy the same format is read and written in pure python, more slowly.
+
+Timestamps come back rounded to TIME_RESOLUTION and round trip times to RTT_MANTISSA_BITS, both far below what a
+probe can measure.
+"""
+import argparse
+import json
+import math
+import os
+import struct
+import time
+from bisect import bisect_left, bisect_right
+from typing import List, Sequence, Tuple
+
+from sample_store import HEADER as SEGMENT_HEADER
+from sample_store import NUMPY_DTYPE, RECORD, _numpy
+
+COMPRESSED_SUFFIX = ".gcz"
+MAGIC = b"GCSZ"
+VERSION = 1
+BLOCK_RECORDS = 1 << 19  # about 10 MB of raw records, two blocks per sealed segment
+CHUNK_VALUES = 128  # values packed at one bit width
+TIME_RESOLUTION = 0.001  # seconds, timestamps are stored as whole multiples of this
+RTT_MANTISSA_BITS = 8  # of float32's 23, a relative error below 0.2% (0.04 ms at 20 ms)
+
+# magic, version, block count
+FILE_HEADER = struct.Struct("<4sHI")
+# offset, length, records, first and last time of a block, the index sits at the end of the file
+BLOCK_INDEX = struct.Struct("<QIIdd")
+FOOTER = struct.Struct("<Q")  # offset of the block index
+# records, series, base time in TIME_RESOLUTION units, lost runs, flag runs
+BLOCK_HEADER = struct.Struct("<IIqII")
+CHUNK_HEADER = struct.Struct("<BB")  # bit width, shift
+
+_RTT_DROP_BITS = 23 - RTT_MANTISSA_BITS
+_RTT_MASK = (0xFFFFFFFF >> _RTT_DROP_BITS) << _RTT_DROP_BITS
+_RTT_ROUND = 1 << (_RTT_DROP_BITS - 1) if _RTT_DROP_BITS else 0
+_FLOAT = struct.Struct("<f")
+_UINT = struct.Struct("<I")
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+def _trailing_zeros(value: int) -> int:
+    return (value & -value).bit_length() - 1 if value else 0
+
+
+# pure python packing, the reference for the format
+
+
+def pack_values(values: Sequence[int]) -> bytes:
+    """bit packs non-negative integers below 2**64, CHUNK_VALUES at a time at the smallest width (after shifting out
+    the trailing zero bits they all share) that holds them"""
+    output = bytearray()
+    for begin in range(0, len(values), CHUNK_VALUES):
+        chunk = values[begin:begin + CHUNK_VALUES]
+        combined = 0
+        for value in chunk:
+            combined |= value
+        shift = _trailing_zeros(combined)
+        width = (combined >> shift).bit_length()
+        packed = 0
+        for position, value in enumerate(chunk):
+            packed |= (value >> shift) << (position * width)
+        output += CHUNK_HEADER.pack(width, shift)
+        output += packed.to_bytes((len(chunk) * width + 7) // 8, "little")
+    return bytes(output)
+
+
+def unpack_values(data, offset: int, count: int) -> Tuple[List[int], int]:
+    """reads count values written by pack_values, returns them and the offset after them"""
+    values = []
+    for begin in range(0, count, CHUNK_VALUES):
+        size = min(CHUNK_VALUES, count - begin)
+        width, shift = CHUNK_HEADER.unpack_from(data, offset)
+        offset += CHUNK_HEADER.size
+        length = (size * width + 7) // 8
+        packed = int.from_bytes(data[offset:offset + length], "little")
+        offset += length
+        mask = (1 << width) - 1
+        values.extend(((packed >> (position * width)) & mask) << shift for position in range(size))
+    return values, offset
+
+
+# numpy packing, byte for byte the same format
+
+
+def pack_array(values) -> bytes:
+    numpy = _numpy()
+    values = numpy.ascontiguousarray(values, dtype=numpy.uint64)
+    output = bytearray()
+    for begin in range(0, len(values), CHUNK_VALUES):
+        chunk = values[begin:begin + CHUNK_VALUES]
+        combined = int(numpy.bitwise_or.reduce(chunk)) if len(chunk) else 0
+        shift = _trailing_zeros(combined)
+        width = (combined >> shift).bit_length()
+        output += CHUNK_HEADER.pack(width, shift)
+        if width:
+            bits = (chunk[:, None] >> numpy.arange(shift, shift + width, dtype=numpy.uint64)) & numpy.uint64(1)
+            output += numpy.packbits(bits.astype(numpy.uint8).ravel(), bitorder="little").tobytes()
+    return bytes(output)
+
+
+def unpack_array(data, offset: int, count: int):
+    """reads count values written by pack_values into a uint64 array, returns it and the offset after it.
+
+    Only the chunk headers are walked one by one. Every value is then read at once, as the 8 bytes starting at the
+    byte its bits start in, shifted and masked."""
+    numpy = _numpy()
+    chunks = (count + CHUNK_VALUES - 1) // CHUNK_VALUES
+    widths = [0] * chunks
+    shifts = [0] * chunks
+    bit_offsets = [0] * chunks
+    start = offset
+    for chunk in range(chunks):
+        size = min(CHUNK_VALUES, count - chunk * CHUNK_VALUES)
+        widths[chunk], shifts[chunk] = CHUNK_HEADER.unpack_from(data, offset)
+        offset += CHUNK_HEADER.size
+        bit_offsets[chunk] = (offset - start) * 8
+        offset += (size * widths[chunk] + 7) // 8
+    if not count or not any(widths):
+        return numpy.zeros(count, dtype=numpy.uint64), offset
+    if max(widths) > 57:
+        # a value starting late in a byte would not fit in the 8 bytes read for it, only huge time jumps get here
+        values = [value for value in unpack_values(data, start, count)[0]]
+        return numpy.array(values, dtype=numpy.uint64), offset
+    padded = numpy.zeros(offset - start + 8, dtype=numpy.uint8)
+    padded[:offset - start] = numpy.frombuffer(data, numpy.uint8, offset - start, start)
+    # every byte offset as the start of a little endian 64 bit word, an overlapping view without copying
+    words = numpy.ndarray(shape=(offset - start + 1,), dtype="<u8", buffer=padded, strides=(1,))
+    widths = numpy.repeat(numpy.array(widths, dtype=numpy.uint64), CHUNK_VALUES)[:count]
+    positions = (numpy.repeat(numpy.array(bit_offsets, dtype=numpy.uint64), CHUNK_VALUES)[:count]
+                 + numpy.tile(numpy.arange(CHUNK_VALUES, dtype=numpy.uint64), chunks)[:count] * widths)
+    values = words[positions >> numpy.uint64(3)] >> (positions & numpy.uint64(7))
+    values &= (numpy.uint64(1) << widths) - numpy.uint64(1)
+    values <<= numpy.repeat(numpy.array(shifts, dtype=numpy.uint64), CHUNK_VALUES)[:count]
+    return values, offset
+
+
+def _runs(values: Sequence[int]) -> Tuple[List[int], List[int]]:
+    """run length encoding, (run values, run lengths)"""
+    run_values = []
+    run_lengths = []
+    for value in values:
+        if run_values and run_values[-1] == value:
+            run_lengths[-1] += 1
+        else:
+            run_values.append(value)
+            run_lengths.append(1)
+    return run_values, run_lengths
+
+
+def _rtt_bits(rtt: float) -> int:
+    bits = _UINT.unpack(_FLOAT.pack(rtt))[0]
+    return ((bits + _RTT_ROUND) & _RTT_MASK) if bits & 0x7F800000 != 0x7F800000 else bits
+
+
+def encode_block(records: Sequence[Tuple]) -> bytes:
+    """compresses records (time, server id, rtt, flags, reserved) in pure python, the reserved field is dropped
+
+    :param records: tuples as RECORD unpacks them, in time order
+    :type records: Sequence[Tuple]
+    :rtype: bytes
+    """
+    numpy = _numpy()
+    if numpy is not None:
+        array = numpy.array([tuple(record) for record in records], dtype=numpy.dtype(NUMPY_DTYPE))
+        return encode_array(array)
+    by_server = {}
+    for record in records:
+        by_server.setdefault(record[1], []).append(record)
+    base = min((round(record[0] / TIME_RESOLUTION) for record in records), default=0)
+    ids, counts, starts, first_deltas, first_rtts = [], [], [], [], []
+    deltas, lost, rtts, flags = [], [], [], []
+    previous_id = 0
+    for server_id in sorted(by_server):
+        series = by_server[server_id]
+        times = [round(record[0] / TIME_RESOLUTION) for record in series]
+        ids.append(server_id - previous_id)
+        previous_id = server_id
+        counts.append(len(series))
+        starts.append(times[0] - base)
+        first_deltas.append(_zigzag(times[1] - times[0]) if len(times) > 1 else 0)
+        deltas.extend([0, 0][:len(times)])
+        deltas.extend(_zigzag((times[i] - times[i - 1]) - (times[i - 1] - times[i - 2])) for i in range(2, len(times)))
+        present = [_rtt_bits(record[2]) for record in series if not math.isnan(record[2])]
+        first_rtts.append(present[0] if present else 0)
+        if present:
+            rtts.append(0)
+            rtts.extend(present[i] ^ present[i - 1] for i in range(1, len(present)))
+        lost.extend(math.isnan(record[2]) for record in series)
+        flags.extend(record[3] for record in series)
+    lost_values, lost_lengths = _runs(lost)
+    if lost_values and lost_values[0]:
+        lost_lengths.insert(0, 0)  # runs alternate starting with answered probes
+    flag_values, flag_lengths = _runs(flags)
+    return b"".join([
+        BLOCK_HEADER.pack(len(records), len(ids), base, len(lost_lengths), len(flag_values)),
+        pack_values(ids), pack_values(counts), pack_values(starts), pack_values(first_deltas),
+        pack_values(first_rtts), pack_values(deltas), pack_values(lost_lengths), pack_values(rtts),
+        pack_values(flag_values), pack_values(flag_lengths),
+    ])
+
+
+def encode_array(records) -> bytes:
+    """compresses a structured array of NUMPY_DTYPE, the numpy version of encode_block"""
+    numpy = _numpy()
+    order = numpy.argsort(records["server"], kind="stable")
+    records = records[order]
+    count = len(records)
+    times = numpy.rint(records["time"] / TIME_RESOLUTION).astype(numpy.int64)
+    base = int(times.min()) if count else 0
+    server = records["server"].astype(numpy.int64)
+    starts = numpy.flatnonzero(numpy.diff(server, prepend=-1)) if count else numpy.zeros(0, numpy.int64)
+    counts = numpy.diff(numpy.append(starts, count))
+    ids = numpy.diff(server[starts], prepend=0)
+
+    def zigzag(values):
+        return ((values << 1) ^ (values >> 63)).astype(numpy.uint64)
+
+    # delta of delta within each server, the first two positions of a series are kept in the series columns
+    deltas = numpy.diff(times, prepend=0)
+    position = numpy.arange(count) - numpy.repeat(starts, counts)
+    first_deltas = numpy.where(counts > 1, deltas[numpy.minimum(starts + 1, max(count - 1, 0))], 0)
+    dods = numpy.diff(deltas, prepend=0)
+    dods[position < 2] = 0
+
+    rtt = records["rtt"]
+    lost = numpy.isnan(rtt)
+    bits = rtt.view(numpy.uint32).astype(numpy.uint64)
+    finite = (bits & 0x7F800000) != 0x7F800000
+    bits = numpy.where(finite, (bits + _RTT_ROUND) & _RTT_MASK, bits)
+    present = ~lost
+    present_bits = bits[present]
+    present_server = server[present]
+    present_starts = numpy.flatnonzero(numpy.diff(present_server, prepend=-1))
+    xors = present_bits ^ numpy.concatenate([[0], present_bits[:-1]]).astype(numpy.uint64)
+    xors[present_starts] = 0
+    # the first answered rtt of each series, 0 for a series without any
+    first_rtts = numpy.zeros(len(starts), numpy.uint64)
+    if len(present_starts):
+        series_of_present = numpy.searchsorted(starts, numpy.flatnonzero(present)[present_starts], side="right") - 1
+        first_rtts[series_of_present] = present_bits[present_starts]
+
+    lost_changes = numpy.flatnonzero(numpy.diff(lost.astype(numpy.int8), prepend=0))
+    lost_lengths = numpy.diff(numpy.concatenate([[0], lost_changes, [count]]))
+    if len(lost_lengths) and lost_lengths[-1] == 0:
+        lost_lengths = lost_lengths[:-1]
+    flags = records["flags"].astype(numpy.int64)
+    flag_starts = numpy.flatnonzero(numpy.diff(flags, prepend=-1)) if count else numpy.zeros(0, numpy.int64)
+    flag_lengths = numpy.diff(numpy.append(flag_starts, count))
+    return b"".join([
+        BLOCK_HEADER.pack(count, len(starts), base, len(lost_lengths), len(flag_starts)),
+        pack_array(ids), pack_array(counts), pack_array(times[starts] - base), pack_array(zigzag(first_deltas)),
+        pack_array(first_rtts), pack_array(zigzag(dods)), pack_array(lost_lengths), pack_array(xors),
+        pack_array(flags[flag_starts]), pack_array(flag_lengths),
+    ])
+
+
+def decode_block(data, offset: int = 0):
+    """decodes a block back into records in time order, a structured array of NUMPY_DTYPE with numpy or a list of
+    RECORD tuples without"""
+    numpy = _numpy()
+    if numpy is not None:
+        return decode_array(data, offset)
+    count, series, base, lost_runs, flag_runs = BLOCK_HEADER.unpack_from(data, offset)
+    offset += BLOCK_HEADER.size
+    ids, offset = unpack_values(data, offset, series)
+    counts, offset = unpack_values(data, offset, series)
+    starts, offset = unpack_values(data, offset, series)
+    first_deltas, offset = unpack_values(data, offset, series)
+    first_rtts, offset = unpack_values(data, offset, series)
+    dods, offset = unpack_values(data, offset, count)
+    lost_lengths, offset = unpack_values(data, offset, lost_runs)
+    lost = []
+    for run, length in enumerate(lost_lengths):
+        lost.extend([run % 2 == 1] * length)
+    xors, offset = unpack_values(data, offset, count - sum(lost))
+    flag_values, offset = unpack_values(data, offset, flag_runs)
+    flag_lengths, offset = unpack_values(data, offset, flag_runs)
+    flags = [value for value, length in zip(flag_values, flag_lengths) for _ in range(length)]
+
+    records = []
+    position = present = 0
+    server_id = 0
+    for index in range(series):
+        server_id += ids[index]
+        moment = base + starts[index]
+        delta = _unzigzag(first_deltas[index])
+        rtt_bits = first_rtts[index]
+        first_present = True
+        for offset_in_series in range(counts[index]):
+            if offset_in_series == 1:
+                moment += delta
+            elif offset_in_series > 1:
+                delta += _unzigzag(dods[position])
+                moment += delta
+            if lost[position]:
+                rtt = math.nan
+            else:
+                if not first_present:
+                    rtt_bits ^= xors[present]
+                first_present = False
+                present += 1
+                rtt = _FLOAT.unpack(_UINT.pack(rtt_bits))[0]
+            records.append((moment * TIME_RESOLUTION, server_id, rtt, flags[position], 0))
+            position += 1
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def decode_array(data, offset: int = 0):
+    """the vectorized version of decode_block"""
+    numpy = _numpy()
+    count, series, base, lost_runs, flag_runs = BLOCK_HEADER.unpack_from(data, offset)
+    offset += BLOCK_HEADER.size
+    ids, offset = unpack_array(data, offset, series)
+    counts, offset = unpack_array(data, offset, series)
+    starts, offset = unpack_array(data, offset, series)
+    first_deltas, offset = unpack_array(data, offset, series)
+    first_rtts, offset = unpack_array(data, offset, series)
+    dods, offset = unpack_array(data, offset, count)
+    lost_lengths, offset = unpack_array(data, offset, lost_runs)
+    lost = numpy.repeat(numpy.arange(lost_runs) % 2 == 1, lost_lengths.astype(numpy.int64))
+    xors, offset = unpack_array(data, offset, count - int(lost.sum()))
+    flag_values, offset = unpack_array(data, offset, flag_runs)
+    flag_lengths, offset = unpack_array(data, offset, flag_runs)
+
+    def unzigzag(values):
+        values = values.astype(numpy.int64)
+        return (values >> 1) ^ -(values & 1)
+
+    counts = counts.astype(numpy.int64)
+    series_starts = numpy.cumsum(counts) - counts
+    # segmented prefix sums: a global cumulative sum minus its value where each series starts
+    deltas = unzigzag(dods)
+    deltas[series_starts[counts > 1] + 1] = unzigzag(first_deltas)[counts > 1]
+    summed = numpy.cumsum(deltas)
+    deltas = summed - numpy.repeat(summed[series_starts] - deltas[series_starts], counts)
+    deltas[series_starts] = 0
+    summed = numpy.cumsum(deltas)
+    moments = numpy.repeat(base + starts.astype(numpy.int64), counts) + summed - numpy.repeat(summed[series_starts],
+                                                                                              counts)
+
+    rtt_bits = numpy.full(count, 0x7FC00000, dtype=numpy.uint32)
+    present = ~lost
+    if len(xors):
+        present_series = numpy.repeat(numpy.arange(series), counts)[present]
+        present_starts = numpy.flatnonzero(numpy.diff(present_series, prepend=-1))
+        scanned = numpy.bitwise_xor.accumulate(xors)
+        present_counts = numpy.diff(numpy.append(present_starts, len(xors)))
+        scanned ^= numpy.repeat(scanned[present_starts], present_counts)
+        scanned ^= numpy.repeat(first_rtts[present_series[present_starts]], present_counts)
+        rtt_bits[present] = scanned.astype(numpy.uint32)
+
+    records = numpy.zeros(count, dtype=numpy.dtype(NUMPY_DTYPE))
+    records["time"] = moments * TIME_RESOLUTION
+    records["server"] = numpy.repeat(numpy.cumsum(ids), counts)
+    records["rtt"] = rtt_bits.view(numpy.float32)
+    records["flags"] = numpy.repeat(flag_values, flag_lengths.astype(numpy.int64))
+    return records[numpy.argsort(records["time"], kind="stable")]
+
+
+class CompressedSegment:
+    """a compressed segment, read a block at a time. Has the same fields as sample_store.Segment"""
+
+    def __init__(self, path: str, number: int) -> None:
+        self.path = path
+        self.number = number
+        with open(path, "rb") as file:
+            magic, version, blocks = FILE_HEADER.unpack(file.read(FILE_HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a compressed sample segment")
+            file.seek(-FOOTER.size, os.SEEK_END)
+            index_offset = FOOTER.unpack(file.read(FOOTER.size))[0]
+            file.seek(index_offset)
+            index = file.read(blocks * BLOCK_INDEX.size)
+        self.blocks = [BLOCK_INDEX.unpack_from(index, position * BLOCK_INDEX.size) for position in range(blocks)]
+        self.block_firsts = [block[3] for block in self.blocks]
+        self.block_lasts = [block[4] for block in self.blocks]
+        self.count = sum(block[2] for block in self.blocks)
+        self.first = self.block_firsts[0] if self.blocks else None
+        self.last = max(self.block_lasts) if self.blocks else None
+        self._cached = None  # (block number, records) of the last decoded block
+
+    def close(self) -> None:
+        self._cached = None
+
+    def block(self, number: int):
+        if self._cached is None or self._cached[0] != number:
+            offset, length = self.blocks[number][:2]
+            with open(self.path, "rb") as file:
+                file.seek(offset)
+                self._cached = (number, decode_block(file.read(length)))
+        return self._cached[1]
+
+    def scan(self, start: float, end: float):
+        """records with start <= time < end, None if there are none"""
+        numpy = _numpy()
+        first = max(0, bisect_right(self.block_firsts, start) - 1)
+        last = bisect_left(self.block_firsts, end)
+        parts = []
+        for number in range(first, last):
+            if self.block_lasts[number] < start:
+                continue
+            records = self.block(number)
+            if numpy is not None:
+                times = records["time"]
+                part = records[numpy.searchsorted(times, start):numpy.searchsorted(times, end)]
+            else:
+                times = [record[0] for record in records]
+                part = records[bisect_left(times, start):bisect_left(times, end)]
+            if len(part):
+                parts.append(part)
+        if not parts:
+            return None
+        if numpy is not None:
+            return parts[0] if len(parts) == 1 else numpy.concatenate(parts)
+        return [record for part in parts for record in part]
+
+
+def compress_segment(path: str, block_records: int = BLOCK_RECORDS, remove: bool = True) -> str:
+    """compresses a sealed sample segment next to it
+
+    :param path: segment file written by SampleStore
+    :type path: str
+    :param remove: remove the segment afterwards, defaults to True
+    :type remove: bool, optional
+    :return: path of the compressed segment
+    :rtype: str
+    """
+    numpy = _numpy()
+    target = os.path.splitext(path)[0] + COMPRESSED_SUFFIX
+    with open(path, "rb") as source:
+        data = source.read()
+    count = (len(data) - SEGMENT_HEADER.size) // RECORD.size
+    index = []
+    with open(target + ".tmp", "wb") as output:
+        output.write(FILE_HEADER.pack(MAGIC, VERSION, (count + block_records - 1) // block_records))
+        for begin in range(0, count, block_records):
+            size = min(block_records, count - begin)
+            offset = SEGMENT_HEADER.size + begin * RECORD.size
+            if numpy is not None:
+                records = numpy.frombuffer(data, numpy.dtype(NUMPY_DTYPE), size, offset)
+                encoded = encode_array(records)
+                first, last = float(records["time"].min()), float(records["time"].max())
+            else:
+                records = list(RECORD.iter_unpack(data[offset:offset + size * RECORD.size]))
+                encoded = encode_block(records)
+                first, last = min(record[0] for record in records), max(record[0] for record in records)
+            index.append(BLOCK_INDEX.pack(output.tell(), len(encoded), size, first, last))
+            output.write(encoded)
+        index_offset = output.tell()
+        output.write(b"".join(index))
+        output.write(FOOTER.pack(index_offset))
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(target + ".tmp", target)
+    if remove:
+        os.remove(path)
+    return target
+
+
+def synthetic_records(servers: int = 1000, seconds: float = 3600, interval: float = 5.0, loss: float = 0.01,
+                      seed: int = 1):
+    """probe results shaped like the panel's: a steady cadence with scheduling jitter, a per server base rtt with
+    small jitter, occasional loss and flags following reachability. A structured array in time order"""
+    numpy = _numpy()
+    generator = numpy.random.default_rng(seed)
+    rounds = int(seconds / interval)
+    offsets = generator.uniform(0, interval, servers)
+    times = (numpy.arange(rounds)[:, None] * interval + offsets[None, :]
+             + numpy.abs(generator.normal(0, 0.002, (rounds, servers))))
+    base_rtt = generator.lognormal(numpy.log(0.02), 0.8, servers)
+    rtts = (base_rtt[None, :] * (1 + numpy.abs(generator.normal(0, 0.05, (rounds, servers))))).astype(numpy.float32)
+    lost = generator.random((rounds, servers)) < loss
+    rtts[lost] = numpy.nan
+    records = numpy.zeros(rounds * servers, dtype=numpy.dtype(NUMPY_DTYPE))
+    records["time"] = (1.7e9 + times).ravel()
+    records["server"] = numpy.tile(numpy.arange(servers), rounds)
+    records["rtt"] = rtts.ravel()
+    records["flags"] = (~lost).astype(numpy.uint16).ravel()
+    return records[numpy.argsort(records["time"], kind="stable")]
+
+
+def benchmark(servers: int = 1000, seconds: float = 3600) -> dict:
+    """compression ratio and throughput on synthetic_records, needs numpy"""
+    numpy = _numpy()
+    records = synthetic_records(servers, seconds)
+    began = time.perf_counter()
+    blocks = [encode_array(records[begin:begin + BLOCK_RECORDS])
+              for begin in range(0, len(records), BLOCK_RECORDS)]
+    encode = time.perf_counter() - began
+    began = time.perf_counter()
+    decoded = [decode_array(block) for block in blocks]
+    decode = time.perf_counter() - began
+    decoded = numpy.concatenate(decoded)
+    raw = len(records) * RECORD.size
+    compressed = sum(len(block) for block in blocks)
+    return {
+        "records": len(records),
+        "servers": servers,
+        "ratio": round(raw / compressed, 2),
+        "bits_per_record": round(compressed * 8 / len(records), 2),
+        "encode_records_per_second": round(len(records) / encode),
+        "decode_records_per_second": round(len(records) / decode),
+        "decode_mb_per_second": round(raw / decode / 1e6, 1),
+        "max_time_error": float(numpy.abs(numpy.sort(decoded["time"]) - numpy.sort(records["time"])).max()),
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Compress sample store segments or benchmark the codec.")
+    parser.add_argument("segments", nargs="*", help="sealed segment files to compress")
+    parser.add_argument("--benchmark", action="store_true", help="measure ratio and speed on synthetic data")
+    parser.add_argument("--servers", type=int, default=1000, help="servers in the synthetic data")
+    args = parser.parse_args(argv)
+    if args.benchmark:
+        print(json.dumps(benchmark(args.servers), indent=4))
+    for path in args.segments:
+        size = os.path.getsize(path)
+        target = compress_segment(path)
+        print(f"{path}: {size} -> {os.path.getsize(target)} bytes")
+
+
+if __name__ == "__main__":
+    main()
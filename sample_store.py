@@ -0,0 +1,435 @@
+"""append-only on disk store of every probe result.
+
+Results are fixed width RECORD.size byte records in segment files that are only ever appended to. Readers map the
+segments and, with numpy installed, get structured array views straight onto the mapping without copying; without
+numpy they get tuples. Records are written in time order, so a range scan is a binary search per segment, narrowed
+first by a sparse index of every INDEX_STRIDE-th timestamp.
+
+A crash can leave a half written record at the end of the newest segment, it is cut off when the store is opened.
+Full segments are sealed and compressed with sample_codec on a background thread.
+"""
+import argparse
+import json
+import math
+import mmap
+import os
+import queue
+import re
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Optional
+
+SAMPLES_DIR = "gcs_samples"
+MAGIC = b"GCST"
+VERSION = 1
+SEGMENT_RECORDS = 1 << 20  # records per segment file, about 20 MB
+INDEX_STRIDE = 4096  # one timestamp per this many records is kept in memory to narrow range scans
+SERVERS_FILE = "servers.tsv"  # server id and name pairs, appended as new servers show up
+
+# magic, version, record size
+HEADER = struct.Struct("<4sHH")
+# time, server id, rtt in seconds (NaN when lost), flags, reserved
+RECORD = struct.Struct("<dIfHH")
+NUMPY_DTYPE = [("time", "<f8"), ("server", "<u4"), ("rtt", "<f4"), ("flags", "<u2"), ("reserved", "<u2")]
+
+FLAG_REACHABLE = 1
+FLAG_ERROR = 2
+FLAG_HTTP = 4
+FLAG_VIA_PARENT = 8
+FLAG_DEGRADED = 16  # reachable, but its burst probe lost or jittered too much
+
+_SEGMENT_NAME = re.compile(r"^segment_(?P<number>\d{8})\.(?P<kind>dat|gcz)$")
+
+
+def _numpy():
+    """numpy if it is installed, None otherwise"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class Segment:
+    """one segment file, its mapping and its sparse time index"""
+
+    __slots__ = ("path", "number", "count", "index", "first", "last", "_map", "_map_count")
+
+    def __init__(self, path: str, number: int) -> None:
+        self.path = path
+        self.number = number
+        self.count = 0
+        self.index = array("d")  # time of every INDEX_STRIDE-th record
+        self.first = None
+        self.last = None
+        self._map = None
+        self._map_count = 0  # records covered by the current mapping
+
+    def recover(self) -> int:
+        """cuts a torn record off the end and rebuilds the index, returns the number of bytes cut"""
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size < HEADER.size:
+            with open(self.path, "wb") as file:
+                file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            return size
+        with open(self.path, "rb") as file:
+            magic, version, record_size = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"{self.path} is not a sample segment")
+        torn = (size - HEADER.size) % RECORD.size
+        if torn:
+            with open(self.path, "r+b") as file:
+                file.truncate(size - torn)
+        self.count = (size - torn - HEADER.size) // RECORD.size
+        if self.count:
+            mapped = self.mapping()
+            self.index = array("d", (RECORD.unpack_from(mapped, HEADER.size + position * RECORD.size)[0]
+                                     for position in range(0, self.count, INDEX_STRIDE)))
+            self.first = self.index[0]
+            self.last = RECORD.unpack_from(mapped, HEADER.size + (self.count - 1) * RECORD.size)[0]
+        return torn
+
+    def appended(self, first_time: float, last_time: float, added: int, times) -> None:
+        """updates count and index after the writer appended records"""
+        for position in range(-self.count % INDEX_STRIDE, added, INDEX_STRIDE):
+            self.index.append(times[position])
+        if self.first is None:
+            self.first = first_time
+        self.last = last_time
+        self.count += added
+
+    def mapping(self):
+        """a read only mapping covering every record, remapped when the segment has grown. Earlier mappings stay
+        alive for as long as views onto them do"""
+        if self._map is None or self._map_count != self.count:
+            with open(self.path, "rb") as file:
+                self._map = mmap.mmap(file.fileno(), HEADER.size + self.count * RECORD.size,
+                                      access=mmap.ACCESS_READ)
+            self._map_count = self.count
+        return self._map
+
+    def time_at(self, position: int) -> float:
+        return RECORD.unpack_from(self.mapping(), HEADER.size + position * RECORD.size)[0]
+
+    def position(self, when: float) -> int:
+        """first record at or after a time. The sparse index narrows it to one stride, which is searched on the
+        mapping"""
+        stride = bisect_left(self.index, when)
+        low = max(0, stride - 1) * INDEX_STRIDE
+        high = min(self.count, stride * INDEX_STRIDE)
+        while low < high:
+            middle = (low + high) // 2
+            if self.time_at(middle) < when:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def scan(self, start: float, end: float):
+        """records with start <= time < end, None if there are none"""
+        if not self.count or self.last < start or self.first >= end:
+            return None
+        first = self.position(start)
+        last = self.position(end)
+        return self.view(first, last) if first < last else None
+
+    def close(self) -> None:
+        """drops the mapping, views onto it keep it open until they go"""
+        self._map = None
+
+    def view(self, first: int, last: int):
+        """records first to last (exclusive), a numpy view onto the mapping or a list of tuples without numpy"""
+        numpy = _numpy()
+        mapped = self.mapping()
+        if numpy is not None:
+            return numpy.frombuffer(mapped, dtype=numpy.dtype(NUMPY_DTYPE), count=last - first,
+                                    offset=HEADER.size + first * RECORD.size)
+        return list(RECORD.iter_unpack(memoryview(mapped)[HEADER.size + first * RECORD.size:
+                                                         HEADER.size + last * RECORD.size]))
+
+
+class SampleStore:
+    """probe results of every server, appended in batches and scanned by time range
+
+    Server names are stored once as small integer ids. Results are buffered by append and written with one write
+    per flush, the panel flushes once a second.
+    """
+
+    def __init__(self, directory: str = SAMPLES_DIR, segment_records: int = SEGMENT_RECORDS,
+                 compress: bool = True) -> None:
+        """
+        :param directory: folder of the segment files, created if missing
+        :type directory: str
+        :param segment_records: records per segment file, defaults to SEGMENT_RECORDS
+        :type segment_records: int, optional
+        :param compress: compress full segments in the background, defaults to True
+        :type compress: bool, optional
+        """
+        self.directory = directory
+        self.segment_records = segment_records
+        os.makedirs(directory, exist_ok=True)
+        self.server_ids: Dict[str, int] = {}
+        self.server_names: List[str] = []
+        self._load_servers()
+        self.segments: List[Segment] = []
+        self.recovered_bytes = 0
+        self._lock = threading.Lock()  # guards the segment list against the compressor swapping segments
+        names = sorted(os.listdir(directory))
+        compressed = {name[:-4] for name in names if name.endswith(".gcz")}
+        for name in names:
+            match = _SEGMENT_NAME.match(name)
+            if match is None:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                if match.group("kind") == "gcz":
+                    from sample_codec import CompressedSegment
+                    segment = CompressedSegment(path, int(match.group("number")))
+                elif name[:-4] in compressed:
+                    # compressed before a crash or while a mapping kept it open, the compressed copy is complete
+                    os.remove(path)
+                    continue
+                else:
+                    segment = Segment(path, int(match.group("number")))
+                    self.recovered_bytes += segment.recover()
+            except (OSError, ValueError, struct.error) as e:
+                print(f"ignoring unreadable sample segment {path}: {e}")
+                continue
+            self.segments.append(segment)
+        self._compress_queue = None
+        if compress:
+            self._compress_queue = queue.Queue()
+            threading.Thread(target=self._compress_loop, name="sample-compressor", daemon=True).start()
+            for segment in self.segments[:-1]:
+                if isinstance(segment, Segment):
+                    self._compress_queue.put(segment)
+        self._pending = bytearray()
+        self._pending_times = array("d")
+        self._last_time = self.segments[-1].last if self.segments and self.segments[-1].last is not None else 0.0
+        self.written = 0
+
+    def _load_servers(self) -> None:
+        path = os.path.join(self.directory, SERVERS_FILE)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as file:
+            data = file.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        if len(complete) != len(data):
+            # a torn last line, its server gets a new id on its next result
+            with open(path, "r+b") as file:
+                file.truncate(len(complete))
+        for line in complete.decode("utf-8", errors="replace").splitlines():
+            server_id, _, server_name = line.partition("\t")
+            self.server_ids[server_name] = int(server_id)
+        self.server_names = [""] * (max(self.server_ids.values(), default=-1) + 1)
+        for server_name, server_id in self.server_ids.items():
+            self.server_names[server_id] = server_name
+
+    def server_id(self, server_name: str) -> int:
+        """id of a server, assigning and recording a new one the first time the server is seen"""
+        server_id = self.server_ids.get(server_name)
+        if server_id is None:
+            server_id = self.server_ids[server_name] = len(self.server_names)
+            self.server_names.append(server_name)
+            with open(os.path.join(self.directory, SERVERS_FILE), "a", encoding="utf-8") as file:
+                file.write(f"{server_id}\t{server_name}\n")
+        return server_id
+
+    def append(self, server_name: str, when: float, rtt: Optional[float], flags: int = 0) -> None:
+        """buffers one result until the next flush. Times are kept in order, one earlier than the last appended
+        result is stored at that result's time"""
+        when = max(when, self._last_time)
+        self._last_time = when
+        self._pending += RECORD.pack(when, self.server_id(server_name), math.nan if rtt is None else rtt, flags, 0)
+        self._pending_times.append(when)
+
+    def append_records(self, data: bytes) -> None:
+        """buffers records that are already packed, RECORD.size bytes each and in time order, for bulk imports
+        (a numpy array of NUMPY_DTYPE converts with tobytes)"""
+        if len(data) % RECORD.size:
+            raise ValueError(f"record data must be a multiple of {RECORD.size} bytes")
+        times = [fields[0] for fields in RECORD.iter_unpack(data)] if len(data) else []
+        if times and times[0] < self._last_time:
+            raise ValueError("records must not be older than the ones already appended")
+        self._pending += data
+        self._pending_times.extend(times)
+        if times:
+            self._last_time = times[-1]
+
+    def flush(self) -> int:
+        """writes the buffered records, starting new segments as they fill up
+
+        :return: records written
+        :rtype: int
+        """
+        total = len(self._pending_times)
+        written = 0
+        while written < total:
+            segment = self.segments[-1] if self.segments else None
+            if segment is None or segment.count >= self.segment_records:
+                number = segment.number + 1 if segment is not None else 0
+                if isinstance(segment, Segment) and self._compress_queue is not None:
+                    self._compress_queue.put(segment)
+                segment = Segment(os.path.join(self.directory, f"segment_{number:08d}.dat"), number)
+                segment.recover()
+                with self._lock:
+                    self.segments.append(segment)
+            batch = min(total - written, self.segment_records - segment.count)
+            with open(segment.path, "ab") as file:
+                file.write(self._pending[written * RECORD.size:(written + batch) * RECORD.size])
+            times = self._pending_times[written:written + batch]
+            segment.appended(times[0], times[-1], batch, times)
+            written += batch
+        self._pending = bytearray()
+        self._pending_times = array("d")
+        self.written += written
+        return written
+
+    def _compress_loop(self) -> None:
+        from sample_codec import CompressedSegment, compress_segment
+        while True:
+            segment = self._compress_queue.get()
+            if segment is None:
+                return
+            try:
+                path = compress_segment(segment.path, remove=False)
+                compressed = CompressedSegment(path, segment.number)
+            except (OSError, ValueError) as e:
+                print(f"could not compress sample segment {segment.path}: {e}")
+                continue
+            # a scan that picked up the segment before the swap reads on from its mapping, which outlives the file
+            segment.mapping()
+            with self._lock:
+                self.segments[self.segments.index(segment)] = compressed
+            try:
+                os.remove(segment.path)
+            except OSError as e:
+                # a view still maps it on windows, it is removed when the store is next opened
+                print(f"could not remove compressed sample segment {segment.path}: {e}")
+
+    def scan_segments(self, start: float, end: float) -> Iterator[object]:
+        """records with start <= time < end, one array (or list) per segment holding any. Records of compressed
+        segments are decoded a block at a time"""
+        with self._lock:
+            segments = list(self.segments)
+        for segment in segments:
+            records = segment.scan(start, end)
+            if records is not None:
+                yield records
+
+    def scan(self, start: float, end: Optional[float] = None, server_name: Optional[str] = None):
+        """records of a time range, for one server or all of them
+
+        :param start: unix time
+        :type start: float
+        :param end: unix time, defaults to after the newest record
+        :type end: float, optional
+        :param server_name: only this server's records, defaults to None
+        :type server_name: str, optional
+        :return: a structured numpy array of NUMPY_DTYPE (a view onto the file when the range is within one segment
+        and no server is picked), or a list of (time, server id, rtt, flags, reserved) tuples without numpy
+        """
+        end = math.inf if end is None else end
+        views = list(self.scan_segments(start, end))
+        server_id = self.server_ids.get(server_name, -1) if server_name is not None else None
+        numpy = _numpy()
+        if numpy is None:
+            records = [record for view in views for record in view]
+            return records if server_id is None else [record for record in records if record[1] == server_id]
+        if not views:
+            records = numpy.empty(0, dtype=numpy.dtype(NUMPY_DTYPE))
+        else:
+            records = views[0] if len(views) == 1 else numpy.concatenate(views)
+        return records if server_id is None else records[records["server"] == server_id]
+
+    def drop_before(self, when: float) -> int:
+        """deletes whole segments that end before a time, the newest segment is always kept
+
+        :return: segments deleted
+        :rtype: int
+        """
+        dropped = 0
+        with self._lock:
+            while len(self.segments) > 1 and self.segments[0].last is not None and self.segments[0].last < when:
+                segment = self.segments[0]
+                if self._compress_queue is not None and isinstance(segment, Segment):
+                    break  # still waiting to be compressed
+                segment.close()
+                try:
+                    os.remove(segment.path)
+                except OSError as e:
+                    # a mapping still in use keeps the file open on windows, it goes with the next call
+                    print(f"could not delete sample segment {segment.path}: {e}")
+                    break
+                self.segments.pop(0)
+                dropped += 1
+        return dropped
+
+    def close(self) -> None:
+        """stops the compressor, a segment it is working on is finished first"""
+        if self._compress_queue is not None:
+            self._compress_queue.put(None)
+
+    def metrics(self) -> Dict:
+        return {
+            "segments": len(self.segments),
+            "records": sum(segment.count for segment in self.segments),
+            "pending": len(self._pending_times),
+            "written": self.written,
+            "compressed_segments": sum(1 for segment in self.segments if not isinstance(segment, Segment)),
+            "recovered_bytes": self.recovered_bytes,
+        }
+
+
+def benchmark(directory: str, records: int = 2_000_000, servers: int = 10_000, batch: int = 10_000) -> Dict:
+    """measures ingest through append and flush, and a range scan, in a scratch directory"""
+    store = SampleStore(directory, compress=False)
+    names = [f"bench {index}" for index in range(servers)]
+    for name in names:
+        store.server_id(name)
+    start = time.time()
+    began = time.perf_counter()
+    for index in range(records):
+        store.append(names[index % servers], start + index * 0.001, 0.02 if index % 50 else None, FLAG_REACHABLE)
+        if index % batch == batch - 1:
+            store.flush()
+    store.flush()
+    ingest = time.perf_counter() - began
+    began = time.perf_counter()
+    scanned = store.scan(start + records * 0.0004, start + records * 0.0006)
+    scan = time.perf_counter() - began
+    return {
+        "records": records,
+        "ingest_per_second": round(records / ingest),
+        "scan_records": len(scanned),
+        "scan_ms": round(scan * 1000, 3),
+        "numpy": _numpy() is not None,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Inspect or benchmark the probe sample store.")
+    parser.add_argument("--dir", default=SAMPLES_DIR, help="store directory (default: %(default)s)")
+    parser.add_argument("--server", help="only this server's records")
+    parser.add_argument("--minutes", type=float, default=10, help="print records of the last minutes")
+    parser.add_argument("--benchmark", action="store_true", help="measure ingest and scans in --dir, which must be "
+                                                                 "a scratch directory")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        print(json.dumps(benchmark(args.dir), indent=4))
+        return
+    store = SampleStore(args.dir, compress=False)
+    for record in store.scan(time.time() - args.minutes * 60, server_name=args.server):
+        when, server_id, rtt, flags, _ = (record[field] for field in range(5))
+        rtt_text = "lost" if math.isnan(rtt) else f"{rtt * 1000:.1f} ms"
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when))}  {store.server_names[server_id]}  "
+              f"{rtt_text}  flags={flags}")
+
+
+if __name__ == "__main__":
+    main()
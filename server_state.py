@@ -0,0 +1,341 @@
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from quantiles import QuantileSketch, merged
+from rtt_history import RttHistory
+
+RTT_GAIN = 1 / 8  # rfc 6298 alpha
+RTT_VARIANCE_GAIN = 1 / 4  # rfc 6298 beta
+FLAP_HALF_LIFE = 600  # seconds for a server's flap score to halve
+
+# naming families that make a group of their own, a server's name starts with the prefix and a space. Servers can
+# also name their group in servers.json with "group"
+GROUP_PREFIXES = ("dj", "cj", "b.j", "sub.j")
+DEFAULT_GROUP = "other"
+
+# what a probe result did to a server, returned by ServerModel.apply_result
+EVENT_ONLINE = "online"
+EVENT_OFFLINE = "offline"
+EVENT_ERROR = "error"
+EVENT_DEGRADED = "degraded"  # still reachable, but a burst lost or jittered past the server's thresholds
+EVENT_RECOVERED = "recovered"  # back within the thresholds while reachable
+
+
+def update_rtt_estimate(srtt: Optional[float], rttvar: Optional[float], rtt: float):
+    """folds a new round trip time into the rfc 6298 smoothed rtt and rtt variance
+
+    :return: the new (srtt, rttvar)
+    :rtype: tuple
+    """
+    if srtt is None or rttvar is None:
+        return rtt, rtt / 2
+    rttvar = (1 - RTT_VARIANCE_GAIN) * rttvar + RTT_VARIANCE_GAIN * abs(srtt - rtt)
+    srtt = (1 - RTT_GAIN) * srtt + RTT_GAIN * rtt
+    return srtt, rttvar
+
+
+def group_of(server_name: str, server: Dict) -> str:
+    """the group a server belongs to, its "group" entry in servers.json or else the first matching name prefix"""
+    if server.get("group"):
+        return server["group"]
+    prefix = server_name.strip().split(" ", 1)[0].lower()
+    return prefix if prefix in GROUP_PREFIXES else DEFAULT_GROUP
+
+
+def decay_flap_score(score: float, since: Optional[float], now: float) -> float:
+    """a flap score decays by half every FLAP_HALF_LIFE seconds since it last changed"""
+    if not score or since is None:
+        return score or 0.0
+    return score * 0.5 ** (max(0.0, now - since) / FLAP_HALF_LIFE)
+
+
+class ServerState:
+    """config, health state and probe stats of one server. Plain data, the gui keeps its widgets in lists indexed
+    by ``index`` so nothing here refers to qt"""
+
+    __slots__ = ("index", "name", "ip", "config", "group", "parent", "status", "stale", "via_parent", "last_change",
+                 "srtt", "rttvar", "flap_score", "ttfb", "total_time", "probes", "failures", "path", "history",
+                 "degraded", "burst", "anomalous", "quantiles")
+
+    def __init__(self, index: int, name: str, ip: str, config: Optional[Dict] = None) -> None:
+        self.index = index
+        self.name = name
+        self.ip = ip
+        self.config = config  # the servers.json entry, only kept when it holds more than the ip
+        self.group = None  # ServerGroup, set by the model
+        self.parent = None  # ServerState of the server named in "depends_on", such as the site's regional gateway
+        self.status = False  # True online, False offline, None when monitoring was stopped
+        self.stale = False  # status is the last known one from a previous run, not yet confirmed by a probe
+        self.via_parent = False  # offline because its parent is down, not reported on its own
+        self.last_change = None  # unix time of the last status change
+        self.srtt = None  # seconds
+        self.rttvar = None
+        self.flap_score = 0.0
+        self.ttfb = None  # seconds, http checks only
+        self.total_time = None
+        self.probes = 0
+        self.failures = 0
+        self.path = None  # PathTrace taken when the server last went down
+        self.history = None  # RttHistory of the recent probes, created on the first one
+        self.degraded = False  # reachable but lossy or jittery, servers probed in bursts only
+        self.burst = None  # BurstResult of the latest burst
+        self.anomalous = False  # reachable, but its rtt or loss has been well above its own baseline for a while
+        self.quantiles = None  # QuantileSketch of the last hour, day and week, created on the first answer
+
+    def status_label(self) -> str:
+        if self.status is None:
+            return "Stopped"
+        if self.via_parent:
+            return "Unreachable via parent"
+        if self.status and self.degraded:
+            return "Degraded"
+        if self.status and self.anomalous:
+            return "Anomalous"
+        return "Online" if self.status else "Offline"
+
+    def parent_down(self) -> bool:
+        """whether the parent has been probed this run and found down"""
+        parent = self.parent
+        return parent is not None and parent.status is False and parent.probes > 0
+
+
+class ServerGroup:
+    """a group of servers with its aggregates, kept up to date by the model as statuses and rtts change, so showing
+    a group never walks its members"""
+
+    __slots__ = ("name", "members", "online", "offline", "stopped", "worst", "quantiles")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.members: List[ServerState] = []
+        self.online = 0
+        self.offline = 0
+        self.stopped = 0
+        self.worst = None  # member with the highest smoothed rtt
+        self.quantiles = None  # the members' sketches merged, built when first asked for and then kept up to date
+
+    @property
+    def worst_rtt(self) -> Optional[float]:
+        return self.worst.srtt if self.worst is not None else None
+
+    def sketch(self) -> QuantileSketch:
+        if self.quantiles is None:
+            self.quantiles = merged(member.quantiles for member in self.members)
+        return self.quantiles
+
+    def count(self, status: Optional[bool], delta: int) -> None:
+        if status is None:
+            self.stopped += delta
+        elif status:
+            self.online += delta
+        else:
+            self.offline += delta
+
+    def rtt_changed(self, state: ServerState, previous: Optional[float]) -> None:
+        """updates the worst rtt after a member's srtt changed, only rescans when the worst member got better"""
+        if state.srtt is None:
+            return
+        if self.worst is None or state.srtt > self.worst.srtt:
+            self.worst = state
+        elif state is self.worst and previous is not None and state.srtt < previous:
+            self.worst = max((member for member in self.members if member.srtt is not None), key=lambda m: m.srtt)
+
+
+class ServerModel:
+    """every monitored server in servers.json order, looked up by index or by name, and the groups they form"""
+
+    def __init__(self, servers: Dict[str, Dict], last_known: Optional[Dict[str, Dict]] = None) -> None:
+        """
+        :param servers: server name -> entry from servers.json with at least "ip"
+        :type servers: Dict[str, Dict]
+        :param last_known: server name -> state loaded from the snapshot, defaults to None
+        :type last_known: Dict[str, Dict], optional
+        """
+        self.states: List[ServerState] = []
+        self._by_name: Dict[str, ServerState] = {}
+        self.groups: Dict[str, ServerGroup] = {}  # in order of their first server
+        self._children: Dict[str, List[ServerState]] = {}  # parent name -> servers that depend on it
+        self.suppressed_events = 0  # transitions of dependent servers that were not reported on their own
+        last_known = last_known or {}
+        for server_name, server in servers.items():
+            config = server if len(server) > 1 else None
+            state = ServerState(len(self.states), server_name, server["ip"], config)
+            known = last_known.get(server_name)
+            if known is not None:
+                # stopped servers start out offline like before, anything else starts from its last state
+                state.status = bool(known.get("status"))
+                state.stale = known.get("status") is not None
+                state.last_change = known.get("last_change")
+                state.srtt = known.get("srtt")
+                state.rttvar = known.get("rttvar")
+                state.flap_score = known.get("flap_score") or 0.0
+                state.quantiles = known.get("quantiles")
+                if isinstance(state.quantiles, (bytes, bytearray)):
+                    try:
+                        state.quantiles = QuantileSketch.from_bytes(state.quantiles)
+                    except ValueError as e:
+                        print(f"ignoring the percentiles of {server_name}: {e}")
+                        state.quantiles = None
+            group_name = group_of(server_name, server)
+            group = self.groups.get(group_name)
+            if group is None:
+                group = self.groups[group_name] = ServerGroup(group_name)
+            state.group = group
+            group.members.append(state)
+            group.count(state.status, 1)
+            group.rtt_changed(state, None)
+            self.states.append(state)
+            self._by_name[server_name] = state
+        for state in self.states:
+            parent_name = (state.config or {}).get("depends_on")
+            if not parent_name:
+                continue
+            parent = self._by_name.get(parent_name)
+            if parent is None or parent is state:
+                print(f"ignoring depends_on {parent_name!r} of {state.name}, there is no such server")
+                continue
+            state.parent = parent
+            self._children.setdefault(parent.name, []).append(state)
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def __iter__(self) -> Iterator[ServerState]:
+        return iter(self.states)
+
+    def __contains__(self, server_name: str) -> bool:
+        return server_name in self._by_name
+
+    def __getitem__(self, server_name: str) -> ServerState:
+        return self._by_name[server_name]
+
+    def get(self, server_name: str) -> Optional[ServerState]:
+        return self._by_name.get(server_name)
+
+    def has_children(self, state: ServerState) -> bool:
+        return state.name in self._children
+
+    def descendants(self, state: ServerState) -> List[ServerState]:
+        """every server that depends on this one, directly or through other servers"""
+        found = []
+        seen = {state.name}
+        pending = [state]
+        while pending:
+            for child in self._children.get(pending.pop().name, ()):
+                if child.name not in seen:
+                    seen.add(child.name)
+                    found.append(child)
+                    pending.append(child)
+        return found
+
+    def mark_via_parent(self, parent: ServerState) -> List[ServerState]:
+        """marks every monitored server behind a down parent unreachable via parent. Servers that came up while the
+        parent was down answered their own probe, they are reachable some other way and are left as they are
+
+        :return: the servers that were newly marked
+        :rtype: List[ServerState]
+        """
+        marked = []
+        for state in self.descendants(parent):
+            if state.status is None or state.via_parent:
+                continue
+            if state.status and state.last_change is not None and (
+                    parent.last_change is None or state.last_change > parent.last_change):
+                continue
+            if state.status:
+                self.suppressed_events += 1
+            self.set_status(state, False)
+            state.via_parent = True
+            marked.append(state)
+        return marked
+
+    def known_states(self) -> Dict[str, Dict]:
+        """every server's state in the form load_snapshot returns, to carry it over when the model is rebuilt"""
+        return {
+            state.name: {"status": state.status, "last_change": state.last_change, "srtt": state.srtt,
+                         "rttvar": state.rttvar, "flap_score": state.flap_score, "quantiles": state.quantiles}
+            for state in self.states
+        }
+
+    def set_status(self, state: ServerState, status: Optional[bool], now: Optional[float] = None) -> None:
+        """changes a server's status, keeping its last change time and flap score up to date"""
+        if status is not None and state.status is not None and state.status != status:
+            now = time.time() if now is None else now
+            state.flap_score = decay_flap_score(state.flap_score, state.last_change, now) + 1
+            state.last_change = now
+        if state.status != status:
+            state.group.count(state.status, -1)
+            state.group.count(status, 1)
+        state.status = status
+        state.stale = False
+        if not status:
+            state.anomalous = False
+
+    def apply_result(self, result, now: Optional[float] = None) -> Tuple[Optional[ServerState], Optional[str], bool]:
+        """folds a finished probe into its server's state
+
+        :param result: result handed over by the probe engine
+        :type result: ProbeResult
+        :return: the server's state (None if it was removed or stopped while the probe ran), EVENT_ONLINE,
+        EVENT_OFFLINE, EVENT_ERROR, EVENT_DEGRADED, EVENT_RECOVERED or None if nothing worth logging happened, and
+        whether its tile needs a repaint
+        :rtype: Tuple[Optional[ServerState], Optional[str], bool]
+        """
+        state = self._by_name.get(result.server_name)
+        if state is None or state.status is None:
+            return None, None, False
+        state.probes += 1
+        if state.history is None:
+            state.history = RttHistory()
+        when = time.time() if now is None else now
+        state.history.add(when, result.rtt if result.reachable else None)
+        if result.reachable and result.rtt is not None:
+            if state.quantiles is None:
+                state.quantiles = QuantileSketch()
+            state.quantiles.add(when, result.rtt)
+            if state.group.quantiles is not None:
+                state.group.quantiles.add(when, result.rtt)
+        if result.http is not None:
+            state.ttfb = result.http.ttfb
+            state.total_time = result.http.total
+        if result.rtt is not None:
+            previous = state.srtt
+            state.srtt, state.rttvar = update_rtt_estimate(state.srtt, state.rttvar, result.rtt)
+            state.group.rtt_changed(state, previous)
+
+        # the first probe after a restart confirms (or corrects) the last known state, either way it is repainted
+        repaint = state.stale
+        via_parent = state.via_parent
+        if result.error is not None:
+            # like going offline, only reported when it is news: the server was up, behind a down parent or has not
+            # been probed yet this run. A panel that lost its own network would otherwise report every probe
+            first = state.probes == 1 and not state.stale
+            event = EVENT_ERROR if state.status or via_parent or first else None
+            state.via_parent = False
+        elif result.reachable:
+            # a dependent server that comes back with its parent was never reported down, so its recovery isn't either
+            event = None if state.status or via_parent else EVENT_ONLINE
+            if via_parent and not state.status:
+                self.suppressed_events += 1
+            state.via_parent = False
+        elif state.parent_down():
+            event = None
+            if state.status:
+                self.suppressed_events += 1
+            state.via_parent = True
+        else:
+            # still down after its parent recovered, the failure is its own
+            event = EVENT_OFFLINE if state.status or via_parent else None
+            state.via_parent = False
+        if not result.reachable:
+            state.failures += 1
+        was_degraded = state.degraded
+        was_online = bool(state.status)
+        self.set_status(state, bool(result.reachable) and result.error is None, now)
+        if result.burst is not None:
+            state.burst = result.burst
+        state.degraded = bool(state.status) and result.burst is not None and result.burst.degraded
+        if event is None and was_online and state.status and state.degraded != was_degraded:
+            event = EVENT_DEGRADED if state.degraded else EVENT_RECOVERED
+        repaint = repaint or state.degraded != was_degraded
+        return state, event, repaint or event is not None or via_parent != state.via_parent
@@ -0,0 +1,131 @@
+import math
+from typing import Optional, Tuple
+
+from PyQt5.QtGui import QColor, QPainter, QPainterPath, QPen, QPixmap
+from PyQt5.QtWidgets import QWidget
+
+from instrumentation import Instrumentation
+from quantiles import WINDOWS, describe
+from rtt_history import RttHistory
+
+SPARKLINE_SECONDS = 600  # the sparkline spans this many seconds back from the newest sample
+SPARKLINE_HEIGHT = 28
+BACKGROUND_COLOR = QColor("#1e1e1e")
+RTT_COLOR = QColor("#4fc3f7")
+LOSS_COLOR = QColor("#ff5252")
+
+
+def build_paths(history: RttHistory, width: int, height: int,
+                seconds: float = SPARKLINE_SECONDS) -> Tuple[QPainterPath, QPainterPath, Optional[float]]:
+    """turns a server's history into painter paths, downsampled to one minimum/maximum pair per pixel column.
+
+    The right edge is the newest sample rather than the current time, so the paths only change when a sample
+    arrives and can be cached until then.
+
+    :return: the rtt path, the path of lost probe ticks and the highest rtt in the window (the y scale)
+    :rtype: Tuple[QPainterPath, QPainterPath, Optional[float]]
+    """
+    rtt_path = QPainterPath()
+    loss_path = QPainterPath()
+    latest = history.latest
+    if latest is None or width < 2 or height < 2:
+        return rtt_path, loss_path, None
+    since = latest - seconds
+    columns = {}  # x -> [min, max] rtt
+    lost = set()
+    for when, rtt in history.samples(since):
+        x = min(width - 1, int((when - since) / seconds * (width - 1)))
+        if math.isnan(rtt):
+            lost.add(x)
+            continue
+        column = columns.get(x)
+        if column is None:
+            columns[x] = [rtt, rtt]
+        elif rtt < column[0]:
+            column[0] = rtt
+        elif rtt > column[1]:
+            column[1] = rtt
+    top = max((column[1] for column in columns.values()), default=None)
+    if top:
+        scale = (height - 2) / top
+        first = True
+        for x in sorted(columns):
+            low, high = columns[x]
+            y_low = height - 1 - low * scale
+            y_high = height - 1 - high * scale
+            if first:
+                rtt_path.moveTo(x, y_low)
+                first = False
+            else:
+                rtt_path.lineTo(x, y_low)
+            if y_high != y_low:
+                rtt_path.lineTo(x, y_high)
+    for x in lost:
+        loss_path.moveTo(x + 0.5, height - 1)
+        loss_path.lineTo(x + 0.5, height * 0.4)
+    return rtt_path, loss_path, top
+
+
+class Sparkline(QWidget):
+    """rtt and loss of one server over the last SPARKLINE_SECONDS, drawn under its status bar.
+
+    The painter paths are only rebuilt when the history has new samples or the widget was resized, and they are
+    drawn once into a cached pixmap, so any other repaint is a single blit.
+    """
+
+    def __init__(self, state, instrumentation=None, parent=None) -> None:
+        """
+        :param state: the server's ServerState, its history is read when painting
+        :param instrumentation: records how long paints and path rebuilds take, defaults to None
+        :type instrumentation: Instrumentation, optional
+        """
+        super().__init__(parent)
+        self.state = state
+        self.instrumentation = instrumentation or Instrumentation(enabled=False)
+        self.setFixedHeight(SPARKLINE_HEIGHT)
+        self._key = None  # (history version, width, height) the cached pixmap was drawn for
+        self._pixmap = None
+        self._top = None
+
+    def _cached_pixmap(self) -> QPixmap:
+        history = self.state.history
+        key = (history.version if history is not None else -1, self.width(), self.height())
+        if key != self._key:
+            with self.instrumentation.timer("sparkline_path"):
+                self._pixmap = self._draw(history)
+            self._key = key
+            self._update_tooltip(history)
+        return self._pixmap
+
+    def _draw(self, history: Optional[RttHistory]) -> QPixmap:
+        pixmap = QPixmap(self.width(), self.height())
+        pixmap.fill(BACKGROUND_COLOR)
+        self._top = None
+        if history is None:
+            return pixmap
+        rtt_path, loss_path, self._top = build_paths(history, self.width(), self.height())
+        painter = QPainter(pixmap)
+        painter.setPen(QPen(LOSS_COLOR, 1))
+        painter.drawPath(loss_path)
+        painter.setPen(QPen(RTT_COLOR, 1))
+        painter.drawPath(rtt_path)
+        painter.end()
+        return pixmap
+
+    def _update_tooltip(self, history: Optional[RttHistory]) -> None:
+        if history is None or history.latest is None:
+            self.setToolTip("No probes yet")
+            return
+        loss = history.loss(history.latest - SPARKLINE_SECONDS)
+        peak = f", peak {self._top * 1000:.1f} ms" if self._top else ""
+        lines = [f"Last {SPARKLINE_SECONDS // 60} minutes: loss {loss * 100:.0f}%{peak}"]
+        sketch = self.state.quantiles
+        if sketch is not None:
+            lines.extend(f"Last {window}: {describe(sketch.percentiles(window))}" for window in WINDOWS)
+        self.setToolTip("\n".join(lines))
+
+    def paintEvent(self, event) -> None:
+        with self.instrumentation.timer("sparkline_paint"):
+            painter = QPainter(self)
+            painter.drawPixmap(0, 0, self._cached_pixmap())
+            painter.end()
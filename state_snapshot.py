@@ -0,0 +1,147 @@
+import math
+import mmap
+import os
+import struct
+import time
+from typing import Dict, Iterable, List, Tuple
+
+SNAPSHOT_FILE = "gcs_state.snapshot"
+MAGIC = b"GCSS"
+VERSION = 2
+
+# magic, version, record count, unix time the snapshot was written
+HEADER = struct.Struct("<4sHId")
+# status, offset and length of the name in the string table, last change time, smoothed rtt, rtt variance,
+# flap score, length of the quantile sketch. Fixed width so a record can be read straight out of the mapped file by
+# index. The sketches follow the string table in record order
+RECORD = struct.Struct("<bIHdddfI")
+RECORD_V1 = struct.Struct("<bIHdddf")  # snapshots written before the sketches, still read
+
+STATUS_STOPPED = -1
+STATUS_OFFLINE = 0
+STATUS_ONLINE = 1
+
+_STATUS_CODES = {None: STATUS_STOPPED, False: STATUS_OFFLINE, True: STATUS_ONLINE}
+_STATUS_VALUES = {code: value for value, code in _STATUS_CODES.items()}
+
+
+def _optional(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+def _from_optional(value: float):
+    return None if math.isnan(value) else value
+
+
+def save_snapshot(path: str, states: Iterable) -> None:
+    """writes per server state as a compact binary snapshot, atomically so a crash never leaves half a file
+
+    :param path: snapshot file
+    :type path: str
+    :param states: ServerState records, or anything with name, status, last_change, srtt, rttvar, flap_score and
+        quantiles
+    :type states: Iterable
+    """
+    write_snapshot(path, capture(states))
+
+
+def capture(states: Iterable) -> List[Tuple]:
+    """copies what a snapshot holds of every server, so write_snapshot can run on another thread while the states
+    keep changing. A sketch is taken as its encoding when it hasn't changed since it was last encoded, copied otherwise
+
+    :param states: as for save_snapshot
+    :type states: Iterable
+    :return: one tuple per server
+    :rtype: List[Tuple]
+    """
+    records = []
+    for state in states:
+        sketch = getattr(state, "quantiles", None)
+        if sketch is not None:
+            encoded = sketch.cached_bytes()
+            sketch = sketch.copy() if encoded is None else encoded
+        records.append((state.name, state.status, state.last_change, state.srtt, state.rttvar, state.flap_score,
+                        sketch))
+    return records
+
+
+def write_snapshot(path: str, captured: List[Tuple]) -> None:
+    """encodes what capture took and writes it like save_snapshot does
+
+    :param path: snapshot file
+    :type path: str
+    :param captured: capture's records
+    :type captured: List[Tuple]
+    """
+    names = []
+    names_length = 0
+    records = []
+    sketches = []
+    for server_name, status, last_change, srtt, rttvar, flap_score, sketch in captured:
+        encoded = server_name.encode("utf-8")
+        if sketch is None:
+            sketch = b""
+        elif not isinstance(sketch, bytes):
+            sketch = sketch.to_bytes()
+        records.append(RECORD.pack(
+            _STATUS_CODES.get(status, STATUS_STOPPED),
+            names_length, len(encoded),
+            _optional(last_change),
+            _optional(srtt),
+            _optional(rttvar),
+            float(flap_score or 0.0),
+            len(sketch),
+        ))
+        names.append(encoded)
+        sketches.append(sketch)
+        names_length += len(encoded)
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(records), time.time()))
+        file.write(b"".join(records))
+        file.write(b"".join(names))
+        file.write(b"".join(sketches))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path: str) -> Dict[str, Dict]:
+    """maps the snapshot file and reads every record out of it
+
+    :param path: snapshot file
+    :type path: str
+    :return: server name -> dictionary with status, last_change, srtt, rttvar, flap_score, quantiles (the encoded
+    sketch, None if there is none) and written_at, empty if there is no usable snapshot
+    :rtype: Dict[str, Dict]
+    """
+    if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+        return {}
+    with open(path, "rb") as file:
+        # the mapping is closed before returning so the file can be replaced on windows
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, version, count, written_at = HEADER.unpack_from(mapped, 0)
+            record = RECORD if version == VERSION else RECORD_V1
+            names_start = HEADER.size + count * record.size
+            if magic != MAGIC or version not in (1, VERSION) or names_start > len(mapped):
+                print(f"ignoring unreadable state snapshot {path}")
+                return {}
+            fields = [record.unpack_from(mapped, HEADER.size + index * record.size) for index in range(count)]
+            sketch_start = names_start + sum(field[1] + field[2] for field in fields[-1:])
+            states = {}
+            for status, name_offset, name_length, last_change, srtt, rttvar, flap_score, *sketch in fields:
+                start = names_start + name_offset
+                server_name = mapped[start:start + name_length].decode("utf-8", errors="replace")
+                sketch_length = sketch[0] if sketch else 0
+                states[server_name] = {
+                    "status": _STATUS_VALUES.get(status),
+                    "last_change": _from_optional(last_change),
+                    "srtt": _from_optional(srtt),
+                    "rttvar": _from_optional(rttvar),
+                    "flap_score": flap_score,
+                    "quantiles": mapped[sketch_start:sketch_start + sketch_length] if sketch_length else None,
+                    "written_at": written_at,
+                }
+                sketch_start += sketch_length
+            return states
@@ -0,0 +1,176 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+import alerts
+from alerts import DOWN, UP, AlertDispatcher, Channel, SmtpSink, Transition, WebhookSink
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            failing = server.requests <= server.failures
+        time.sleep(server.delay)
+        if not failing:
+            with server.lock:
+                server.alerts.append(json.loads(body))
+        self.send_response(500 if failing else 204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def webhook():
+    """a local http.server standing in for a webhook, failing its first `failures` requests"""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _WebhookHandler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.requests = 0
+    httpd.failures = 0
+    httpd.delay = 0.0
+    httpd.alerts = []
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/alerts"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def smtp():
+    """a minimal smtp server on a socket, keeping the DATA of every message"""
+    listener = socket.create_server(("127.0.0.1", 0))
+    stand_in = SimpleNamespace(port=listener.getsockname()[1], messages=[])
+
+    def serve():
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            with connection, connection.makefile("rb") as reader:
+                connection.sendall(b"220 stand-in ESMTP\r\n")
+                for line in reader:
+                    command = line.strip().upper()
+                    if command == b"DATA":
+                        connection.sendall(b"354 go ahead\r\n")
+                        data = b"".join(iter(reader.readline, b".\r\n"))
+                        stand_in.messages.append(data.decode("utf-8"))
+                        connection.sendall(b"250 queued\r\n")
+                    elif command == b"QUIT":
+                        connection.sendall(b"221 bye\r\n")
+                        break
+                    else:
+                        connection.sendall(b"250 ok\r\n")
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield stand_in
+    listener.close()
+
+
+class _Deliveries:
+    """on_event of the channels, counting the alerts they sent"""
+
+    def __init__(self):
+        self.lines = []
+        self.changed = threading.Condition()
+
+    def __call__(self, line):
+        with self.changed:
+            self.lines.append(line)
+            self.changed.notify_all()
+
+    def wait(self, count, timeout=5.0):
+        with self.changed:
+            return self.changed.wait_for(lambda: len(self.lines) >= count, timeout)
+
+
+def test_outage_of_a_group_is_one_alert_on_every_channel(webhook, smtp):
+    deliveries = _Deliveries()
+    channels = [Channel(WebhookSink(webhook.url), on_event=deliveries),
+                Channel(SmtpSink("127.0.0.1", smtp.port, recipients=["ops@example.org"]),
+                        on_event=deliveries)]
+    dispatcher = AlertDispatcher(channels, window=0.2)
+    for index in range(12):
+        dispatcher.submit(Transition(f"dj{index:02d}", "dj", DOWN))
+
+    assert deliveries.wait(2)
+    dispatcher.stop()
+    assert [alert["subject"] for alert in webhook.alerts] == ["12 servers down in group DJ"]
+    assert len(webhook.alerts[0]["transitions"]) == 12
+    assert len(smtp.messages) == 1
+    assert "Subject: [GCS] 12 servers down in group DJ" in smtp.messages[0]
+    assert dispatcher.metrics()["alerts"] == 1
+
+
+def test_flap_inside_one_window_is_cancelled(webhook):
+    deliveries = _Deliveries()
+    dispatcher = AlertDispatcher([Channel(WebhookSink(webhook.url), on_event=deliveries)], window=0.2)
+    dispatcher.submit(Transition("flappy", "dj", DOWN))
+    dispatcher.submit(Transition("flappy", "dj", UP))
+    dispatcher.submit(Transition("steady", "dj", DOWN))
+
+    assert deliveries.wait(1)
+    dispatcher.stop()
+    assert [alert["subject"] for alert in webhook.alerts] == ["Steady Server is down"]
+    assert dispatcher.metrics()["cancelled_in_window"] == 1
+
+
+def test_alerts_held_back_by_the_rate_limit_go_out_as_one_digest(webhook):
+    deliveries = _Deliveries()
+    channel = Channel(WebhookSink(webhook.url), rate=120, burst=1, on_event=deliveries)
+    for server_name in ("a", "b", "c"):
+        channel.put(alerts.group_alerts([Transition(server_name, "dj", DOWN)])[0])
+
+    assert deliveries.wait(2)
+    channel.close()
+    channel.join(2)
+    assert [alert["subject"] for alert in webhook.alerts] == [
+        "A Server is down", "2 alerts: B Server is down; C Server is down"]
+    assert channel.sent == 2
+
+
+def test_failed_delivery_is_retried(webhook, monkeypatch):
+    monkeypatch.setattr(alerts, "RETRY_DELAY", 0.01)
+    webhook.failures = 2
+    deliveries = _Deliveries()
+    channel = Channel(WebhookSink(webhook.url), on_event=deliveries)
+    channel.put(alerts.group_alerts([Transition("a", "dj", DOWN)])[0])
+
+    assert deliveries.wait(1)
+    channel.close()
+    channel.join(2)
+    assert webhook.requests == 3
+    assert len(webhook.alerts) == 1
+    assert channel.sent == 1 and channel.failed == 0
+    assert "500" in channel.last_error
+
+
+def test_submit_does_not_wait_for_a_slow_sink(webhook):
+    webhook.delay = 1.0
+    deliveries = _Deliveries()
+    dispatcher = AlertDispatcher([Channel(WebhookSink(webhook.url), on_event=deliveries)], window=0.05)
+    dispatcher.submit(Transition("first", "dj", DOWN))
+    time.sleep(0.2)  # the first alert is being delivered now
+
+    started = time.perf_counter()
+    for index in range(200):
+        dispatcher.submit(Transition(f"dj{index}", "dj", DOWN))
+    assert time.perf_counter() - started < 0.1
+
+    assert deliveries.wait(2, timeout=5)
+    dispatcher.stop()
+    assert [alert["subject"] for alert in webhook.alerts] == ["First Server is down", "200 servers down in group DJ"]
@@ -0,0 +1,122 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from http_probe import HttpProber
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            server.open += 1
+            server.peak = max(server.peak, server.open)
+
+    def finish(self):
+        super().finish()
+        with self.server.lock:
+            self.server.open -= 1
+
+    def do_GET(self):
+        if self.path == "/slow":
+            time.sleep(self.server.slow_seconds)
+        status, body = (404, b"not here") if self.path == "/missing" else (200, b"status: ok")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """a local http.server standing in for a monitored endpoint"""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.connections = 0
+    httpd.open = 0
+    httpd.peak = 0
+    httpd.slow_seconds = 0.5
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _probe(prober, server, path="/health", **kwargs):
+    return prober.probe("127.0.0.1", path, port=server.server_address[1], **kwargs)
+
+
+def test_keep_alive_connection_is_reused(server):
+    prober = HttpProber()
+    first = _probe(prober, server)
+    second = _probe(prober, server)
+    prober.close()
+    assert first.ok and not first.reused
+    assert second.ok and second.reused
+    assert server.connections == 1
+    assert second.ttfb is not None and second.total >= second.ttfb
+
+
+def test_unexpected_status_fails(server):
+    prober = HttpProber()
+    assert _probe(prober, server, "/missing", expected_status=404).ok
+    result = _probe(prober, server, "/missing")
+    prober.close()
+    assert not result.ok and result.status == 404
+    assert "expected status 200" in result.error
+
+
+def test_body_substring(server):
+    prober = HttpProber()
+    assert _probe(prober, server, body_contains="status: ok").ok
+    result = _probe(prober, server, body_contains="healthy")
+    prober.close()
+    assert not result.ok and result.status == 200
+    assert "healthy" in result.error
+
+
+def test_slow_endpoint_hits_deadline(server):
+    prober = HttpProber()
+    began = time.monotonic()
+    result = _probe(prober, server, "/slow", timeout=0.2)
+    elapsed = time.monotonic() - began
+    prober.close()
+    assert not result.ok
+    assert result.error == "timed out"
+    assert elapsed < 0.4
+
+
+def test_pool_bounds_connections_per_host(server):
+    server.slow_seconds = 0.3
+    prober = HttpProber(max_per_host=2)
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(lambda _: _probe(prober, server, "/slow", timeout=2), range(6)))
+    prober.close()
+    assert all(result.ok for result in results)
+    assert server.peak <= 2
+    assert server.connections <= 2
+
+
+def test_probe_waiting_for_a_slot_gives_up_at_its_deadline(server):
+    server.slow_seconds = 1.0
+    prober = HttpProber(max_per_host=1)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        busy = executor.submit(_probe, prober, server, "/slow", timeout=2)
+        time.sleep(0.1)
+        waiting = executor.submit(_probe, prober, server, "/health", timeout=0.3).result()
+        assert busy.result().ok
+    prober.close()
+    assert not waiting.ok
+    assert "no free connection" in waiting.error
@@ -0,0 +1,51 @@
+import bisect
+import random
+import threading
+
+import instrumentation
+from instrumentation import BUCKET_BOUNDS, FOLD_VALUES, Histogram, Instrumentation
+
+
+def observed(values):
+    histogram = Histogram()
+    for seconds in values:
+        histogram.observe(seconds)
+    return histogram
+
+
+def test_bulk_counts_match_bucket_by_bucket_counting_with_and_without_numpy(monkeypatch):
+    generator = random.Random(1)
+    values = [generator.lognormvariate(-7, 3) for _ in range(FOLD_VALUES * 3 + 17)] + [0.0, BUCKET_BOUNDS[4], 1e6]
+    expected = [0] * (len(BUCKET_BOUNDS) + 1)
+    for seconds in values:
+        expected[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+
+    with_numpy = observed(values)
+    summary = with_numpy.to_dict()
+    assert with_numpy.counts == expected and with_numpy.values == []
+    assert summary["count"] == len(values)
+    assert summary["min_ms"] == 0.0 and summary["max_ms"] == 1e9
+
+    monkeypatch.setattr(instrumentation, "_numpy", lambda: None)
+    without_numpy = observed(values)
+    assert without_numpy.to_dict() == summary
+    assert without_numpy.counts == expected
+
+
+def test_observations_from_several_threads_are_all_counted():
+    metrics = Instrumentation()
+    threads = [threading.Thread(target=lambda: [metrics.observe("probe", 0.001) for _ in range(FOLD_VALUES * 5)])
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.snapshot()["timings"]["probe"]["count"] == 8 * FOLD_VALUES * 5
+
+
+def test_disabled_instrumentation_records_nothing():
+    metrics = Instrumentation(enabled=False)
+    with metrics.timer("repaint"):
+        metrics.observe("probe", 0.001)
+        metrics.increment("stalls")
+    assert metrics.snapshot()["timings"] == {} and metrics.snapshot()["counters"] == {}
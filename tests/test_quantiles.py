@@ -0,0 +1,52 @@
+from quantiles import QuantileSketch
+from state_snapshot import capture, load_snapshot, save_snapshot, write_snapshot
+from server_state import ServerModel
+
+NOW = 1_700_000_000.0
+
+
+def sketch_with(rtts):
+    sketch = QuantileSketch()
+    for offset, rtt in enumerate(rtts):
+        sketch.add(NOW - offset, rtt)
+    return sketch
+
+
+def test_sketch_read_back_lazily_matches_and_is_not_encoded_again():
+    sketch = sketch_with([0.01, 0.02, 0.02, 0.3])
+    data = sketch.to_bytes()
+
+    loaded = QuantileSketch.from_bytes(data)
+    assert loaded.to_bytes() is loaded.cached_bytes()
+    assert loaded.histogram("1h", NOW) == sketch.histogram("1h", NOW)
+
+    loaded.add(NOW, 0.05)
+    assert loaded.cached_bytes() is None
+    assert loaded.percentiles("1h", (1.0,), NOW)[1.0] > 0.2
+
+
+def test_copy_encoded_elsewhere_is_remembered_until_the_sketch_changes():
+    sketch = sketch_with([0.01, 0.02])
+    copy = sketch.copy()
+    sketch_bytes = copy.to_bytes()
+    assert sketch.cached_bytes() is sketch_bytes
+
+    sketch.add(NOW, 0.03)
+    assert sketch.cached_bytes() is None
+    assert copy.histogram("1h", NOW) != sketch.histogram("1h", NOW)
+
+
+def test_captured_snapshot_is_written_as_it_was_taken(tmp_path):
+    model = ServerModel({"a": {"ip": "10.0.0.1"}, "b": {"ip": "10.0.0.2"}})
+    model["a"].quantiles = sketch_with([0.01, 0.02])
+    captured = capture(model)
+    model["a"].quantiles.add(NOW, 0.4)
+
+    write_snapshot(str(tmp_path / "captured"), captured)
+    known = load_snapshot(str(tmp_path / "captured"))
+    assert sum(QuantileSketch.from_bytes(known["a"]["quantiles"]).histogram("1h", NOW)) == 2
+    assert known["b"]["quantiles"] is None
+
+    save_snapshot(str(tmp_path / "saved"), model)
+    restored = ServerModel({"a": {"ip": "10.0.0.1"}}, load_snapshot(str(tmp_path / "saved")))
+    assert restored["a"].quantiles.histogram("1h", NOW) == model["a"].quantiles.histogram("1h", NOW)
@@ -0,0 +1,110 @@
+import os
+import time
+
+from rollups import RECORD, RollupStore, write_rollups
+
+
+def test_summary_of_short_recent_range_uses_fine_buckets():
+    store = RollupStore()
+    now = time.time() // 60 * 60  # the range starts on a bucket edge, so no earlier samples share its first bucket
+    start = now - 3 * 3600 - 300
+    for second in range(0, 3 * 3600, 5):
+        store.add("a", start + second, 0.5, up=True)
+    for second in range(0, 300, 5):
+        store.add("a", now - 300 + second, 0.01, up=True)
+
+    summary = store.summary("a", now - 300, now)
+
+    assert summary.resolution == 300
+    assert summary.samples == 60
+    assert abs(summary.rtt_max - 0.01) < 1e-6
+    assert abs(summary.rtt_avg - 0.01) < 1e-6
+
+
+def test_summary_of_long_range_stays_coarse():
+    store = RollupStore()
+    now = time.time()
+    for hour in range(24 * 20):
+        store.add("a", now - (24 * 20 - hour) * 3600 + 1, 0.02, up=True)
+    assert store.choose_resolution(now - 20 * 86400, now) == 3600
+    assert store.summary("a", now - 20 * 86400, now).samples == 24 * 20
+
+
+def minute_results(store, start, minutes, rtt=0.02, server_name="a"):
+    for second in range(0, minutes * 60, 10):
+        store.add(server_name, start + second, rtt, up=True)
+
+
+def test_saves_append_only_what_closed_and_load_back(tmp_path):
+    path = str(tmp_path / "rollups")
+    now = time.time() // 3600 * 3600
+    store = RollupStore()
+    minute_results(store, now - 7200, 30)
+    write_rollups(path, store.capture(), store.resolutions)
+    sizes = {name: os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)}
+    assert store.capture() == []
+
+    minute_results(store, now - 5400, 1)
+    captured = store.capture()
+    # the minute and the quarter hour that just ended
+    assert sorted((resolution, len(records) // RECORD.size) for _, resolution, records in captured) == [(60, 1), (900, 1)]
+    write_rollups(path, captured, store.resolutions)
+    grown = {name: os.path.getsize(os.path.join(path, name)) - sizes.get(name, 0) for name in os.listdir(path)}
+    assert sum(grown.values()) < 100
+
+    store.save(path)
+    loaded = RollupStore.load(path)
+    for resolution in (60, 900, 3600):
+        expected = [rollup.pack() for rollup in store.query("a", now - 7200, now, resolution)]
+        assert [rollup.pack() for rollup in loaded.query("a", now - 7200, now, resolution)] == expected
+
+
+def test_bucket_open_at_shutdown_continues_after_restart(tmp_path):
+    path = str(tmp_path / "rollups")
+    start = time.time() // 3600 * 3600 - 3600
+    store = RollupStore()
+    minute_results(store, start, 20)
+    store.save(path)
+
+    restarted = RollupStore.load(path)
+    minute_results(restarted, start + 1200, 40, rtt=0.04)
+    restarted.add("a", start + 3600, 0.04, up=True)
+    restarted.save(path)
+
+    hour = RollupStore.load(path).query("a", start, start + 3600, 3600)
+    assert [rollup.samples for rollup in hour] == [360]
+    assert abs(hour[0].rtt_avg - (0.02 + 2 * 0.04) / 3) < 1e-6
+
+
+def test_coarse_buckets_lost_in_a_crash_are_rebuilt(tmp_path):
+    path = str(tmp_path / "rollups")
+    start = time.time() // 3600 * 3600 - 3 * 3600
+    store = RollupStore()
+    minute_results(store, start, 150)
+    write_rollups(path, store.capture(), store.resolutions)  # the open hourly bucket is never written
+
+    loaded = RollupStore.load(path)
+    hours = loaded.query("a", start, start + 3 * 3600, 3600)
+    assert [rollup.samples for rollup in hours] == [360, 360, 174]
+    assert [rollup.samples for rollup in loaded.query("a", start + 8100, start + 9000, 900)] == [84]
+
+
+def test_torn_entry_is_cut_off_and_expired_segments_deleted(tmp_path):
+    path = str(tmp_path / "rollups")
+    now = time.time() // 3600 * 3600
+    store = RollupStore()
+    store.add("old", now - 3 * 86400, 0.01, up=True)
+    store.add("old", now - 3 * 86400 + 60, 0.01, up=True)
+    minute_results(store, now - 600, 5)
+    write_rollups(path, store.capture(), store.resolutions, now=now - 3 * 86400)
+    segment = os.path.join(path, f"rollups_60_{int((now - 600) // 86400)}.dat")
+    size = os.path.getsize(segment)
+    with open(segment, "ab") as file:
+        file.write(b"\x05\x00\x3c")
+
+    loaded = RollupStore.load(path)
+    assert os.path.getsize(segment) == size
+    assert len(loaded.query("a", now - 600, now, 60)) == 4
+
+    write_rollups(path, [], store.resolutions, now=now)
+    assert not any(name.startswith("rollups_60_") and name != os.path.basename(segment) for name in os.listdir(path))
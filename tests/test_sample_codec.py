@@ -0,0 +1,94 @@
+import math
+
+import pytest
+
+import sample_codec
+from sample_codec import (RTT_MANTISSA_BITS, TIME_RESOLUTION, CompressedSegment, compress_segment, decode_block,
+                          encode_block)
+from sample_store import FLAG_ERROR, FLAG_REACHABLE, SampleStore
+
+START = 1_700_000_000.0
+TIME_ERROR = TIME_RESOLUTION / 2
+RTT_ERROR = 2.0 ** -(RTT_MANTISSA_BITS + 1)  # rounding to the mantissa bits kept, relative
+
+
+def series(server_id, rtts, offset, interval=5.0, flags=FLAG_REACHABLE):
+    """records of one server at a steady cadence with a little sub-millisecond jitter"""
+    return [(START + offset + index * interval + (index % 3) * 0.00037, server_id, rtt,
+             0 if math.isnan(rtt) else flags, 0)
+            for index, rtt in enumerate(rtts)]
+
+
+CASES = {
+    "all_lost": series(1, [math.nan] * 5, 0.1),
+    "single": series(2, [0.0213], 0.2),
+    "inf": series(3, [0.02, math.inf, 0.021, math.inf], 0.3),
+    "mixed": sorted(series(1, [math.nan] * 6, 0.1) + series(2, [0.0213], 0.2)
+                    + series(3, [0.02, math.inf, 0.021, math.inf], 0.3)
+                    + series(4, [0.005, math.nan, math.nan, 0.0051, 0.5, 0.00049], 0.4, flags=FLAG_ERROR)
+                    + series(7, [0.12, 0.121, 0.119, 0.2, math.nan, 0.118], 0.45, interval=1.0)),
+}
+
+
+def as_tuples(records):
+    return [record.item() if hasattr(record, "item") else tuple(record) for record in records]
+
+
+def assert_within_bounds(decoded, records):
+    assert len(decoded) == len(records)
+    for (when, server_id, rtt, flags, reserved), original in zip(decoded, sorted(records)):
+        assert server_id == original[1]
+        assert flags == original[3] and reserved == 0
+        assert abs(when - original[0]) <= TIME_ERROR + 1e-6
+        if math.isnan(original[2]):
+            assert math.isnan(rtt)
+        elif math.isinf(original[2]):
+            assert rtt == original[2]
+        else:
+            assert rtt == pytest.approx(original[2], rel=RTT_ERROR)
+
+
+@pytest.mark.parametrize("case", sorted(CASES))
+def test_round_trip_is_within_the_documented_bounds(case, monkeypatch):
+    records = CASES[case]
+    assert_within_bounds(as_tuples(decode_block(encode_block(records))), records)
+
+    monkeypatch.setattr(sample_codec, "_numpy", lambda: None)
+    assert_within_bounds(decode_block(encode_block(records)), records)
+
+
+@pytest.mark.parametrize("case", sorted(CASES))
+def test_numpy_and_pure_python_encoders_write_the_same_bytes(case, monkeypatch):
+    records = CASES[case]
+    with_numpy = encode_block(records)
+    decoded_with_numpy = as_tuples(decode_block(with_numpy))
+
+    monkeypatch.setattr(sample_codec, "_numpy", lambda: None)
+    assert encode_block(records) == with_numpy
+    decoded = decode_block(with_numpy)
+    assert [record[:2] + record[3:] for record in decoded] == [record[:2] + record[3:]
+                                                               for record in decoded_with_numpy]
+    assert all(a[2] == b[2] or math.isnan(a[2]) and math.isnan(b[2]) for a, b in zip(decoded, decoded_with_numpy))
+
+
+def test_compressed_segment_is_the_same_file_with_or_without_numpy(tmp_path, monkeypatch):
+    store = SampleStore(str(tmp_path / "store"), compress=False)
+    names = {1: "a", 2: "b", 3: "c", 4: "d", 7: "e"}
+    for when, server_id, rtt, flags, _ in CASES["mixed"]:
+        store.append(names[server_id], when, None if math.isnan(rtt) else rtt, flags)
+    store.flush()
+    path = store.segments[0].path
+
+    with_numpy = compress_segment(path, block_records=8, remove=False)
+    with open(with_numpy, "rb") as file:
+        data = file.read()
+    segment = CompressedSegment(with_numpy, 0)
+    assert segment.count == len(CASES["mixed"])
+    scanned = as_tuples(segment.scan(START + 5.0, START + 20.0))
+    assert [record[0] for record in scanned] == sorted(record[0] for record in scanned)
+    assert all(START + 5.0 <= record[0] < START + 20.0 for record in scanned)
+
+    monkeypatch.setattr(sample_codec, "_numpy", lambda: None)
+    with open(compress_segment(path, block_records=8, remove=False), "rb") as file:
+        assert file.read() == data
+    assert len(CompressedSegment(with_numpy, 0).scan(START + 5.0, START + 20.0)) == len(scanned)
@@ -0,0 +1,78 @@
+import math
+import os
+
+import sample_store
+from sample_store import FLAG_REACHABLE, HEADER, RECORD, SampleStore
+
+
+def rows(records):
+    """records of a scan as tuples, numpy or not, with lost round trip times as None so they compare equal"""
+    rows = []
+    for record in records:
+        when, server_id, rtt, flags, reserved = (record.item() if hasattr(record, "item") else record)
+        rows.append((when, server_id, None if math.isnan(rtt) else rtt, flags, reserved))
+    return rows
+
+
+def fill(store, count, start=100.0):
+    for index in range(count):
+        store.append("a" if index % 2 else "b", start + index, None if index % 5 == 4 else 0.02, FLAG_REACHABLE)
+    return store.flush()
+
+
+def test_scan_includes_the_start_and_excludes_the_end(tmp_path):
+    store = SampleStore(str(tmp_path), compress=False)
+    assert fill(store, 10) == 10
+
+    assert [row[0] for row in rows(store.scan(102.0, 105.0))] == [102.0, 103.0, 104.0]
+    assert [row[0] for row in rows(store.scan(102.5, 103.0))] == []
+    assert len(store.scan(100.0)) == 10
+    assert len(store.scan(110.0)) == 0
+    assert [row[0] for row in rows(store.scan(100.0, 106.0, server_name="a"))] == [101.0, 103.0, 105.0]
+    assert len(store.scan(100.0, server_name="unknown")) == 0
+
+
+def test_record_torn_by_a_crash_is_cut_off_on_reopen(tmp_path):
+    store = SampleStore(str(tmp_path), compress=False)
+    fill(store, 10)
+    store.close()
+    path = os.path.join(str(tmp_path), "segment_00000000.dat")
+    os.truncate(path, HEADER.size + 9 * RECORD.size + 5)
+
+    reopened = SampleStore(str(tmp_path), compress=False)
+    assert reopened.recovered_bytes == 5
+    assert os.path.getsize(path) == HEADER.size + 9 * RECORD.size
+    assert [row[0] for row in rows(reopened.scan(100.0))] == [100.0 + index for index in range(9)]
+
+    reopened.append("a", 200.0, 0.03, FLAG_REACHABLE)
+    reopened.flush()
+    [(when, server_id, rtt, flags, _)] = rows(reopened.scan(150.0))
+    assert (when, server_id, flags) == (200.0, reopened.server_ids["a"], FLAG_REACHABLE)
+    assert math.isclose(rtt, 0.03, rel_tol=1e-6)
+
+
+def test_scan_runs_across_segment_rollover(tmp_path):
+    store = SampleStore(str(tmp_path), segment_records=4, compress=False)
+    fill(store, 6)
+    fill(store, 4, start=106.0)
+    assert [segment.count for segment in store.segments] == [4, 4, 2]
+
+    assert [row[0] for row in rows(store.scan(102.0, 109.0))] == [100.0 + index for index in range(2, 9)]
+    assert [row[0] for row in rows(store.scan(103.0, 108.0, server_name="a"))] == [103.0, 105.0, 107.0]
+
+    reopened = SampleStore(str(tmp_path), segment_records=4, compress=False)
+    assert rows(reopened.scan(100.0)) == rows(store.scan(100.0))
+
+
+def test_scan_without_numpy_returns_the_same_records(tmp_path, monkeypatch):
+    store = SampleStore(str(tmp_path), segment_records=4, compress=False)
+    fill(store, 10)
+    with_numpy = {(start, end, server_name): rows(store.scan(start, end, server_name))
+                  for start, end, server_name in ((100.0, 110.0, None), (101.0, 107.0, None), (102.0, 109.0, "b"))}
+
+    monkeypatch.setattr(sample_store, "_numpy", lambda: None)
+    for (start, end, server_name), expected in with_numpy.items():
+        records = store.scan(start, end, server_name)
+        assert isinstance(records, list)
+        assert rows(records) == expected
+    assert store.scan(120.0) == []
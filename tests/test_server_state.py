@@ -0,0 +1,29 @@
+from probe_engine import ProbeResult
+from server_state import ServerModel
+
+SERVERS = {
+    "gw": {"ip": "10.1.0.1"},
+    "a": {"ip": "10.1.0.2", "depends_on": "gw"},
+    "b": {"ip": "10.1.0.3", "depends_on": "gw"},
+}
+
+
+def probe(model, server_name, reachable, now):
+    return model.apply_result(ProbeResult(server_name, SERVERS[server_name]["ip"], reachable,
+                                          0.01 if reachable else None), now=now)
+
+
+def test_child_answering_behind_down_parent_is_not_marked_again():
+    model = ServerModel(SERVERS)
+    for server_name in SERVERS:
+        probe(model, server_name, True, 100.0)
+    probe(model, "gw", False, 200.0)
+    assert [state.name for state in model.mark_via_parent(model["gw"])] == ["a", "b"]
+
+    state, event, _ = probe(model, "a", True, 300.0)
+    assert event is None and state.status and not state.via_parent
+
+    probe(model, "gw", False, 400.0)
+    assert model.mark_via_parent(model["gw"]) == []
+    assert model["a"].status_label() == "Online"
+    assert model["b"].via_parent
@@ -0,0 +1,332 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, List, Sequence
+
+from PyQt5.QtCore import QEvent, QRect, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QImage, QPainter
+from PyQt5.QtWidgets import QAbstractScrollArea, QToolTip
+
+from availability import LOG_HISTORY_DAYS, AvailabilityHistory
+from instrumentation import Instrumentation
+
+# zoom name -> (seconds shown across the view, bucket width in seconds). A tile pixel column is one bucket, so the
+# aggregation level follows the zoom and a month never costs more pixels than an hour
+ZOOM_LEVELS = {
+    "Hour": (3600, 10),
+    "Day": (86400, 120),
+    "Month": (LOG_HISTORY_DAYS * 86400, 3600),
+}
+DEFAULT_ZOOM = "Day"
+TILE_COLUMNS = 256  # buckets per tile
+TILE_ROWS = 64  # servers per tile
+ROW_HEIGHT = 8  # pixels per server row, the last one is left as a gap
+LABEL_WIDTH = 150
+MAX_TILES = 256  # cached tile images, about 128 KB each
+TILE_WORKERS = 1
+
+DOWN_COLOR = QColor("#c62828")
+DEGRADED_COLOR = QColor("#ffb300")
+UP_COLOR = QColor("#2e7d32")
+UNKNOWN_COLOR = QColor("#3a3a3a")
+GAP_COLOR = QColor("#2b2b2b")
+LABEL_COLOR = QColor("#dcdcdc")
+NOW_COLOR = QColor("#4fc3f7")
+
+# colour table of the tile images: 0 down, 1-9 partly up (degraded), 10 up, then unknown and the row gap
+DEGRADED_STEPS = 9
+UNKNOWN_INDEX = DEGRADED_STEPS + 2
+GAP_INDEX = DEGRADED_STEPS + 3
+
+
+def _mix(first: QColor, second: QColor, ratio: float) -> int:
+    return QColor(
+        int(first.red() + (second.red() - first.red()) * ratio),
+        int(first.green() + (second.green() - first.green()) * ratio),
+        int(first.blue() + (second.blue() - first.blue()) * ratio),
+    ).rgb()
+
+
+def _color_table() -> List[int]:
+    table = [DOWN_COLOR.rgb()]
+    for step in range(DEGRADED_STEPS):
+        # mostly down buckets lean red, mostly up ones lean towards amber, a fully up bucket is the only green one
+        table.append(_mix(DOWN_COLOR, DEGRADED_COLOR, (step + 1) / DEGRADED_STEPS))
+    return table + [UP_COLOR.rgb(), UNKNOWN_COLOR.rgb(), GAP_COLOR.rgb()]
+
+
+COLOR_TABLE = _color_table()
+
+
+def color_index(fraction: float) -> int:
+    """colour table index of a bucket's up fraction, -1 meaning no known state"""
+    if fraction < 0:
+        return UNKNOWN_INDEX
+    if fraction >= 1:
+        return DEGRADED_STEPS + 1
+    if fraction <= 0:
+        return 0
+    return 1 + min(DEGRADED_STEPS - 1, int(fraction * DEGRADED_STEPS))
+
+
+def render_tile(history: AvailabilityHistory, names: Sequence[str], bucket_seconds: int, tile_x: int,
+                now: float) -> QImage:
+    """draws one tile, TILE_COLUMNS buckets of up to TILE_ROWS servers, one byte per pixel.
+
+    Safe to call off the gui thread, it only touches QImage.
+
+    :param names: the tile's servers from top to bottom
+    :type names: Sequence[str]
+    :param tile_x: tile column, tiles are aligned to multiples of TILE_COLUMNS buckets since the epoch
+    :type tile_x: int
+    :rtype: QImage
+    """
+    start = tile_x * TILE_COLUMNS * bucket_seconds
+    gap_line = bytes([GAP_INDEX]) * TILE_COLUMNS
+    rows = []
+    for name in names:
+        line = bytes(color_index(fraction)
+                     for fraction in history.up_fractions(name, start, bucket_seconds, TILE_COLUMNS, now))
+        rows.append(line * (ROW_HEIGHT - 1) + gap_line)
+    rows.append(gap_line * (ROW_HEIGHT * (TILE_ROWS - len(names))))
+    data = b"".join(rows)
+    image = QImage(data, TILE_COLUMNS, TILE_ROWS * ROW_HEIGHT, TILE_COLUMNS, QImage.Format_Indexed8)
+    image.setColorTable(COLOR_TABLE)
+    return image.copy()  # the image above only borrows data
+
+
+class _Tile:
+    __slots__ = ("image", "rendered_at", "version")
+
+    def __init__(self, image: QImage, rendered_at: float, version: int) -> None:
+        self.image = image
+        self.rendered_at = rendered_at
+        self.version = version  # history version the tile was drawn from
+
+
+class TimelineView(QAbstractScrollArea):
+    """fleet availability heatmap, one row per server and one pixel column per bucket of the zoom level.
+
+    The heatmap is cut into tiles of TILE_COLUMNS buckets by TILE_ROWS servers, drawn on a worker thread and kept in
+    an LRU cache. A tile that ends in the past never changes, so as time goes on only the tiles holding the current
+    bucket are redrawn and panning back over a month is served from the cache.
+    """
+
+    tile_rendered = pyqtSignal(object, object, float, int)
+
+    def __init__(self, history: AvailabilityHistory, names: Callable[[], List[str]], instrumentation=None,
+                 parent=None) -> None:
+        """
+        :param history: the panel's availability history
+        :type history: AvailabilityHistory
+        :param names: returns the servers in row order, called whenever the rows are reset
+        :type names: Callable[[], List[str]]
+        :param instrumentation: records paint and tile render times, defaults to None
+        :type instrumentation: Instrumentation, optional
+        """
+        super().__init__(parent)
+        self.history = history
+        self.names_source = names
+        self.names = names()
+        self.instrumentation = instrumentation or Instrumentation(enabled=False)
+        self.zoom = DEFAULT_ZOOM
+        self.follow_now = True  # keeps the right edge on the current time until the user pans away
+        self._tiles = OrderedDict()  # (bucket seconds, tile x, tile y) -> _Tile
+        self._pending = set()
+        self._generation = 0  # bumped when rows change, renders of an older generation are dropped
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=TILE_WORKERS, thread_name_prefix="timeline-tile")
+        self.tile_rendered.connect(self._on_tile_rendered)
+        self.horizontalScrollBar().valueChanged.connect(self._on_scrolled)
+        self.verticalScrollBar().valueChanged.connect(self.viewport().update)
+        self.viewport().setMouseTracking(True)
+        self._update_scroll_ranges()
+
+    @property
+    def bucket_seconds(self) -> int:
+        return ZOOM_LEVELS[self.zoom][1]
+
+    def _pixels_per_bucket(self) -> float:
+        span, bucket_seconds = ZOOM_LEVELS[self.zoom]
+        return max(1, self.viewport().width() - LABEL_WIDTH) / (span / bucket_seconds)
+
+    def set_zoom(self, zoom: str) -> None:
+        """switches to another ZOOM_LEVELS entry, keeping the time at the right edge"""
+        right = self._right_edge_time()
+        self.zoom = zoom
+        self._update_scroll_ranges(right)
+        self.viewport().update()
+
+    def go_to_now(self) -> None:
+        self.follow_now = True
+        self._update_scroll_ranges()
+        self.viewport().update()
+
+    def reset_rows(self) -> None:
+        """picks up added or removed servers and drops every cached tile"""
+        self.names = self.names_source()
+        with self._lock:
+            self._generation += 1
+            self._tiles.clear()
+            self._pending.clear()
+        self._update_scroll_ranges(self._right_edge_time())
+        self.viewport().update()
+
+    def _right_edge_time(self) -> float:
+        bar = self.horizontalScrollBar()
+        visible = (self.viewport().width() - LABEL_WIDTH) / self._pixels_per_bucket()
+        return (bar.value() + visible) * self.bucket_seconds
+
+    def _update_scroll_ranges(self, right_edge: float = None) -> None:
+        """the horizontal scroll bar counts buckets since the epoch, from LOG_HISTORY_DAYS ago up to now"""
+        now = time.time()
+        visible = int((self.viewport().width() - LABEL_WIDTH) / self._pixels_per_bucket())
+        last = int(now // self.bucket_seconds) + 1 - visible
+        first = int((now - LOG_HISTORY_DAYS * 86400) // self.bucket_seconds)
+        bar = self.horizontalScrollBar()
+        bar.blockSignals(True)
+        bar.setRange(min(first, last), last)
+        bar.setPageStep(max(1, visible))
+        bar.setSingleStep(max(1, visible // 20))
+        if self.follow_now or right_edge is None:
+            bar.setValue(last)
+        else:
+            bar.setValue(int(right_edge // self.bucket_seconds) - visible)
+        bar.blockSignals(False)
+        rows = self.verticalScrollBar()
+        rows.setRange(0, max(0, len(self.names) * ROW_HEIGHT - self.viewport().height()))
+        rows.setPageStep(self.viewport().height())
+        rows.setSingleStep(ROW_HEIGHT * 3)
+
+    def _on_scrolled(self, value: int) -> None:
+        self.follow_now = value >= self.horizontalScrollBar().maximum()
+        self.viewport().update()
+
+    def advance(self) -> None:
+        """called periodically, moves the view along with the current time and redraws the tiles holding it"""
+        if self.follow_now:
+            self._update_scroll_ranges()
+        self.viewport().update()
+
+    def resizeEvent(self, event) -> None:
+        super().resizeEvent(event)
+        self._update_scroll_ranges(self._right_edge_time())
+
+    def _tile(self, key, now: float):
+        """the cached image of a tile, queueing a render if it is missing or out of date"""
+        bucket_seconds, tile_x, tile_y = key
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+            tile_end = (tile_x + 1) * TILE_COLUMNS * bucket_seconds
+            # a tile is final once it was drawn after its last bucket ended, until then it follows the clock
+            stale = tile is None or (tile.rendered_at < tile_end
+                                     and (tile.version != self.history.version
+                                          or now - tile.rendered_at >= bucket_seconds))
+            if stale and key not in self._pending:
+                self._pending.add(key)
+                names = self.names[tile_y * TILE_ROWS:(tile_y + 1) * TILE_ROWS]
+                self._executor.submit(self._render, key, names, now, self._generation)
+        return tile.image if tile is not None else None
+
+    def _render(self, key, names: List[str], now: float, generation: int) -> None:
+        version = self.history.version
+        started = time.perf_counter()
+        try:
+            image = render_tile(self.history, names, key[0], key[1], now)
+        except Exception as e:
+            print(f"timeline tile {key} failed: {e}")
+            image = None
+        self.instrumentation.observe("timeline_tile", time.perf_counter() - started)
+        self.tile_rendered.emit((key, generation), image, now, version)
+
+    def _on_tile_rendered(self, tagged, image, rendered_at: float, version: int) -> None:
+        key, generation = tagged
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._pending.discard(key)
+            if image is None:
+                return
+            self._tiles[key] = _Tile(image, rendered_at, version)
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > MAX_TILES:
+                self._tiles.popitem(last=False)
+        self.viewport().update()
+
+    def paintEvent(self, event) -> None:
+        with self.instrumentation.timer("timeline_paint"):
+            painter = QPainter(self.viewport())
+            painter.fillRect(self.viewport().rect(), GAP_COLOR)
+            self._paint_tiles(painter)
+            self._paint_labels(painter)
+            painter.end()
+
+    def _paint_tiles(self, painter: QPainter) -> None:
+        now = time.time()
+        bucket_seconds = self.bucket_seconds
+        scale = self._pixels_per_bucket()
+        first_bucket = self.horizontalScrollBar().value()
+        top = self.verticalScrollBar().value()
+        width = self.viewport().width() - LABEL_WIDTH
+        height = self.viewport().height()
+        tile_height = TILE_ROWS * ROW_HEIGHT
+        last_bucket = first_bucket + int(width / scale) + 1
+        painter.save()
+        painter.setClipRect(QRect(LABEL_WIDTH, 0, width, height))
+        for tile_y in range(top // tile_height, min((top + height) // tile_height, (len(self.names) - 1) // TILE_ROWS) + 1):
+            y = tile_y * tile_height - top
+            for tile_x in range(first_bucket // TILE_COLUMNS, last_bucket // TILE_COLUMNS + 1):
+                image = self._tile((bucket_seconds, tile_x, tile_y), now)
+                if image is None:
+                    continue
+                x = LABEL_WIDTH + (tile_x * TILE_COLUMNS - first_bucket) * scale
+                target = QRect(int(x), y, int(x + TILE_COLUMNS * scale) - int(x), tile_height)
+                painter.drawImage(target, image)
+        now_x = LABEL_WIDTH + (now / bucket_seconds - first_bucket) * scale
+        painter.setPen(NOW_COLOR)
+        painter.drawLine(int(now_x), 0, int(now_x), height)
+        painter.restore()
+
+    def _paint_labels(self, painter: QPainter) -> None:
+        top = self.verticalScrollBar().value()
+        painter.fillRect(0, 0, LABEL_WIDTH, self.viewport().height(), GAP_COLOR)
+        painter.setPen(LABEL_COLOR)
+        font = painter.font()
+        font.setPixelSize(ROW_HEIGHT + 1)
+        painter.setFont(font)
+        # a label every few rows keeps them legible, the tooltip names every row
+        step = 2
+        first = top // ROW_HEIGHT
+        last = min(len(self.names), (top + self.viewport().height()) // ROW_HEIGHT + 1)
+        for row in range(first - first % step, last, step):
+            y = row * ROW_HEIGHT - top
+            painter.drawText(QRect(4, y - 2, LABEL_WIDTH - 8, ROW_HEIGHT * step), Qt.AlignLeft | Qt.AlignTop,
+                             self.names[row].title())
+
+    def viewportEvent(self, event) -> bool:
+        if event.type() == QEvent.ToolTip:
+            self._show_tooltip(event)
+            return True
+        return super().viewportEvent(event)
+
+    def _show_tooltip(self, event) -> None:
+        """names the server and bucket under the cursor with its availability"""
+        position = event.pos()
+        row = (position.y() + self.verticalScrollBar().value()) // ROW_HEIGHT
+        if position.x() < LABEL_WIDTH or not 0 <= row < len(self.names):
+            QToolTip.hideText()
+            return
+        bucket = self.horizontalScrollBar().value() + int((position.x() - LABEL_WIDTH) / self._pixels_per_bucket())
+        start = bucket * self.bucket_seconds
+        fraction = self.history.up_fractions(self.names[row], start, self.bucket_seconds, 1)[0]
+        availability = "no data" if fraction < 0 else f"up {fraction * 100:.0f}%"
+        when = datetime.fromtimestamp(start).strftime("%Y-%m-%d %H:%M:%S")
+        QToolTip.showText(event.globalPos(), f"{self.names[row].title()}\n{when} (+{self.bucket_seconds}s)\n"
+                                             f"{availability}", self.viewport())
+
+    def stop(self) -> None:
+        self._executor.shutdown(wait=False)